@@ -313,10 +313,12 @@ async def get_public_welfare_flow(
 async def get_public_welfare_report(
         start_date: str = Query(..., description="开始日期 yyyy-MM-dd"),
         end_date: str = Query(..., description="结束日期 yyyy-MM-dd"),
+        page: int = Query(1, ge=1, description="页码"),
+        page_size: int = Query(20, ge=1, le=100, description="每页条数"),
         service: FinanceService = Depends(get_finance_service)
 ):
     try:
-        report_data = service.get_public_welfare_report(start_date, end_date)
+        report_data = service.get_public_welfare_report(start_date, end_date, page, page_size)
 
         def get_user_name(uid):
             if not uid:
@@ -349,7 +351,7 @@ async def get_public_welfare_report(
         return ResponseModel(
             success=True,
             message="查询成功",
-            data={"summary": report_data['summary'], "details": details}
+            data={"summary": report_data['summary'], "pagination": report_data['pagination'], "details": details}
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -519,10 +521,11 @@ async def get_points_deduction_report(
         end_date: str = Query(..., description="结束日期 yyyy-MM-dd"),
         page: int = Query(1, ge=1),
         page_size: int = Query(20, ge=1, le=100),
+        include_total: bool = Query(True, description="是否返回总数与汇总；加载更多式分页可传 false 跳过统计"),
         service: FinanceService = Depends(get_finance_service)
 ):
     try:
-        data = service.get_points_deduction_report(start_date, end_date, page, page_size)
+        data = service.get_points_deduction_report(start_date, end_date, page, page_size, include_total)
         return ResponseModel(success=True, message="查询成功", data=data)
     except Exception as e:
         logger.error(f"查询积分抵扣报表失败: {e}")
@@ -605,14 +608,9 @@ async def get_pool_allocations(
     """获取当前资金池分配配置"""
     try:
         allocs = service.get_pool_allocations()
-        # 同时查询每个资金池的当前余额，并构建返回结构
-        data = {}
-        for k, v in allocs.items():
-            try:
-                balance = service.get_account_balance(k)
-            except Exception:
-                balance = None
-            data[k] = {"allocation": str(v), "balance": float(balance) if balance is not None else None}
+        # 同时查询每个资金池的当前余额（一次查询），并构建返回结构
+        balances = service.get_account_balances(list(allocs))
+        data = {k: {"allocation": str(v), "balance": float(balances[k])} for k, v in allocs.items()}
         return ResponseModel(success=True, message="ok", data=data)
     except Exception as e:
         logger.error(f"获取资金池配置失败: {e}", exc_info=True)
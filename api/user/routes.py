@@ -13,9 +13,9 @@ from models.schemas.user import (
 from core.config import WECHAT_APP_ID, WECHAT_APP_SECRET
 from core.database import get_conn
 from core.logging import get_logger
-from core.table_access import build_dynamic_select, get_table_structure, _quote_identifier
+from core.table_access import build_dynamic_select, get_table_structure, clear_table_cache, _quote_identifier
 from core.auth import create_access_token  # ✅ 新增：导入 Token 创建函数
-from services.user_service import UserService, UserStatus, verify_pwd, hash_pwd
+from services.user_service import UserService, UserStatus, verify_pwd, hash_pwd, rehash_pwd_if_needed
 from services.address_service import AddressService
 from services.points_service import add_points
 from services.reward_service import TeamRewardService
@@ -54,6 +54,7 @@ def set_user_status(body: SetStatusReq):
                 cur.execute(
                     "ALTER TABLE users ADD COLUMN status TINYINT NOT NULL DEFAULT 0 COMMENT '0-正常 1-冻结 2-注销'"
                 )
+                clear_table_cache("users")
                 conn.commit()
 
             # 2. 校验用户是否存在
@@ -117,48 +118,50 @@ def user_auth(body: AuthReq):
             cur.execute(select_sql, (body.mobile,))
             row = cur.fetchone()
 
-            is_new_user = False
+    # 密码校验/注册中的 bcrypt 计算放在连接归还之后，避免长时间占用连接池
+    is_new_user = False
+
+    if row:
+        # 已有用户：验证密码
+        if not verify_pwd(body.password, row["password_hash"]):
+            raise HTTPException(status_code=400, detail="手机号或密码错误")
+
+        status = row["status"]
+        if status == UserStatus.FROZEN:
+            raise HTTPException(status_code=403, detail="账号已冻结")
+        if status == UserStatus.DELETED:
+            raise HTTPException(status_code=403, detail="账号已注销")
+
+        rehash_pwd_if_needed(row["id"], body.password, row["password_hash"])
+        user_id = row["id"]
+        level = row["member_level"]
+        name = row["name"]
+    else:
+        # 新用户：自动注册
+        try:
+            user_id = UserService.register(
+                mobile=body.mobile,
+                pwd=body.password,
+                name=body.name,
+                referrer_mobile=None
+            )
+            level = 0
+            is_new_user = True
+            name = body.name
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-            if row:
-                # 已有用户：验证密码
-                if not verify_pwd(body.password, row["password_hash"]):
-                    raise HTTPException(status_code=400, detail="手机号或密码错误")
+    # ✅ 关键修复：创建并持久化 Token（保存到 sessions 表或 users.token 字段）
+    token = create_access_token(user_id, token_type="uuid")
 
-                status = row["status"]
-                if status == UserStatus.FROZEN:
-                    raise HTTPException(status_code=403, detail="账号已冻结")
-                if status == UserStatus.DELETED:
-                    raise HTTPException(status_code=403, detail="账号已注销")
+    logger.info(f"用户认证成功 - ID: {user_id}, 手机: {body.mobile}, Token: {token[:8]}...")
 
-                user_id = row["id"]
-                level = row["member_level"]
-                name = row["name"]
-            else:
-                # 新用户：自动注册
-                try:
-                    user_id = UserService.register(
-                        mobile=body.mobile,
-                        pwd=body.password,
-                        name=body.name,
-                        referrer_mobile=None
-                    )
-                    level = 0
-                    is_new_user = True
-                    name = body.name
-                except ValueError as e:
-                    raise HTTPException(status_code=400, detail=str(e))
-
-            # ✅ 关键修复：创建并持久化 Token（保存到 sessions 表或 users.token 字段）
-            token = create_access_token(user_id, token_type="uuid")
-
-            logger.info(f"用户认证成功 - ID: {user_id}, 手机: {body.mobile}, Token: {token[:8]}...")
-
-            return AuthResp(
-                uid=user_id,
-                token=token,
-                level=level,
-                is_new=is_new_user
-            )
+    return AuthResp(
+        uid=user_id,
+        token=token,
+        level=level,
+        is_new=is_new_user
+    )
 
 @router.post("/user/update-profile", summary="修改资料（动态字段/兼容老库）")
 def update_profile(body: UpdateProfileReq):
@@ -219,6 +222,7 @@ def self_delete(body: SelfDeleteReq):
                 cur.execute(
                     "ALTER TABLE users ADD COLUMN status TINYINT NOT NULL DEFAULT 0 COMMENT '0-正常 1-冻结 2-注销'"
                 )
+                clear_table_cache("users")
                 conn.commit()
 
             # 2. 取用户 id & 密码哈希
@@ -374,6 +378,7 @@ def upgrade(mobile: str):
                 cur.execute(
                     "ALTER TABLE users ADD COLUMN member_level TINYINT NOT NULL DEFAULT 0 COMMENT '0-6 星'"
                 )
+                clear_table_cache("users")
                 conn.commit()
 
             # 2. 取当前星级
@@ -428,6 +433,7 @@ def set_level(body: SetLevelReq):
                 cur.execute(
                     "ALTER TABLE users ADD COLUMN member_level TINYINT NOT NULL DEFAULT 0 COMMENT '0-6 星'"
                 )
+                clear_table_cache("users")
                 conn.commit()
 
             # 2. 取当前星级
@@ -683,6 +689,7 @@ def bind_referrer(body: BindReferrerReq):
                 cur.execute(
                     "ALTER TABLE users ADD COLUMN referral_id INT DEFAULT NULL COMMENT '推荐人ID'"
                 )
+                clear_table_cache("users")
 
             cur.execute("UPDATE users SET referral_id=%s WHERE id=%s", (referrer_id, user_id))
             conn.commit()
@@ -1220,6 +1227,7 @@ def grant_merchant(mobile: str, admin_key: str):
                 cur.execute(
                     "ALTER TABLE users ADD COLUMN is_merchant TINYINT(1) NOT NULL DEFAULT 0 COMMENT '0-普通用户 1-商户'"
                 )
+                clear_table_cache("users")
                 conn.commit()          # 提交 DDL
 
             # 3. 执行更新
@@ -1251,17 +1259,7 @@ def is_merchant(mobile: str):
 @router.post("/wechat/login", summary="微信小程序登录")
 async def wechat_login(request: Request):
     """微信小程序登录接口 - 使用124位专用Token"""
-    # 确保 users 表存在 openid 字段（兼容旧库）
-    try:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SET FOREIGN_KEY_CHECKS = 0")  #-- ✅ 临时禁用外键
-                WechatService.ensure_openid_column()
-                cur.execute("SET FOREIGN_KEY_CHECKS = 1")  #-- ✅ 恢复外键检查
-                conn.commit()
-    except Exception as e:
-        logger.warning(f"确保openid字段时出错: {e}")  #-- 非致命错误，继续执行
-
+    # users.openid 字段由启动时 database_setup 的 required_columns 保证存在
     try:
         data = await request.json()
     except Exception:
@@ -1278,7 +1276,7 @@ async def wechat_login(request: Request):
 
     try:
         # 调用微信接口，通过 code 换取 openid（及服务端用的 session_key，可选 unionid）
-        result = WechatService.get_openid_by_code(code)
+        result = await WechatService.get_openid_by_code(code)
         # session_key 仅用于服务端解密等场景，禁止写入响应或日志（微信安全规范）
         if isinstance(result, (list, tuple)):
             if len(result) >= 2:
@@ -1290,19 +1288,8 @@ async def wechat_login(request: Request):
             openid = result
             unionid = ""
 
-        # 检查用户是否已注册
-        user = WechatService.check_user_by_openid(openid)
-        is_new_user = False
-
-        if not user:
-            # 注册新用户
-            user_id = WechatService.register_user(openid, nick_name)
-            level = 0
-            is_new_user = True
-        else:
-            user_id = user['id']
-            level = user.get('member_level', 0)
-            is_new_user = False
+        # 按 openid 取用户，未注册则自动注册
+        user_id, level, is_new_user = WechatService.get_or_create_user(openid, nick_name)
 
         # ✅ 关键修改：使用微信专用Token类型，生成124位Token
         token = create_access_token(user_id, token_type="wechat")
@@ -1674,7 +1661,7 @@ def refresh_referral_qr(user_id: int):
 
 
 @router.post("/user/decrypt-phone", tags=["用户中心"], response_model=DecryptPhoneResp, summary="解密微信手机号")
-def decrypt_phone(req: DecryptPhoneReq):
+async def decrypt_phone(req: DecryptPhoneReq):
     """
     解密微信手机号（核心接口）
     这个是旧版本的新版的在👇的👇
@@ -1685,7 +1672,7 @@ def decrypt_phone(req: DecryptPhoneReq):
     """
     try:
         # 1. code 换 session_key
-        openid, session_key = WechatService.get_openid_by_code(req.code)
+        openid, session_key = await WechatService.get_openid_by_code(req.code)
 
         # 2. 解密手机号
         phone = WechatService.decrypt_phone_number(
@@ -31,6 +31,19 @@ JWT_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", "10080"))  # 默认7天
 # 认证模式开关
 ENABLE_UUID_AUTH = os.getenv("ENABLE_UUID_AUTH", "1") == "1"  # 默认开启UUID模式
 
+# sessions 表一旦确认存在即缓存（运行期不会被删除），之后每次认证/发 token 不再 SHOW TABLES；
+# 不存在时不缓存，以便建表后无需重启即可切换
+_sessions_table_exists = False
+
+
+def _has_sessions_table(cur) -> bool:
+    """sessions 表是否存在（存在结果进程内缓存）"""
+    global _sessions_table_exists
+    if not _sessions_table_exists:
+        cur.execute("SHOW TABLES LIKE 'sessions'")
+        _sessions_table_exists = cur.fetchone() is not None
+    return _sessions_table_exists
+
 
 # ========================================
 # 主认证函数 - 修复版
@@ -112,8 +125,7 @@ async def _get_user_from_wechat_token(token: str) -> Dict[str, Any]:
         with get_conn() as conn:
             with conn.cursor() as cur:
                 # 检查 sessions 表是否存在
-                cur.execute("SHOW TABLES LIKE 'sessions'")
-                has_sessions = cur.fetchone() is not None
+                has_sessions = _has_sessions_table(cur)
 
                 if has_sessions:
                     # 使用 sessions 表（推荐方式）
@@ -270,8 +282,7 @@ async def _get_user_from_uuid(token: str) -> Dict[str, Any]:
         with get_conn() as conn:
             with conn.cursor() as cur:
                 # 检查 sessions 表是否存在
-                cur.execute("SHOW TABLES LIKE 'sessions'")
-                has_sessions = cur.fetchone() is not None
+                has_sessions = _has_sessions_table(cur)
 
                 if has_sessions:
                     # 使用 sessions 表（推荐方式）
@@ -385,8 +396,7 @@ def _create_uuid_token(user_id: int) -> str:
         with get_conn() as conn:
             with conn.cursor() as cur:
                 # 检查 sessions 表是否存在
-                cur.execute("SHOW TABLES LIKE 'sessions'")
-                has_sessions = cur.fetchone() is not None
+                has_sessions = _has_sessions_table(cur)
 
                 if has_sessions:
                     # 使用 sessions 表（推荐方式）
@@ -422,8 +432,7 @@ def _create_wechat_token(user_id: int) -> str:
         with get_conn() as conn:
             with conn.cursor() as cur:
                 # 检查 sessions 表是否存在
-                cur.execute("SHOW TABLES LIKE 'sessions'")
-                if cur.fetchone():
+                if _has_sessions_table(cur):
                     # 使用 sessions 表
                     cur.execute("""
                         INSERT INTO sessions (user_id, token, created_at, expired_at)
@@ -474,8 +483,7 @@ def invalidate_token(token: str) -> bool:
         with get_conn() as conn:
             with conn.cursor() as cur:
                 # 检查 sessions 表
-                cur.execute("SHOW TABLES LIKE 'sessions'")
-                if cur.fetchone():
+                if _has_sessions_table(cur):
                     # 删除 sessions 记录
                     cur.execute("DELETE FROM sessions WHERE token = %s", (token,))
                 else:
@@ -26,6 +26,8 @@ class Settings(BaseSettings):
     JWT_SECRET_KEY: SecretStr
     JWT_ALGORITHM: str = "HS256"
     JWT_EXPIRE_MINUTES: int = 1440
+    # 密码哈希 bcrypt 成本因子（2^N 轮）；调整后旧哈希会在用户下次登录时自动按新成本重算
+    BCRYPT_ROUNDS: int = 10
 
     ENABLE_UUID_AUTH: int = 0
 
@@ -46,6 +48,10 @@ class Settings(BaseSettings):
     MYSQL_USER: str
     MYSQL_PASSWORD: str
     MYSQL_DATABASE: str
+    # 连接池中保留的空闲连接上限（超出部分归还时直接关闭）
+    MYSQL_POOL_MAX_IDLE: int = 20
+    # 会话事务隔离级别（新建连接时设置）；留空则沿用服务端默认（REPEATABLE READ）
+    MYSQL_ISOLATION_LEVEL: str = "READ COMMITTED"
 
     # 微信/支付相关
     WECHAT_APP_ID: str = ""
@@ -119,6 +125,7 @@ settings = Settings()
 JWT_SECRET_KEY: Final[str] = settings.JWT_SECRET_KEY.get_secret_value()
 JWT_ALGORITHM: Final[str] = settings.JWT_ALGORITHM
 JWT_EXPIRE_MINUTES: Final[int] = settings.JWT_EXPIRE_MINUTES
+BCRYPT_ROUNDS: Final[int] = settings.BCRYPT_ROUNDS
 
 # 双认证开关
 ENABLE_UUID_AUTH: Final[int] = settings.ENABLE_UUID_AUTH
@@ -129,6 +136,9 @@ DRAFT_EXPIRE_DAYS: int = settings.DRAFT_EXPIRE_DAYS
 MAX_FILE_SIZE_MB: int = settings.MAX_FILE_SIZE_MB
 
 # ==================== 数据库配置 ====================
+MYSQL_POOL_MAX_IDLE: int = settings.MYSQL_POOL_MAX_IDLE
+MYSQL_ISOLATION_LEVEL: str = settings.MYSQL_ISOLATION_LEVEL
+
 def get_db_config():
     """获取数据库配置字典"""
     cfg = {
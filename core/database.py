@@ -1,15 +1,42 @@
 """
 统一的数据库连接管理模块
 使用 pymysql 作为统一的数据库连接方式
+
+连接默认使用 READ COMMITTED 隔离级别（见 MYSQL_ISOLATION_LEVEL）：资金写入均按主键/唯一键定位，
+并通过 SELECT ... FOR UPDATE 或条件 UPDATE 保证正确性，不依赖 REPEATABLE READ 的快照与间隙锁。
 """
+import logging
+import queue
 import pymysql
+from pymysql import converters
+from pymysql.constants import FIELD_TYPE
 from contextlib import contextmanager
 from typing import Optional
-from core.config import get_db_config
+from core.config import get_db_config, MYSQL_POOL_MAX_IDLE, MYSQL_ISOLATION_LEVEL
+
+logger = logging.getLogger(__name__)
 
 # 全局连接配置缓存
 _db_config = None
 
+# 空闲连接池：归还的连接在此复用，省去每次请求的 TCP 建连与认证开销
+_idle_conns: "queue.LifoQueue[pymysql.connections.Connection]" = queue.LifoQueue(maxsize=MYSQL_POOL_MAX_IDLE)
+
+# 新建连接时执行的会话初始化语句（隔离级别只接受白名单取值，避免配置拼接进 SQL）
+_ISOLATION_LEVELS = {"READ UNCOMMITTED", "READ COMMITTED", "REPEATABLE READ", "SERIALIZABLE"}
+_isolation_level = " ".join(MYSQL_ISOLATION_LEVEL.upper().split())
+if _isolation_level and _isolation_level not in _ISOLATION_LEVELS:
+    raise RuntimeError(f"无效的 MYSQL_ISOLATION_LEVEL: {MYSQL_ISOLATION_LEVEL}")
+_INIT_COMMAND = f"SET SESSION TRANSACTION ISOLATION LEVEL {_isolation_level}" if _isolation_level else None
+
+# 只读展示接口使用的类型转换表：DECIMAL 列由驱动直接解码为 float，跳过中间的 Decimal 对象
+# 涉及金额计算/写入的路径仍使用默认转换（Decimal），保证精度
+FLOAT_DECIMAL_CONV = {
+    **converters.conversions,
+    FIELD_TYPE.DECIMAL: float,
+    FIELD_TYPE.NEWDECIMAL: float,
+}
+
 
 def get_db_config_cached():
     """获取缓存的数据库配置"""
@@ -20,18 +47,40 @@ def get_db_config_cached():
 
 
 @contextmanager
-def get_conn():
+def get_conn(conv: Optional[dict] = None):
     """
     获取数据库连接的上下文管理器（统一入口）
     
+    连接优先从空闲连接池复用，退出时回滚未提交事务并归还连接池（池满则关闭）。
+    
+    Args:
+        conv: 可选的类型转换表（如 FLOAT_DECIMAL_CONV），为 None 时使用驱动默认转换
+    
     使用示例:
         with get_conn() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT * FROM users WHERE id = %s", (user_id,))
                 result = cur.fetchone()
     """
+    # 自定义类型转换的连接不进入连接池，避免影响其他调用方的解码结果
+    pooled = conv is None
+    conn = _acquire_conn() if pooled else _connect(conv)
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if pooled:
+            _release_conn(conn)
+        else:
+            conn.close()
+
+
+def _connect(conv: Optional[dict] = None):
+    """新建一个数据库连接"""
     cfg = get_db_config_cached()
-    conn = pymysql.connect(
+    return pymysql.connect(
         host=cfg['host'],
         port=cfg['port'],
         user=cfg['user'],
@@ -39,15 +88,45 @@ def get_conn():
         database=cfg['database'],
         charset=cfg['charset'],
         cursorclass=pymysql.cursors.DictCursor,
-        autocommit=False  # 统一使用事务管理
+        autocommit=False,  # 统一使用事务管理
+        init_command=_INIT_COMMAND,
+        conv=conv
     )
+
+
+def _acquire_conn():
+    """从连接池取出一个可用连接；池为空时新建"""
+    while True:
+        try:
+            conn = _idle_conns.get_nowait()
+        except queue.Empty:
+            return _connect()
+        try:
+            # 空闲期间连接可能已被服务端断开，ping 失败则丢弃换下一个
+            conn.ping(reconnect=False)
+            return conn
+        except Exception:
+            _close_quietly(conn)
+
+
+def _release_conn(conn):
+    """归还连接：回滚未提交的事务后放回连接池，池满或连接已关闭则直接关闭"""
+    if not conn.open:
+        # 调用方（如 PyMySQLAdapter.close）已自行关闭连接
+        return
     try:
-        yield conn
-    except Exception:
         conn.rollback()
-        raise
-    finally:
+        _idle_conns.put_nowait(conn)
+    except Exception as e:
+        logger.debug("discarding connection instead of pooling it: %s", e)
+        _close_quietly(conn)
+
+
+def _close_quietly(conn):
+    try:
         conn.close()
+    except Exception:
+        pass
 
 
 @contextmanager
@@ -4,6 +4,7 @@
 """
 from contextlib import contextmanager
 import logging
+import re
 from typing import Optional, Any, Dict, List
 from core.database import get_conn
 import pymysql
@@ -17,15 +18,21 @@ class PyMySQLAdapter:
     """
     
     def __init__(self):
+        self._conn_cm = None
         self._conn = None
         self._cursor = None
+
+    def _open(self):
+        """从 get_conn() 取得连接；持有其上下文管理器，直到 close() 时归还连接池"""
+        self._conn_cm = get_conn()
+        self._conn = self._conn_cm.__enter__()
+        self._cursor = self._conn.cursor()
     
     @contextmanager
     def begin(self):
         """开始事务（上下文管理器）"""
         if self._conn is None:
-            self._conn = get_conn().__enter__()
-            self._cursor = self._conn.cursor()
+            self._open()
         try:
             yield self
             self._conn.commit()
@@ -34,26 +41,27 @@ class PyMySQLAdapter:
                 self._conn.rollback()
             raise
     
-    def execute(self, sql: str, params: Optional[Dict[str, Any]] = None):
+    def execute(self, sql: str, params: Optional[Any] = None):
         """
         执行 SQL 语句
         
         Args:
             sql: SQL 语句（支持 :param 格式，会自动转换为 %s）
-            params: 参数字典
+            params: 参数字典（配合 :param 格式），或与 %s 占位符按位置对应的元组/列表
         
         Returns:
             ResultProxy 对象，用于访问查询结果
         """
         if self._conn is None:
-            self._conn = get_conn().__enter__()
-            self._cursor = self._conn.cursor()
+            self._open()
         
         # 简单校验 SQL，拒绝包含多语句或注释的输入
         self._validate_sql(sql)
 
-        # 将 :param 格式转换为 %s 格式
-        if params:
+        # 元组/列表按位置直接绑定 %s；字典则将 :param 格式转换为 %s 格式
+        if isinstance(params, (tuple, list)):
+            values = tuple(params)
+        elif params:
             sql, values = self._convert_sql_params(sql, params)
         else:
             values = None
@@ -68,8 +76,7 @@ class PyMySQLAdapter:
             try:
                 # 关闭已有资源并重建
                 self.close()
-                self._conn = get_conn().__enter__()
-                self._cursor = self._conn.cursor()
+                self._open()
                 logger.debug("Retrying SQL after reconnect: %s | params: %s", sql, values)
                 self._cursor.execute(sql, values)
             except Exception as e2:
@@ -201,13 +208,19 @@ class PyMySQLAdapter:
                 i += 1
     
     def _convert_sql_params(self, sql: str, params: Dict[str, Any]) -> tuple:
-        """将命名参数格式 `:param` 转换为 PyMySQL 的 `%s` 格式，并返回转换后的 SQL 和参数元组"""
-        result_sql = sql
+        """将命名参数格式 `:param` 转换为 PyMySQL 的 `%s` 格式，并返回转换后的 SQL 和参数元组
+
+        参数值按占位符在 SQL 中出现的顺序排列（与字典键顺序无关），同一参数可多次引用。
+        """
+        names = sorted(params, key=len, reverse=True)
+        pattern = re.compile(r":(" + "|".join(re.escape(name) for name in names) + r")\b")
         param_list = []
-        # 按顺序替换参数
-        for key, value in params.items():
-            result_sql = result_sql.replace(f":{key}", "%s", 1)  # 只替换第一个
-            param_list.append(value)
+
+        def _replace(match):
+            param_list.append(params[match.group(1)])
+            return "%s"
+
+        result_sql = pattern.sub(_replace, sql)
         return result_sql, tuple(param_list)
     
     def commit(self):
@@ -221,7 +234,7 @@ class PyMySQLAdapter:
             self._conn.rollback()
     
     def close(self):
-        """关闭连接"""
+        """释放连接（归还连接池）"""
         logger = logging.getLogger(__name__)
         if self._cursor:
             try:
@@ -230,11 +243,16 @@ class PyMySQLAdapter:
                 logger.debug("ignoring cursor.close() error: %s", e)
         if self._conn:
             try:
-                self._conn.close()
+                if self._conn_cm is not None:
+                    # 退出 get_conn() 上下文：未提交的事务被回滚，连接归还连接池
+                    self._conn_cm.__exit__(None, None, None)
+                else:
+                    self._conn.close()
             except Exception as e:
                 # pymysql may raise Error("Already closed") if connection was closed
                 logger.debug("ignoring conn.close() error: %s", e)
             finally:
+                self._conn_cm = None
                 self._conn = None
                 self._cursor = None
     
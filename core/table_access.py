@@ -10,6 +10,15 @@ import re
 # 缓存表结构信息，避免重复查询
 _table_structure_cache: Dict[str, Dict[str, any]] = {}
 
+# 缓存 build_dynamic_select 生成的 SQL：键为 (表名, where, order_by, 字段元组)。
+# 带 limit 的语句不缓存（分页偏移量来自请求参数，取值无界）；条目数设上限，满了不再新增
+_select_sql_cache: Dict[tuple, str] = {}
+_SELECT_SQL_CACHE_MAX = 512
+
+# 数值列类型（*INT 已覆盖 BIGINT/TINYINT/SMALLINT/MEDIUMINT）与资产字段名关键字，模块加载时编译一次
+_NUMERIC_TYPE_RE = re.compile(r"DECIMAL|NUMERIC|FLOAT|DOUBLE|INT")
+_ASSET_NAME_RE = re.compile(r"points|balance|amount", re.I)
+
 
 def get_table_structure(cursor, table_name: str, use_cache: bool = True) -> Dict[str, any]:
     """
@@ -35,8 +44,44 @@ def get_table_structure(cursor, table_name: str, use_cache: bool = True) -> Dict
     
     # 查询表结构
     cursor.execute(f"SHOW COLUMNS FROM {table_name}")
-    columns = cursor.fetchall()
+    result = _build_structure(cursor.fetchall())
+    
+    # 缓存结果
+    if use_cache:
+        _table_structure_cache[cache_key] = result
     
+    return result
+
+
+def preload_table_structures(cursor, table_names: List[str]) -> None:
+    """
+    一次查询 information_schema 预加载多张表的结构到缓存，代替逐表 SHOW COLUMNS
+
+    Args:
+        cursor: 数据库游标（DictCursor）
+        table_names: 表名列表；当前库中不存在的表直接忽略
+    """
+    if not table_names:
+        return
+    placeholders = ", ".join(["%s"] * len(table_names))
+    cursor.execute(
+        f"""SELECT TABLE_NAME AS `Table`, COLUMN_NAME AS `Field`, COLUMN_TYPE AS `Type`
+            FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({placeholders})
+            ORDER BY TABLE_NAME, ORDINAL_POSITION""",
+        tuple(table_names)
+    )
+    columns_by_table: Dict[str, List[Dict[str, Any]]] = {}
+    for col in cursor.fetchall():
+        columns_by_table.setdefault(col['Table'], []).append(col)
+    for table_name, columns in columns_by_table.items():
+        _table_structure_cache[table_name] = _build_structure(columns)
+        for key in [k for k in _select_sql_cache if k[0] == table_name]:
+            _select_sql_cache.pop(key, None)
+
+
+def _build_structure(columns) -> Dict[str, any]:
+    """由列信息（含 Field/Type 键）构造 get_table_structure 返回的结构字典"""
     fields = []
     asset_fields = []
     field_types = {}
@@ -49,20 +94,14 @@ def get_table_structure(cursor, table_name: str, use_cache: bool = True) -> Dict
         field_types[field_name] = field_type
         
         # 判断是否为资产字段（数值类型）
-        if any(num_type in field_type for num_type in ['DECIMAL', 'NUMERIC', 'FLOAT', 'DOUBLE', 'INT', 'BIGINT', 'TINYINT', 'SMALLINT', 'MEDIUMINT']):
+        if _NUMERIC_TYPE_RE.search(field_type):
             asset_fields.append(field_name)
     
-    result = {
+    return {
         'fields': fields,
         'asset_fields': asset_fields,
         'field_types': field_types
     }
-    
-    # 缓存结果
-    if use_cache:
-        _table_structure_cache[cache_key] = result
-    
-    return result
 
 
 _IDENT_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
@@ -147,7 +186,7 @@ def build_select_sql(table_name: str, structure: Dict[str, any],
         # 对字段名进行白名单校验与引用，防止注入
         if field not in existing_fields:
             # 字段不存在，使用默认值并引用别名
-            if field in asset_fields or any(num_type in field.lower() for num_type in ['points', 'balance', 'amount']):
+            if field in asset_fields or _ASSET_NAME_RE.search(field):
                 select_parts.append(f"0 AS {_quote_identifier(field)}")
             else:
                 select_parts.append(f"NULL AS {_quote_identifier(field)}")
@@ -201,8 +240,17 @@ def build_dynamic_select(cursor, table_name: str,
     Returns:
         构造的 SQL 语句
     """
-    structure = get_table_structure(cursor, table_name)
-    return build_select_sql(table_name, structure, where_clause, order_by, limit, select_fields)
+    if limit:
+        structure = get_table_structure(cursor, table_name)
+        return build_select_sql(table_name, structure, where_clause, order_by, limit, select_fields)
+    cache_key = (table_name, where_clause, order_by, tuple(select_fields) if select_fields else None)
+    sql = _select_sql_cache.get(cache_key)
+    if sql is None:
+        structure = get_table_structure(cursor, table_name)
+        sql = build_select_sql(table_name, structure, where_clause, order_by, limit, select_fields)
+        if len(_select_sql_cache) < _SELECT_SQL_CACHE_MAX:
+            _select_sql_cache[cache_key] = sql
+    return sql
 
 
 def clear_table_cache(table_name: Optional[str] = None):
@@ -215,8 +263,11 @@ def clear_table_cache(table_name: Optional[str] = None):
     global _table_structure_cache
     if table_name:
         _table_structure_cache.pop(table_name, None)
+        for key in [k for k in _select_sql_cache if k[0] == table_name]:
+            _select_sql_cache.pop(key, None)
     else:
         _table_structure_cache.clear()
+        _select_sql_cache.clear()
 
 
 # ===== 新增缺失的函数 =====
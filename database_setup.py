@@ -5,6 +5,7 @@
 import pymysql
 from core.config import get_db_config
 from core.logging import get_logger
+from core.table_access import clear_table_cache
 import json
 
 # 使用统一的日志配置
@@ -52,6 +53,7 @@ class DatabaseManager:
                 if column_name not in existing_columns:
                     try:
                         cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_def}")
+                        clear_table_cache(table_name)
                         logger.info(f"✅ 已添加字段 {table_name}.{column_name}")
                     except Exception as e:
                         logger.warning(f"⚠️ 添加字段 {table_name}.{column_name} 失败: {e}")
@@ -59,6 +61,41 @@ class DatabaseManager:
             # 如果表不存在，会在创建表时处理
             logger.debug(f"表 {table_name} 可能不存在，将在创建表时处理: {e}")
 
+    def _ensure_table_indexes(self, cursor, table_name: str, required_indexes: dict):
+        """
+        确保表的必需索引存在，如果不存在则创建
+
+        Args:
+            cursor: 数据库游标
+            table_name: 表名
+            required_indexes: 必需索引字典，格式为 {索引名: 索引字段列表定义}
+        """
+        try:
+            cursor.execute(f"SHOW INDEX FROM {table_name}")
+            index_rows = cursor.fetchall()
+            existing_indexes = {row['Key_name'] for row in index_rows}
+            # 已有唯一索引的字段组合（旧库可能以其他名字建过同列唯一索引，避免重复创建）
+            unique_columns: dict = {}
+            for row in index_rows:
+                if not row['Non_unique']:
+                    unique_columns.setdefault(row['Key_name'], []).append(row['Column_name'])
+            existing_unique = {", ".join(cols) for cols in unique_columns.values()}
+
+            for index_name, index_columns in required_indexes.items():
+                # 以 "UNIQUE " 开头的定义建唯一索引
+                unique = index_columns.startswith("UNIQUE ")
+                columns = index_columns[len("UNIQUE "):] if unique else index_columns
+                if index_name in existing_indexes or (unique and columns in existing_unique):
+                    continue
+                try:
+                    cursor.execute(
+                        f"CREATE {'UNIQUE ' if unique else ''}INDEX {index_name} ON {table_name} ({columns})")
+                    logger.info(f"✅ 已创建索引 {table_name}.{index_name}")
+                except Exception as e:
+                    logger.warning(f"⚠️ 创建索引 {table_name}.{index_name} 失败: {e}")
+        except Exception as e:
+            logger.debug(f"表 {table_name} 可能不存在，跳过索引检查: {e}")
+
     def init_all_tables(self, cursor):
         logger.info("初始化数据库表结构")
 
@@ -103,6 +140,7 @@ class DatabaseManager:
                     INDEX idx_member_level (member_level),
                     INDEX idx_wechat_sub_mchid (wechat_sub_mchid),
                     UNIQUE KEY uk_referral_code (referral_code),
+                    UNIQUE KEY uk_openid (openid),
                     INDEX idx_token (token)
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
             """,
@@ -294,10 +332,16 @@ class DatabaseManager:
                     balance_after DECIMAL(14,4),
                     flow_type VARCHAR(50),
                     remark VARCHAR(255),
+                    related_order BIGINT UNSIGNED NULL COMMENT '关联订单ID（奖励流水防重复发放查询）',
+                    order_number VARCHAR(64) NULL COMMENT '关联订单号（订单分账/退款回冲查询）',
                     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                     INDEX idx_account (account_id),
                     INDEX idx_related_user (related_user),
-                    INDEX idx_created_at (created_at)
+                    INDEX idx_created_at (created_at),
+                    INDEX idx_account_type_created (account_type, created_at),
+                    INDEX idx_related_order (related_order, account_type),
+                    INDEX idx_order_number (order_number),
+                    INDEX idx_af_type_flow_time (account_type, flow_type, created_at, change_amount)
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
             """,
             'points_log': """
@@ -848,6 +892,8 @@ class DatabaseManager:
                 'wechat_sub_mchid': 'wechat_sub_mchid VARCHAR(32) NULL DEFAULT NULL COMMENT \'微信特约商户号\'',
                 'has_store_permission': 'has_store_permission TINYINT(1) NOT NULL DEFAULT 0 COMMENT \'是否开通开店权限（支付进件成功后置为1）\'',
                 'wx_openid': "wx_openid VARCHAR(100) UNIQUE DEFAULT NULL COMMENT '微信openid'",
+                'openid': "openid VARCHAR(128) NULL DEFAULT NULL COMMENT '微信小程序openid'",
+                'referral_id': "referral_id BIGINT UNSIGNED NULL COMMENT '推荐人id'",
                 'phone': "phone VARCHAR(20) DEFAULT NULL COMMENT '手机号'",
             },
             'orders': {
@@ -882,6 +928,10 @@ class DatabaseManager:
             'finance_accounts': {
                 'config_params': "config_params JSON DEFAULT NULL COMMENT '资金池配置参数（如：fixed_amount_per_weight）'"
             },
+            'account_flow': {
+                'related_order': "related_order BIGINT UNSIGNED NULL COMMENT '关联订单ID（奖励流水防重复发放查询）'",
+                'order_number': "order_number VARCHAR(64) NULL COMMENT '关联订单号（订单分账/退款回冲查询）'",
+            },
             'merchant_settlement_accounts': {
                 # ✅ 新增改绑相关字段
                 'new_account_number_encrypted': "new_account_number_encrypted TEXT NULL COMMENT '改绑-新卡号(加密)'",
@@ -927,6 +977,20 @@ class DatabaseManager:
             },
         }
 
+        # 定义必需索引（用于给已存在的表补建索引）
+        required_indexes = {
+            'users': {
+                # 微信登录按 openid 查找/注册，唯一索引保证并发回调不会重复建号
+                'uk_openid': 'UNIQUE openid',
+            },
+            'account_flow': {
+                'idx_account_type_created': 'account_type, created_at',
+                'idx_related_order': 'related_order, account_type',
+                'idx_order_number': 'order_number',
+                'idx_af_type_flow_time': 'account_type, flow_type, created_at, change_amount',
+            },
+        }
+
         for table_name, sql in tables.items():
             cursor.execute(sql)
             logger.debug(f"表 `{table_name}` 已创建/确认")
@@ -935,6 +999,12 @@ class DatabaseManager:
             if table_name in required_columns:
                 self._ensure_table_columns(cursor, table_name, required_columns[table_name])
 
+            # 检查并补建缺失的索引（users 建 uk_openid 前先清理重复 openid）
+            if table_name == 'users':
+                self._dedupe_users_openid(cursor)
+            if table_name in required_indexes:
+                self._ensure_table_indexes(cursor, table_name, required_indexes[table_name])
+
         # 在表创建后添加外键约束（避免类型不匹配问题）
         self._add_cart_foreign_keys(cursor)
         self._add_refunds_foreign_keys(cursor)
@@ -967,6 +1037,8 @@ class DatabaseManager:
             else:
                 logger.warning(f"⚠️ 创建索引失败: {e}")
 
+        self._backfill_account_flow_related_order(cursor)
+        self._backfill_account_flow_order_number(cursor)
         self._init_finance_accounts(cursor)
         self._init_system_config(cursor)  # 新增
         logger.info("数据库表结构初始化完成")
@@ -1431,6 +1503,62 @@ class DatabaseManager:
         except Exception as e:
             logger.warning(f"⚠️ user_bankcard_operations 外键添加失败: {e}")
 
+    def _backfill_account_flow_related_order(self, cursor):
+        """为历史奖励流水回填 account_flow.related_order（从 remark 中的"订单#ID"解析），保证防重复检查覆盖旧数据"""
+        try:
+            cursor.execute(
+                """UPDATE account_flow
+                   SET related_order = CAST(SUBSTRING_INDEX(remark, '订单#', -1) AS UNSIGNED)
+                   WHERE related_order IS NULL
+                   AND account_type IN ('referral_points', 'team_reward_points')
+                   AND remark LIKE '%订单#%'"""
+            )
+            if cursor.rowcount:
+                logger.info(f"✅ 已回填 {cursor.rowcount} 条奖励流水的 related_order")
+        except Exception as e:
+            logger.warning(f"⚠️ 回填 account_flow.related_order 失败: {e}")
+
+    def _dedupe_users_openid(self, cursor):
+        """建 uk_openid 前清理重复 openid：每个 openid 保留 id 最小的账号，其余账号的 openid 置 NULL"""
+        try:
+            cursor.execute(
+                """UPDATE users u
+                   JOIN (SELECT openid, MIN(id) AS keep_id
+                         FROM users
+                         WHERE openid IS NOT NULL
+                         GROUP BY openid
+                         HAVING COUNT(*) > 1) d ON u.openid = d.openid AND u.id <> d.keep_id
+                   SET u.openid = NULL"""
+            )
+            if cursor.rowcount:
+                logger.warning(f"⚠️ 已清除 {cursor.rowcount} 个重复账号的 openid（保留每个 openid 下 id 最小的账号）")
+        except Exception as e:
+            logger.warning(f"⚠️ 清理重复 openid 失败: {e}")
+
+    def _backfill_account_flow_order_number(self, cursor):
+        """为历史分账/回冲流水回填 account_flow.order_number（从 remark 解析订单号）。
+
+        分账收入（"订单分账: 订单号"）供退款回冲汇总金额；回冲支出（"退款回冲: 订单号"）供
+        reverse_split_on_refund 识别已回冲订单，防止旧订单重复回调时再次扣减。
+        """
+        pool_types = """('merchant_balance', 'public_welfare', 'maintain_pool', 'subsidy_pool',
+                                        'director_pool', 'shop_pool', 'city_pool', 'branch_pool', 'fund_pool')"""
+        for flow_type, prefix, desc in (('income', '订单分账: ', '分账'), ('expense', '退款回冲: ', '回冲')):
+            try:
+                cursor.execute(
+                    f"""UPDATE account_flow
+                       SET order_number = SUBSTRING_INDEX(remark, %s, -1)
+                       WHERE order_number IS NULL
+                       AND flow_type = %s
+                       AND account_type IN {pool_types}
+                       AND remark LIKE %s""",
+                    (prefix, flow_type, prefix + '%')
+                )
+                if cursor.rowcount:
+                    logger.info(f"✅ 已回填 {cursor.rowcount} 条{desc}流水的 order_number")
+            except Exception as e:
+                logger.warning(f"⚠️ 回填{desc}流水 account_flow.order_number 失败: {e}")
+
     def _init_finance_accounts(self, cursor):
         accounts = [
             ('周补贴池', 'subsidy_pool'),
@@ -88,6 +88,20 @@ def on_startup():
     except Exception as e:
         logger.error(f"初始化数据库失败: {e}", exc_info=True)
 
+    # 表结构初始化完成后，一次 information_schema 查询预热动态 SELECT 用到的表结构缓存
+    try:
+        from core.database import get_conn
+        from core.table_access import preload_table_structures
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                preload_table_structures(cur, [
+                    'users', 'orders', 'points_log', 'finance_accounts', 'account_flow',
+                    'team_rewards', 'addresses', 'product_skus'
+                ])
+        logger.info("表结构缓存预热完成")
+    except Exception as e:
+        logger.warning(f"预热表结构缓存失败，将在首次使用时按需加载: {e}")
+
     try:
         from database_setup import start_background_tasks
         start_background_tasks()
@@ -104,6 +118,12 @@ def on_startup():
     except Exception as e:
         logger.warning(f"刷新快递公司列表缓存失败: {e}")'''
 
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    from services.wechat_service import WechatService
+    await WechatService.close_http_client()
+
 # ... 原有代码保持不变 ...
 
 tags_metadata = [
@@ -6,24 +6,25 @@
 
 import logging
 import json
-from decimal import Decimal, ROUND_DOWN, ROUND_CEILING
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from decimal import Decimal, ROUND_DOWN, ROUND_CEILING, ROUND_HALF_EVEN, Context, localcontext
+from datetime import date, datetime, timedelta
+from typing import Optional, List, Dict, Any, NamedTuple, Set
 import time
 import pymysql
+from functools import lru_cache
 from io import BytesIO
+from operator import itemgetter
 from core.config import (
     AllocationKey, ALLOCATIONS, MAX_POINTS_VALUE, TAX_RATE,
     POINTS_DISCOUNT_RATE, MEMBER_PRODUCT_PRICE, COUPON_VALID_DAYS,
     PLATFORM_MERCHANT_ID, MAX_PURCHASE_PER_DAY, MAX_TEAM_LAYER,
     LOG_FILE, CouponStatus,
 )
-from core.database import get_conn
+from core.database import get_conn, FLOAT_DECIMAL_CONV
 from core.db_adapter import PyMySQLAdapter
 from core.exceptions import FinanceException, OrderException, InsufficientBalanceException
 from core.logging import get_logger
-from core.table_access import build_dynamic_select, get_table_structure, _quote_identifier
-from core.table_access import build_dynamic_select, get_table_structure, _quote_identifier, build_select_list
+from core.table_access import build_dynamic_select, get_table_structure, _quote_identifier, build_select_list, clear_table_cache
 from core.db_adapter import build_in_placeholders
 
 logger = get_logger(__name__)
@@ -115,6 +116,150 @@ def parse_offline_coupon_ids(order_row: dict) -> list[int]:
     return []
 
 
+_D_ZERO = Decimal('0')
+
+
+# 批量金额运算使用的精简上下文：金额最多 4 位小数、整数部分远小于 14 位，18 位有效数字足够
+_FIN_CTX = Context(prec=18, rounding=ROUND_HALF_EVEN)
+
+
+def _to_decimal(value) -> Decimal:
+    """将数据库返回值转为 Decimal：DECIMAL 列本身即为 Decimal，直接返回；整数直接构造，仅 float/字符串才经 str() 转换。
+
+    空值（None、0、空字符串）按 0 处理，与 `Decimal(str(x or 0))` 一致。
+    """
+    if type(value) is Decimal:
+        return value
+    if not value:
+        return _D_ZERO
+    if type(value) is int:
+        return Decimal(value)
+    return Decimal(str(value))
+
+
+def _date_range(start_date, end_date) -> tuple[datetime, datetime]:
+    """将闭区间日期 [start_date, end_date] 转为半开区间 [lo, hi)。
+
+    用于 `created_at >= lo AND created_at < hi`，替代不可走索引的 `DATE(created_at) BETWEEN ...`。
+    """
+    return _day_start(start_date), _day_start(end_date) + timedelta(days=1)
+
+
+def _day_start(day) -> datetime:
+    """日期（'YYYY-MM-DD' 字符串或 date/datetime）当天 00:00，作为 `created_at` 范围的边界值。"""
+    return datetime.strptime(str(day)[:10], "%Y-%m-%d")
+
+
+# account_flow 明细行的字段提取器（公益基金流水/报表共用），避免逐字段按键取值
+_flow_row_fields = itemgetter('id', 'related_user', 'change_amount', 'balance_after', 'flow_type', 'remark',
+                              'created_at')
+
+# ==================== 高频写入语句（模块级常量，SQL 文本固定，解析/拼接只发生一次） ====================
+_INSERT_POOL_FLOW_SQL = (
+    "INSERT INTO account_flow (account_id, account_type, related_user, change_amount, balance_after, flow_type, remark, created_at) "
+    "SELECT %s, %s, %s, %s, "
+    "COALESCE((SELECT balance FROM finance_accounts WHERE account_type = %s), 0), "
+    "%s, %s, NOW()"
+)
+
+# 资金流水通用插入语句（balance_after 由调用方给出）
+_INSERT_FLOW_SQL = (
+    "INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, flow_type, remark, created_at) "
+    "VALUES (%s, %s, %s, %s, %s, %s, NOW())"
+)
+_INSERT_POINTS_LOG_SQL = (
+    "INSERT INTO points_log (user_id, change_amount, balance_after, type, reason, related_order, created_at) "
+    "VALUES (%s, %s, %s, %s, %s, %s, NOW())"
+)
+
+
+@lru_cache(maxsize=None)
+def _user_balance_sql(field: str) -> tuple[str, str, str]:
+    """按用户余额字段生成并缓存 (UPDATE, SELECT, INSERT account_flow) 三条语句，字段名经白名单引用。"""
+    quoted_field = _quote_identifier(field)
+    return (
+        f"UPDATE users SET {quoted_field} = COALESCE({quoted_field}, 0) + %s WHERE id = %s",
+        f"SELECT COALESCE({quoted_field}, 0) AS balance FROM users WHERE id = %s",
+        "INSERT INTO account_flow (account_id, account_type, related_user, change_amount, balance_after, flow_type, remark, created_at) "
+        f"SELECT %s, %s, %s, %s, COALESCE((SELECT {quoted_field} FROM users WHERE id = %s), 0), %s, %s, NOW()",
+    )
+
+
+# 日补贴按批流式处理的每批用户数
+_SUBSIDY_BATCH_SIZE = 1000
+
+# 高频查询语句：模块级常量，每次调用复用同一 SQL 文本
+_ACCOUNT_BALANCE_SQL = "SELECT balance FROM finance_accounts WHERE account_type = %s"
+_REFERRER_OF_SQL = "SELECT referrer_id FROM user_referrals WHERE user_id = %s"
+
+# 平台总积分分母：消费者积分全额 + 商家积分（仅计正数），一次扫描 users 同时汇总
+_SUM_USER_MERCHANT_POINTS_SQL = (
+    "SELECT SUM(COALESCE(member_points, 0)) AS member_total, "
+    "SUM(CASE WHEN merchant_points > 0 THEN merchant_points END) AS merchant_total FROM users"
+)
+
+# 资金池账户行不存在时创建（已存在则不改动余额）。
+# 初始余额也走占位符：VALUES 组内全为 %s 时 PyMySQL 的 executemany 才会合并成一条多行 INSERT
+_ENSURE_POOL_ACCOUNT_SQL = (
+    "INSERT INTO finance_accounts (account_name, account_type, balance) VALUES (%s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE account_name=VALUES(account_name)"
+)
+
+# 本进程内已确认存在的资金池账户类型；命中后分账热路径不再每单执行上面的 upsert
+_known_pool_accounts: Set[str] = set()
+
+
+def _ensure_pool_accounts(cur, account_types: List[str]) -> None:
+    """确保 finance_accounts 中存在这些账户行（必须使用调用方的 cur）。
+
+    只有 upsert 影响行数为 0（全部早已存在）时才记入进程缓存：新插入的行可能随调用方事务回滚，不能缓存。
+    """
+    missing = [account_type for account_type in account_types if account_type not in _known_pool_accounts]
+    if not missing:
+        return
+    cur.executemany(_ENSURE_POOL_ACCOUNT_SQL, [(account_type, account_type, 0) for account_type in missing])
+    if cur.rowcount == 0:
+        _known_pool_accounts.update(missing)
+
+# 订单分账/退款回冲流水：balance_after 由子查询在写入时读取，省去 UPDATE 后单独 SELECT 余额的往返
+_SPLIT_FLOW_INSERT_SQL = (
+    "INSERT INTO account_flow (account_type, change_amount, balance_after, flow_type, remark, order_number, created_at) "
+    "VALUES "
+)
+_SPLIT_POOL_FLOW_ROW = "(%s, %s, COALESCE((SELECT balance FROM finance_accounts WHERE account_type = %s), %s), %s, %s, %s, NOW())"
+_SPLIT_MERCHANT_FLOW_ROW = "(%s, %s, COALESCE((SELECT merchant_balance FROM users WHERE id = 1), %s), %s, %s, %s, NOW())"
+
+# 订单分账默认配置：(简称, account_type, 占订单总额比例)，比例在模块加载时构造一次
+_MERCHANT_SPLIT_RATIO = Decimal('0.80')
+# 结算时公司积分池按分账基数计提的比例，以及分池金额的量化精度
+_COMPANY_POINTS_RATIO = Decimal('0.20')
+_ALLOC_QUANT = Decimal('0.000001')
+_POOL_SPEC: tuple[tuple[str, str, Decimal], ...] = (
+    ("public", "public_welfare", Decimal('0.01')),
+    ("maintain", "maintain_pool", Decimal('0.01')),
+    ("subsidy", "subsidy_pool", Decimal('0.12')),
+    ("director", "director_pool", Decimal('0.02')),
+    ("shop", "shop_pool", Decimal('0.01')),
+    ("city", "city_pool", Decimal('0.01')),
+    ("branch", "branch_pool", Decimal('0.005')),
+    ("fund", "fund_pool", Decimal('0.015')),
+)
+_DEFAULT_POOL_ALLOCATIONS: Dict[str, Decimal] = {account_type: ratio for _, account_type, ratio in _POOL_SPEC}
+
+# 配置读取失败时的兜底分配：(池名, 比例, 是否公益基金)，模块加载时展开一次，避免每单重复做枚举比较
+_FALLBACK_POOL_ALLOCS: tuple[tuple[str, Decimal, bool], ...] = tuple(
+    (purpose.value, percent, purpose is AllocationKey.PUBLIC_WELFARE)
+    for purpose, percent in ALLOCATIONS.items()
+    if purpose is not AllocationKey.PLATFORM_REVENUE_POOL
+)
+
+
+class _BuyerSnapshot(NamedTuple):
+    """结算时购买者的等级与积分快照"""
+    member_level: int
+    member_points: Decimal
+
+
 class FinanceService:
     def __init__(self, session: Optional[PyMySQLAdapter] = None):
         """
@@ -146,33 +291,41 @@ class FinanceService:
         try:
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    cur.execute(
-                        "SELECT balance FROM finance_accounts WHERE account_type = %s",
-                        (account_type,)
-                    )
+                    cur.execute(_ACCOUNT_BALANCE_SQL, (account_type,))
                     row = cur.fetchone()
                     # 使用字典访问方式，避免 RowProxy 的属性访问问题
-                    balance_val = row.get('balance') if row else 0
-                    return Decimal(str(balance_val)) if balance_val is not None else Decimal('0')
+                    return _to_decimal(row.get('balance')) if row else _D_ZERO
         except Exception as e:
             logger.error(f"查询账户余额失败: {e}")
             return Decimal('0')
 
-    def get_user_balance(self, user_id: int, balance_type: str = 'promotion_balance') -> Decimal:
+    def get_account_balances(self, account_types: List[str]) -> Dict[str, Decimal]:
+        """一次查询多个资金池余额；不存在的账户按 0 返回"""
+        balances = {account_type: _D_ZERO for account_type in account_types}
+        if not balances:
+            return balances
+        placeholders = ",".join(["%s"] * len(balances))
         try:
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    # 使用动态表访问，自动处理字段不存在的情况
-                    select_sql = build_dynamic_select(
-                        cur,
-                        "users",
-                        where_clause="id=%s",
-                        select_fields=[balance_type]
+                    cur.execute(
+                        f"SELECT account_type, balance FROM finance_accounts WHERE account_type IN ({placeholders})",
+                        tuple(balances)
                     )
-                    cur.execute(select_sql, (user_id,))
+                    for row in cur.fetchall():
+                        balances[row['account_type']] = _to_decimal(row['balance'])
+        except Exception as e:
+            logger.error(f"批量查询账户余额失败: {e}")
+        return balances
+
+    def get_user_balance(self, user_id: int, balance_type: str = 'promotion_balance') -> Decimal:
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    # 复用按字段缓存的余额查询语句（字段名经白名单引用），不再逐次探测表结构
+                    cur.execute(_user_balance_sql(balance_type)[1], (user_id,))
                     row = cur.fetchone()
-                    val = row.get(balance_type, 0) if row else 0
-                    return Decimal(str(val))
+                    return _to_decimal(row['balance']) if row else _D_ZERO
         except Exception as e:
             logger.error(f"查询用户余额失败: {e}")
             return Decimal('0')
@@ -200,13 +353,11 @@ class FinanceService:
             "SELECT COALESCE(referral_points, 0) AS balance FROM users WHERE id = %s",
             (referrer_id,)
         )
-        new_balance = Decimal(str(cur.fetchone()['balance'] or 0))
+        new_balance = _to_decimal(cur.fetchone()['balance'])
 
         # 记录 account_flow
         cur.execute(
-            """INSERT INTO account_flow (account_type, related_user, change_amount, balance_after,
-               flow_type, remark, created_at)
-               VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
+            _INSERT_FLOW_SQL,
             ('referral_points', referrer_id, amount, new_balance, 'income',
              f"普通商品推荐奖励 - 订单{order_no}")
         )
@@ -283,15 +434,18 @@ class FinanceService:
                                points_to_use: Decimal, coupon_discount: Decimal) -> int:
         """多商品订单结算核心逻辑（最终干净版：按实付金额分账）"""
         try:
-            # ---------- 查询订单信息（pending_coupon_ids 多券、delivery_way 等） ----------
+            # ---------- 查询订单信息（pending_coupon_ids 多券、delivery_way 等），同一次往返带出用户等级/积分 ----------
             cur.execute(
-                """SELECT pending_points, pending_coupon_id, pending_coupon_ids, delivery_way,
-                          total_amount AS cash_payable,
-                          coupon_discount AS stored_coupon_discount,
-                          points_discount AS stored_points_discount,
-                          original_amount AS stored_original_amount
-                   FROM orders WHERE order_number = %s""",
-                (order_no,),
+                """SELECT o.pending_points, o.pending_coupon_id, o.pending_coupon_ids, o.delivery_way,
+                          o.total_amount AS cash_payable,
+                          o.coupon_discount AS stored_coupon_discount,
+                          o.points_discount AS stored_points_discount,
+                          o.original_amount AS stored_original_amount,
+                          u.id AS buyer_id, u.member_level, u.member_points
+                   FROM orders o
+                   LEFT JOIN users u ON u.id = %s
+                   WHERE o.order_number = %s""",
+                (user_id, order_no),
             )
             order_info = cur.fetchone()
             if not order_info:
@@ -319,21 +473,14 @@ class FinanceService:
             if not order_items:
                 raise OrderException(f"订单无商品明细: {order_no}")
 
-            # 2. 查询用户信息
-            select_sql = build_dynamic_select(
-                cur, "users",
-                where_clause="id=%s",
-                select_fields=["member_level", "member_points"]
-            )
-            cur.execute(select_sql, (user_id,))
-            user_row = cur.fetchone()
-            if not user_row:
+            # 2. 用户信息（已随订单查询一并取出）
+            if order_info.get('buyer_id') is None:
                 raise OrderException(f"用户不存在: {user_id}")
 
-            user = type('obj', (object,), {
-                'member_level': user_row.get('member_level', 0) or 0,
-                'member_points': Decimal(str(user_row.get('member_points', 0) or 0))
-            })()
+            user = _BuyerSnapshot(
+                member_level=order_info.get('member_level', 0) or 0,
+                member_points=_to_decimal(order_info.get('member_points', 0))
+            )
 
             # 3. 计算总金额 + 分类商品
             total_amount = Decimal('0')
@@ -341,13 +488,13 @@ class FinanceService:
             single_member_price = Decimal('0')
 
             for item in order_items:
-                item_total = Decimal(str(item['unit_price'])) * Decimal(str(item['quantity']))
+                item_total = _to_decimal(item['unit_price']) * _to_decimal(item['quantity'])
                 total_amount += item_total
 
                 if item['is_member_product']:
                     member_items.append(item)
                     if single_member_price == Decimal('0'):
-                        single_member_price = Decimal(str(item['unit_price']))
+                        single_member_price = _to_decimal(item['unit_price'])
 
             # 4. 重新汇总优惠券面额（多券叠加，防止订单表字段过期）
             ids = parse_pending_coupon_ids(order_info)
@@ -358,17 +505,17 @@ class FinanceService:
                     ids,
                 )
                 rows = cur.fetchall() or []
-                by_id = {int(r["id"]): Decimal(str(r["amount"])) for r in rows}
+                by_id = {int(r["id"]): _to_decimal(r["amount"]) for r in rows}
                 coupon_discount = sum((by_id[i] for i in ids if i in by_id), Decimal('0'))
             else:
                 # 无券 ID（历史数据/JSON 异常）时以订单已落库的券抵扣为准，避免实付重算偏大、多送消费积分
-                stored_cd = Decimal(str(order_info.get("stored_coupon_discount") or 0))
+                stored_cd = _to_decimal(order_info.get("stored_coupon_discount"))
                 if stored_cd > 0:
                     coupon_discount = stored_cd
                 elif coupon_discount is None or coupon_discount < 0:
                     coupon_discount = Decimal("0")
 
-            cash_payable = Decimal(str(order_info.get("cash_payable") or 0))
+            cash_payable = _to_decimal(order_info.get("cash_payable"))
             if cash_payable < Decimal("0"):
                 cash_payable = Decimal("0")
             cash_payable = cash_payable.quantize(Decimal("0.01"))
@@ -394,8 +541,8 @@ class FinanceService:
             final_amount = total_amount - total_discount
 
             logger.debug(
-                f"订单金额计算: 商品总额¥{total_amount}, 积分抵扣¥{points_discount}, "
-                f"优惠券¥{coupon_discount}, 重算实付¥{final_amount}, 订单应付现金¥{cash_payable}"
+                "订单金额计算: 商品总额¥%s, 积分抵扣¥%s, 优惠券¥%s, 重算实付¥%s, 订单应付现金¥%s",
+                total_amount, points_discount, coupon_discount, final_amount, cash_payable
             )
 
             # 零元订单自动完成结算
@@ -431,7 +578,7 @@ class FinanceService:
                 # 发放用户积分：仅按订单应付现金（与微信实付一致），不按「券面额/积分抵扣」分摊进获赠积分
                 if cash_payable > Decimal('0'):
                     member_total_amount = sum(
-                        Decimal(str(item['unit_price'])) * Decimal(str(item['quantity']))
+                        _to_decimal(item['unit_price']) * _to_decimal(item['quantity'])
                         for item in member_items
                     )
                     points_ratio = member_total_amount / total_amount if total_amount > 0 else Decimal('1')
@@ -460,7 +607,7 @@ class FinanceService:
             normal_total_amount = Decimal('0')
             if normal_items:
                 normal_total_amount = sum(
-                    Decimal(str(item['unit_price'])) * Decimal(str(item['quantity']))
+                    _to_decimal(item['unit_price']) * _to_decimal(item['quantity'])
                     for item in normal_items
                 )
 
@@ -486,8 +633,8 @@ class FinanceService:
             )
 
             logger.debug(
-                f"[分账基数] 订单{order_no} 使用原价减去积分抵扣作为基数: ¥{distribution_base:.2f} "
-                f"（原价¥{total_amount:.2f}，积分抵扣¥{points_discount:.2f}，优惠券¥{coupon_discount:.2f}，实付¥{final_amount:.2f}）"
+                "[分账基数] 订单%s 使用原价减去积分抵扣作为基数: ¥%.2f（原价¥%.2f，积分抵扣¥%.2f，优惠券¥%.2f，实付¥%.2f）",
+                order_no, distribution_base, total_amount, points_discount, coupon_discount, final_amount
             )
 
             # 平台收入池记入 100% 实付现金
@@ -502,7 +649,7 @@ class FinanceService:
             referrer_id = None
             if normal_items:
                 cur.execute(
-                    "SELECT referrer_id FROM user_referrals WHERE user_id = %s",
+                    _REFERRER_OF_SQL,
                     (user_id,)
                 )
                 ref_row = cur.fetchone()
@@ -523,48 +670,47 @@ class FinanceService:
                 normal_ratio = Decimal('0')
             normal_paid = distribution_base * normal_ratio
 
-            # 各子池统一分配（从平台收入池扣减）
+            # 各子池统一分配（从平台收入池扣减）；量化后为 0 的池子不写流水，其余变更最后一次批量落库
+            pool_rows = []
             for atype, ratio in allocs.items():
                 if atype == 'merchant_balance':
                     continue
-                alloc_amount = (distribution_base * ratio).quantize(Decimal('0.000001'))
-                self._add_pool_balance(
-                    cur, 'platform_revenue_pool', -alloc_amount,
-                    f"订单分账: {order_no} → {atype} ({ratio * 100:.0f}%)",
-                    user_id
-                )
+                alloc_amount = (distribution_base * ratio).quantize(_ALLOC_QUANT)
+                if alloc_amount <= 0:
+                    continue
+                pool_rows.append((
+                    'platform_revenue_pool', -alloc_amount,
+                    f"订单分账: {order_no} → {atype} ({ratio * 100:.0f}%)"
+                ))
                 if atype == 'fund_pool' and has_referrer and normal_paid > 0:
                     # 计算应给推荐人的金额（基于普通商品部分）
-                    referral_amount = (normal_paid * ratio).quantize(Decimal('0.000001'))
+                    referral_amount = (normal_paid * ratio).quantize(_ALLOC_QUANT)
                     # 发放给推荐人点数
                     self._grant_referral_points(cur, referrer_id, referral_amount, order_no)
                     # 剩余部分进入事业发展基金
                     fund_pool_amount = alloc_amount - referral_amount
                     if fund_pool_amount > 0:
-                        self._add_pool_balance(
-                            cur, atype, fund_pool_amount,
-                            f"订单#{order_no} {atype.replace('_', ' ')}+{int(ratio * 100)}% (剩余部分)",
-                            user_id
-                        )
+                        pool_rows.append((
+                            atype, fund_pool_amount,
+                            f"订单#{order_no} {atype.replace('_', ' ')}+{int(ratio * 100)}% (剩余部分)"
+                        ))
                 else:
-                    self._add_pool_balance(
-                        cur, atype, alloc_amount,
-                        f"订单#{order_no} {atype.replace('_', ' ')}+{int(ratio * 100)}%",
-                        user_id
-                    )
+                    pool_rows.append((
+                        atype, alloc_amount,
+                        f"订单#{order_no} {atype.replace('_', ' ')}+{int(ratio * 100)}%"
+                    ))
+            self._add_pool_balance_bulk(cur, pool_rows, user_id)
 
             # 公司积分池独立增加（基于实付金额的20%）
-            company_points_amount = (distribution_base * Decimal('0.20')).quantize(Decimal('0.000001'))
+            company_points_amount = (distribution_base * _COMPANY_POINTS_RATIO).quantize(_ALLOC_QUANT)
             cur.execute(
                 "UPDATE finance_accounts SET balance = balance + %s WHERE account_type = 'company_points'",
                 (company_points_amount,)
             )
             cur.execute("SELECT balance FROM finance_accounts WHERE account_type = 'company_points'")
-            cp_new_balance = Decimal(str(cur.fetchone()['balance'] or 0))
+            cp_new_balance = _to_decimal(cur.fetchone()['balance'])
             cur.execute(
-                """INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, 
-                   flow_type, remark, created_at)
-                   VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
+                _INSERT_FLOW_SQL,
                 ('company_points', PLATFORM_MERCHANT_ID, company_points_amount, cp_new_balance, 'income',
                  f"订单#{order_no} 公司积分池+20% ¥{company_points_amount:.4f}")
             )
@@ -579,11 +725,9 @@ class FinanceService:
 
             # 记录平台收入池流水
             cur.execute("SELECT balance FROM finance_accounts WHERE account_type = 'platform_revenue_pool'")
-            new_balance = Decimal(str(cur.fetchone()['balance'] or 0))
+            new_balance = _to_decimal(cur.fetchone()['balance'])
             cur.execute(
-                """INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, 
-                   flow_type, remark, created_at)
-                   VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
+                _INSERT_FLOW_SQL,
                 (
                     'platform_revenue_pool',
                     PLATFORM_MERCHANT_ID,
@@ -606,8 +750,8 @@ class FinanceService:
                 total_rain = Decimal('0')
                 total_points = Decimal('0')
                 for item in reward_items:
-                    total_rain += Decimal(str(item.get('reward_rain', 0) or 0))
-                    total_points += Decimal(str(item.get('reward_points', 0) or 0))
+                    total_rain += _to_decimal(item.get('reward_rain', 0))
+                    total_points += _to_decimal(item.get('reward_points', 0))
 
                 if total_rain > 0:
                     cur.execute(
@@ -617,9 +761,7 @@ class FinanceService:
                     cur.execute("SELECT true_total_points FROM users WHERE id = %s", (user_id,))
                     new_true_total = cur.fetchone()['true_total_points']
                     cur.execute(
-                        """INSERT INTO account_flow (account_type, related_user, change_amount, balance_after,
-                           flow_type, remark, created_at)
-                           VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
+                        _INSERT_FLOW_SQL,
                         ('true_total_points', user_id, total_rain, new_true_total, 'income',
                          f"购买商品赠送雨点 - 订单#{order_no}")
                     )
@@ -644,7 +786,7 @@ class FinanceService:
 
             OrderManager.update_status(order_no, next_status, external_conn=cur.connection)
 
-            logger.debug(f"订单结算成功: {order_no}，实付分账基数¥{distribution_base:.2f}")
+            logger.debug("订单结算成功: %s，实付分账基数¥%.2f", order_no, distribution_base)
             return order_id
 
         except Exception as e:
@@ -675,7 +817,7 @@ class FinanceService:
     def _apply_points_discount_v2(self, cur, user_id: int, user, points_to_use: Decimal, amount: Decimal,
                                   order_id: int) -> None:
         """积分抵扣处理（v2：接受cursor参数）"""
-        user_points = Decimal(str(user.member_points))
+        user_points = _to_decimal(user.member_points)
         if user_points < points_to_use:
             raise OrderException(f"积分不足，当前{user_points:.4f}分")
 
@@ -688,19 +830,12 @@ class FinanceService:
             # 说明积分不足或被并发消费
             raise OrderException(f"积分不足或并发冲突，无法使用{points_to_use:.4f}分")
 
-        # 【关键修复】获取扣减后的余额用于记录流水
-        cur.execute(
-            "SELECT member_points FROM users WHERE id = %s",
-            (user_id,)
-        )
-        new_balance = Decimal(str(cur.fetchone()['member_points'] or 0))
-
-        # 【关键修复】记录用户积分扣减流水
+        # 【关键修复】记录用户积分扣减流水（扣减后余额在 INSERT 内子查询取得，无需再回读一次）
         cur.execute(
             """INSERT INTO points_log 
                (user_id, change_amount, balance_after, type, reason, related_order, created_at)
-               VALUES (%s, %s, %s, 'member', %s, %s, NOW())""",
-            (user_id, -points_to_use, new_balance, '积分抵扣支付', order_id)
+               VALUES (%s, %s, (SELECT member_points FROM users WHERE id = %s), 'member', %s, %s, NOW())""",
+            (user_id, -points_to_use, user_id, '积分抵扣支付', order_id)
         )
 
         '''# 积分扣减后，旧逻辑会把扣掉的积分放回公司积分池；
@@ -848,7 +983,7 @@ class FinanceService:
         allocs = self.get_pool_allocations()
 
         # 商家/平台收入部分使用 merchant_balance
-        platform_revenue = total_amount * allocs.get('merchant_balance', Decimal('0.80'))
+        platform_revenue = total_amount * allocs.get('merchant_balance', _MERCHANT_SPLIT_RATIO)
 
         # 更新平台收入池余额
         cur.execute(
@@ -858,12 +993,10 @@ class FinanceService:
 
         # ==================== 关键修复：查询余额并写入流水 ====================
         cur.execute("SELECT balance FROM finance_accounts WHERE account_type = 'platform_revenue_pool'")
-        new_balance = Decimal(str(cur.fetchone()['balance'] or 0))
+        new_balance = _to_decimal(cur.fetchone()['balance'])
 
         cur.execute(
-            """INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, 
-               flow_type, remark, created_at)
-               VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
+            _INSERT_FLOW_SQL,
             ('platform_revenue_pool', PLATFORM_MERCHANT_ID, platform_revenue,
              new_balance, 'income', f"会员订单#{order_id} 平台收入¥{platform_revenue:.2f}")
         )
@@ -877,10 +1010,7 @@ class FinanceService:
                 alloc_amount = total_amount * ratio
 
                 # 确保对应的 finance_accounts 行存在
-                cur.execute(
-                    "INSERT INTO finance_accounts (account_name, account_type, balance) VALUES (%s, %s, 0) ON DUPLICATE KEY UPDATE account_name=VALUES(account_name)",
-                    (atype, atype)
-                )
+                cur.execute(_ENSURE_POOL_ACCOUNT_SQL, (atype, atype, 0))
 
                 cur.execute(
                     "UPDATE finance_accounts SET balance = balance + %s WHERE account_type = %s",
@@ -888,12 +1018,10 @@ class FinanceService:
                 )
 
                 cur.execute("SELECT balance FROM finance_accounts WHERE account_type = %s", (atype,))
-                new_balance = Decimal(str(cur.fetchone()['balance'] or 0))
+                new_balance = _to_decimal(cur.fetchone()['balance'])
 
                 cur.execute(
-                    """INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, 
-                       flow_type, remark, created_at)
-                       VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
+                    _INSERT_FLOW_SQL,
                     (atype, PLATFORM_MERCHANT_ID, alloc_amount, new_balance, 'income',
                      f"会员订单#{order_id} {atype}池¥{alloc_amount:.2f}")
                 )
@@ -919,12 +1047,13 @@ class FinanceService:
         logger.info(f"开始发放奖励: 订单#{order_id}, 购买者={buyer_id}({old_level}→{new_level}星)")
 
         # ==================== 防重复检查 ====================
+        # 使用结构化的 related_order 列走索引查找，替代 remark LIKE '%订单#X%' 的前导通配全表扫描
         cur.execute(
             """SELECT id FROM account_flow 
-               WHERE account_type IN ('referral_points', 'team_reward_points') 
-               AND remark LIKE %s
+               WHERE related_order = %s
+               AND account_type IN ('referral_points', 'team_reward_points') 
                LIMIT 1""",
-            (f"%订单#{order_id}%",)
+            (order_id,)
         )
         if cur.fetchone():
             logger.warning(f"⚠️ 订单#{order_id}的奖励已发放过，跳过重复发放")
@@ -937,7 +1066,7 @@ class FinanceService:
         # 1. 推荐奖励（首次购买 + 推荐人必须是星级会员）
         if old_level == 0:  # 只有0星升1星时才发推荐奖励
             cur.execute(
-                "SELECT referrer_id FROM user_referrals WHERE user_id = %s",
+                _REFERRER_OF_SQL,
                 (buyer_id,)
             )
             referrer = cur.fetchone()
@@ -969,14 +1098,14 @@ class FinanceService:
                         "SELECT COALESCE(referral_points, 0) AS referral_points FROM users WHERE id = %s",
                         (referrer['referrer_id'],)
                     )
-                    new_balance = Decimal(str(cur.fetchone()['referral_points'] or 0))
+                    new_balance = _to_decimal(cur.fetchone()['referral_points'])
 
                     cur.execute(
                         """INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, 
-                           flow_type, remark, created_at)
-                           VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
+                           flow_type, remark, related_order, created_at)
+                           VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())""",
                         ('referral_points', referrer['referrer_id'], reward_amount,
-                         new_balance, 'income', f"推荐奖励 - 订单#{order_id}")
+                         new_balance, 'income', f"推荐奖励 - 订单#{order_id}", order_id)
                     )
 
                     logger.info(f"推荐奖励发放: 用户{referrer['referrer_id']}({referrer_level}星) +{reward_amount:.2f}")
@@ -1004,40 +1133,32 @@ class FinanceService:
         # ========================================================================
 
         # ==================== 核心修复：构建完整推荐链 ============================
-        current_id = buyer_id
+        # 递归 CTE 一次取回各层推荐人及其星级；path 记录已出现的用户（含购买者），防止自指或循环
+        cur.execute(
+            """WITH RECURSIVE ref_chain AS (
+                   SELECT ur.referrer_id, 1 AS layer,
+                          CAST(CONCAT(ur.user_id, ',', ur.referrer_id) AS CHAR(1024)) AS path
+                   FROM user_referrals ur
+                   WHERE ur.user_id = %s AND ur.referrer_id > 0 AND ur.referrer_id <> ur.user_id
+                   UNION ALL
+                   SELECT ur.referrer_id, c.layer + 1, CONCAT(c.path, ',', ur.referrer_id)
+                   FROM ref_chain c
+                   JOIN user_referrals ur ON ur.user_id = c.referrer_id
+                   WHERE c.layer < %s AND ur.referrer_id > 0 AND FIND_IN_SET(ur.referrer_id, c.path) = 0
+               )
+               SELECT c.referrer_id, c.layer, COALESCE(u.member_level, 0) AS member_level
+               FROM ref_chain c LEFT JOIN users u ON u.id = c.referrer_id
+               ORDER BY c.layer""",
+            (buyer_id, MAX_TEAM_LAYER)
+        )
         referrer_chain = []  # 存储完整的推荐链
-        visited = {buyer_id}  # 防止自指或循环
-
-        for current_layer in range(1, MAX_TEAM_LAYER + 1):
-            cur.execute(
-                "SELECT referrer_id FROM user_referrals WHERE user_id = %s",
-                (current_id,)
-            )
-            ref = cur.fetchone()
-
-            if not ref or not ref['referrer_id']:
-                logger.debug(f"第{current_layer}层无推荐人，链断裂")
-                break
-
-            referrer_id = ref['referrer_id']
-
-            # 避免自指或循环导致自己拿团队奖
-            if referrer_id in visited:
-                logger.debug(f"推荐链出现自指/循环（用户{referrer_id}），停止发放团队奖励")
-                break
-            visited.add(referrer_id)
-            cur.execute("SELECT member_level FROM users WHERE id = %s", (referrer_id,))
-            user_row = cur.fetchone()
-            referrer_level = user_row.get('member_level', 0) if user_row else 0
-
+        for row in cur.fetchall():
             referrer_chain.append({
-                'layer': current_layer,
-                'user_id': referrer_id,
-                'member_level': referrer_level
+                'layer': row['layer'],
+                'user_id': row['referrer_id'],
+                'member_level': row['member_level']
             })
-
-            logger.debug(f"第{current_layer}层: 用户{referrer_id}({referrer_level}星)")
-            current_id = referrer_id
+            logger.debug(f"第{row['layer']}层: 用户{row['referrer_id']}({row['member_level']}星)")
 
         if not referrer_chain:
             logger.debug("推荐链为空，无法发放团队奖励")
@@ -1103,14 +1224,15 @@ class FinanceService:
                 "SELECT COALESCE(team_reward_points, 0) AS team_reward_points FROM users WHERE id = %s",
                 (recipient_id,)
             )
-            new_balance = Decimal(str(cur.fetchone()['team_reward_points'] or 0))
+            new_balance = _to_decimal(cur.fetchone()['team_reward_points'])
 
             cur.execute(
                 """INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, 
-                   flow_type, remark, created_at)
-                   VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
+                   flow_type, remark, related_order, created_at)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())""",
                 ('team_reward_points', recipient_id, reward_amount,
-                 new_balance, 'income', f"团队L{target_layer}奖励（来自第{actual_layer}层）- 订单#{order_id}")
+                 new_balance, 'income', f"团队L{target_layer}奖励（来自第{actual_layer}层）- 订单#{order_id}",
+                 order_id)
             )
 
             total_distributed += reward_amount
@@ -1123,10 +1245,10 @@ class FinanceService:
     def _allocate_funds_to_pools(self, order_id: int, total_amount: Decimal) -> None:
         try:
             allocs = self.get_pool_allocations()
-            platform_revenue = total_amount * allocs.get('merchant_balance', Decimal('0.80'))
+            platform_revenue = total_amount * allocs.get('merchant_balance', _MERCHANT_SPLIT_RATIO)
         except Exception:
             allocs = None
-            platform_revenue = total_amount * Decimal('0.80')
+            platform_revenue = total_amount * _MERCHANT_SPLIT_RATIO
 
         # 使用 helper 统一处理平台池子余额变更与流水
         self._add_pool_balance('platform_revenue_pool', platform_revenue, f"订单#{order_id} 平台收入")
@@ -1140,12 +1262,10 @@ class FinanceService:
                 if atype == 'public_welfare':
                     logger.debug(f"公益基金获得: ¥{alloc_amount}")
         else:
-            for purpose, percent in ALLOCATIONS.items():
-                if purpose == AllocationKey.PLATFORM_REVENUE_POOL:
-                    continue
+            for pool_name, percent, is_public_welfare in _FALLBACK_POOL_ALLOCS:
                 alloc_amount = total_amount * percent
-                self._add_pool_balance(purpose.value, alloc_amount, f"订单#{order_id} 分配到{purpose.value}")
-                if purpose == AllocationKey.PUBLIC_WELFARE:
+                self._add_pool_balance(pool_name, alloc_amount, f"订单#{order_id} 分配到{pool_name}")
+                if is_public_welfare:
                     logger.debug(f"公益基金获得: ¥{alloc_amount}")
 
     def audit_and_distribute_rewards(self, reward_ids: List[int], approve: bool, auditor: str = 'admin') -> bool:
@@ -1153,6 +1273,9 @@ class FinanceService:
         if not reward_ids:
             raise FinanceException("奖励ID列表不能为空")
 
+        # 去重并按 id 升序，保证并发审核时行锁的获取顺序一致，避免死锁
+        reward_ids = sorted(set(reward_ids))
+
         # ============= 关键修复：移除 try...except，让 FinanceException 直接抛出 =============
         # 使用核心库中的占位符构造器，避免直接拼接值到 SQL
         placeholders, params_dict = build_in_placeholders(reward_ids)
@@ -1160,11 +1283,13 @@ class FinanceService:
 
         with get_conn() as conn:
             with conn.cursor() as cur:
-                # 查询待审核奖励
+                # 查询并按 id 顺序锁定待审核奖励
                 cur.execute(
                     f"""SELECT id, user_id, reward_type, amount, order_id, layer
                        FROM pending_rewards 
-                       WHERE id IN ({placeholders}) AND status = 'pending'""",
+                       WHERE id IN ({placeholders}) AND status = 'pending'
+                       ORDER BY id
+                       FOR UPDATE""",
                     params_tuple
                 )
                 rewards = cur.fetchall()
@@ -1177,36 +1302,51 @@ class FinanceService:
                     today = datetime.now().date()
                     valid_to = today + timedelta(days=COUPON_VALID_DAYS)
 
+                    # 发放优惠券：多行 VALUES 一次写入
+                    coupon_params = []
                     for reward in rewards:
-                        # 发放优惠券
-                        cur.execute(
-                            """INSERT INTO coupons (user_id, coupon_type, amount, valid_from, valid_to, status)
-                               VALUES (%s, 'user', %s, %s, %s, 'unused')""",
-                            (reward['user_id'], reward['amount'], today, valid_to)
-                        )
-                        coupon_id = cur.lastrowid
+                        coupon_params.extend((reward['user_id'], reward['amount'], today, valid_to))
+                    cur.execute(
+                        "INSERT INTO coupons (user_id, coupon_type, amount, valid_from, valid_to, status) VALUES "
+                        + ", ".join(["(%s, 'user', %s, %s, %s, 'unused')"] * len(rewards)),
+                        tuple(coupon_params)
+                    )
+                    # lastrowid 为第一行的 ID；步长受 auto_increment_increment 影响，不能假定连续，
+                    # 在本事务内按 ID 升序读回本次插入的行（插入顺序与 rewards 顺序一致）
+                    first_coupon_id = cur.lastrowid
+                    coupon_user_ids = sorted({reward['user_id'] for reward in rewards})
+                    cur.execute(
+                        f"SELECT id FROM coupons WHERE id >= %s AND user_id IN ({', '.join(['%s'] * len(coupon_user_ids))}) "
+                        "ORDER BY id LIMIT %s",
+                        (first_coupon_id, *coupon_user_ids, len(rewards))
+                    )
+                    coupon_ids = [row['id'] for row in cur.fetchall()]
 
-                        # 更新奖励状态
-                        cur.execute(
-                            "UPDATE pending_rewards SET status = 'approved' WHERE id = %s",
-                            (reward['id'],)
-                        )
+                    # 更新奖励状态（按 id 顺序，与加锁顺序一致）
+                    approved_ids = [reward['id'] for reward in rewards]
+                    cur.execute(
+                        f"UPDATE pending_rewards SET status = 'approved' WHERE id IN ({', '.join(['%s'] * len(approved_ids))}) ORDER BY id",
+                        tuple(approved_ids)
+                    )
 
-                        # 记录流水
+                    # 记录流水：多行 VALUES 一次写入（优惠券流水金额为 0，balance_after 取 coupon 账户余额）
+                    flow_params = []
+                    for reward, coupon_id in zip(rewards, coupon_ids):
                         reward_desc = '推荐' if reward['reward_type'] == 'referral' else f"团队L{reward['layer']}"
-                        self._record_flow(
-                            account_type='coupon',
-                            related_user=reward['user_id'],
-                            change_amount=Decimal('0'),
-                            flow_type='coupon',
-                            remark=f"{reward_desc}奖励发放优惠券#{coupon_id} ¥{reward['amount']:.2f}"
-                        )
+                        flow_params.extend((reward['user_id'],
+                                            f"{reward_desc}奖励发放优惠券#{coupon_id} ¥{reward['amount']:.2f}"))
                         logger.debug(f"奖励{reward['id']}已批准，发放优惠券{coupon_id}")
+                    cur.execute(
+                        "INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, flow_type, remark, created_at) VALUES "
+                        + ", ".join(["('coupon', %s, 0, COALESCE((SELECT balance FROM finance_accounts "
+                                     "WHERE account_type = 'coupon'), 0), 'coupon', %s, NOW())"] * len(rewards)),
+                        tuple(flow_params)
+                    )
                 else:
                     # 拒绝奖励
                     cur.execute(
-                        f"UPDATE pending_rewards SET status = 'rejected' WHERE id IN ({placeholders})",
-                        reward_ids
+                        f"UPDATE pending_rewards SET status = 'rejected' WHERE id IN ({placeholders}) ORDER BY id",
+                        params_tuple
                     )
                     logger.debug(f"已拒绝 {len(reward_ids)} 条奖励")
 
@@ -1265,7 +1405,7 @@ class FinanceService:
                         "points_issued": float(r['points_issued']),
                         "current_status": "已自动发放",
                         "remark": r['remark'],
-                        "created_at": r['created_at'].strftime("%Y-%m-%d %H:%M:%S"),
+                        "created_at": r['created_at'].isoformat(sep=" ", timespec="seconds"),
                         "points_field": r['account_type']
                     })
 
@@ -1288,7 +1428,7 @@ class FinanceService:
                                 'config_params']
 
                             if isinstance(config, dict) and 'points_value' in config:
-                                value = Decimal(str(config['points_value']))
+                                value = _to_decimal(config['points_value'])
                                 auto_clear = config.get('auto_clear', False)
                                 if 0 <= value <= MAX_POINTS_VALUE:
                                     return {
@@ -1354,21 +1494,18 @@ class FinanceService:
         # ========== 修复：计算完整的平台总积分 ==========
         with get_conn() as conn:
             with conn.cursor() as cur:
-                # 1. 消费者积分（全额）
-                cur.execute("SELECT SUM(COALESCE(member_points, 0)) as total FROM users")
-                total_user_points = Decimal(str(cur.fetchone()['total'] or 0))
-
-                # 2. 商家积分（按20%计入）
-                cur.execute(
-                    "SELECT SUM(COALESCE(merchant_points, 0)) as total FROM users WHERE COALESCE(merchant_points, 0) > 0")
-                total_merchant_points = Decimal(str(cur.fetchone()['total'] or 0))
+                # 1. 消费者积分（全额）+ 2. 商家积分（仅计正数）：一次扫描 users 同时汇总
+                cur.execute(_SUM_USER_MERCHANT_POINTS_SQL)
+                points_row = cur.fetchone()
+                total_user_points = _to_decimal(points_row['member_total'])
+                total_merchant_points = _to_decimal(points_row['merchant_total'])
                 weighted_merchant_points = total_merchant_points
 
                 # 3. 平台储备积分（公司积分池）
                 try:
                     cur.execute("SELECT balance FROM finance_accounts WHERE account_type = 'company_points'")
                     cp_row = cur.fetchone()
-                    company_points_balance = Decimal(str(cp_row['balance'] or 0)) if cp_row else Decimal('0')
+                    company_points_balance = _to_decimal(cp_row['balance']) if cp_row else Decimal('0')
                 except Exception:
                     company_points_balance = Decimal('0')
 
@@ -1480,17 +1617,16 @@ class FinanceService:
         # ========== 计算完整的平台总积分（包含商家和平台）==========
         with get_conn() as conn:
             with conn.cursor() as cur:
-                cur.execute("SELECT SUM(COALESCE(member_points, 0)) as total FROM users")
-                total_user_points = Decimal(str(cur.fetchone()['total'] or 0))
-
-                cur.execute(
-                    "SELECT SUM(COALESCE(merchant_points, 0)) as total FROM users WHERE COALESCE(merchant_points, 0) > 0")
-                total_merchant_points = Decimal(str(cur.fetchone()['total'] or 0))
+                # 消费者积分与商家积分（仅计正数）一次扫描 users 同时汇总
+                cur.execute(_SUM_USER_MERCHANT_POINTS_SQL)
+                points_row = cur.fetchone()
+                total_user_points = _to_decimal(points_row['member_total'])
+                total_merchant_points = _to_decimal(points_row['merchant_total'])
 
                 try:
                     cur.execute("SELECT balance FROM finance_accounts WHERE account_type = 'company_points'")
                     cp_row = cur.fetchone()
-                    company_points_balance = Decimal(str(cp_row['balance'] or 0)) if cp_row else Decimal('0')
+                    company_points_balance = _to_decimal(cp_row['balance']) if cp_row else Decimal('0')
                 except Exception:
                     company_points_balance = Decimal('0')
 
@@ -1530,85 +1666,44 @@ class FinanceService:
         try:
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    cur.execute(
-                        "SELECT id, member_points, subsidy_points FROM users WHERE COALESCE(member_points, 0) > 0"
-                    )
-                    users = cur.fetchall()
-
-                    for user in users:
-                        user_id = user['id']
-                        member_points = Decimal(str(user['member_points'] or 0))
-                        current_subsidy_points = Decimal(str(user['subsidy_points'] or 0))
-
-                        subsidy_amount = member_points * points_value
-                        points_to_add = subsidy_amount
-
-                        if points_to_add <= Decimal('0'):
-                            continue
-
-                        points_to_deduct = min(points_to_add, member_points)
-                        if points_to_deduct <= Decimal('0'):
-                            continue
-
-                        new_subsidy_points = current_subsidy_points + points_to_add
-                        cur.execute(
-                            "UPDATE users SET subsidy_points = %s WHERE id = %s",
-                            (new_subsidy_points, user_id)
-                        )
-                        cur.execute(
-                            "UPDATE users SET true_total_points = true_total_points + %s WHERE id = %s",
-                            (points_to_add, user_id)
-                        )
-
-                        cur.execute(
-                            "UPDATE users SET member_points = member_points - %s WHERE id = %s",
-                            (points_to_deduct, user_id)
-                        )
-
-                        cur.execute(
-                            "SELECT member_points FROM users WHERE id = %s",
-                            (user_id,)
-                        )
-                        new_balance = Decimal(str(cur.fetchone()['member_points'] or 0))
-
-                        cur.execute(
-                            """INSERT INTO points_log 
-                               (user_id, change_amount, balance_after, type, reason, related_order, created_at)
-                               VALUES (%s, %s, %s, 'member', %s, NULL, NOW())""",
-                            (user_id, -points_to_deduct, new_balance, f"日补贴扣减积分（本次积分值:{points_value:.4f}）")
-                        )
-
-                        try:
-                            self._add_pool_balance(
-                                cur, 'subsidy_pool', -subsidy_amount,
-                                f"日补贴发放 - 用户{user_id}获得{points_to_add:.4f}点数",
-                                related_user=None
+                    # 另开一条连接用服务端游标流式读取用户，按批计算并批量写入（整个发放仍在同一写事务内）
+                    with get_conn() as read_conn:
+                        with read_conn.cursor(pymysql.cursors.SSDictCursor) as read_cur:
+                            read_cur.execute(
+                                "SELECT id, member_points FROM users WHERE COALESCE(member_points, 0) > 0 ORDER BY id"
                             )
-                        except InsufficientBalanceException:
-                            logger.error(f"补贴池余额不足，无法发放用户{user_id}的补贴")
-                            raise FinanceException("补贴池余额不足，发放失败")
-
-                        cur.execute(
-                            """INSERT INTO weekly_subsidy_records 
-                               (user_id, week_start, subsidy_amount, points_before, points_deducted, remark)
-                               VALUES (%s, %s, %s, %s, %s, %s)""",
-                            (user_id, today, subsidy_amount, member_points, points_to_deduct,
-                             f"日补贴（每日可分配金额{daily_available:.4f}）")
-                        )
-
-                        total_distributed += subsidy_amount
-                        total_points_deducted += points_to_deduct
-                        logger.info(
-                            f"用户{user_id}: 发放点数{points_to_add:.4f}, 扣减积分{points_to_deduct:.4f}"
-                        )
+                            while True:
+                                users = read_cur.fetchmany(_SUBSIDY_BATCH_SIZE)
+                                if not users:
+                                    break
+                                batch = []
+                                with localcontext(_FIN_CTX):
+                                    for user in users:
+                                        member_points = _to_decimal(user['member_points'])
+                                        points_to_add = member_points * points_value
+                                        if points_to_add <= Decimal('0'):
+                                            continue
+                                        points_to_deduct = min(points_to_add, member_points)
+                                        if points_to_deduct <= Decimal('0'):
+                                            continue
+                                        batch.append((user['id'], member_points, points_to_add, points_to_deduct))
+
+                                if not batch:
+                                    continue
+                                self._flush_daily_subsidy_batch(cur, batch, points_value, daily_available, today)
+                                for user_id, _, points_to_add, points_to_deduct in batch:
+                                    total_distributed += points_to_add
+                                    total_points_deducted += points_to_deduct
+                                    logger.info(
+                                        "用户%s: 发放点数%.4f, 扣减积分%.4f", user_id, points_to_add, points_to_deduct
+                                    )
 
                     # ========== 用户26平台积分池特殊发放 ==========
                     try:
                         logger.info("开始处理平台积分池(company_points)补贴发放给用户26")
                         cur.execute("SELECT balance FROM finance_accounts WHERE account_type = 'company_points'")
                         cp_current_row = cur.fetchone()
-                        company_points_current = Decimal(
-                            str(cp_current_row['balance'] or 0)) if cp_current_row else Decimal('0')
+                        company_points_current = _to_decimal(cp_current_row['balance']) if cp_current_row else Decimal('0')
 
                         if company_points_current > 0:
                             platform_subsidy_amount = company_points_current * points_value
@@ -1616,8 +1711,7 @@ class FinanceService:
                             if platform_subsidy_amount > Decimal('0'):
                                 cur.execute("SELECT balance FROM finance_accounts WHERE account_type = 'subsidy_pool'")
                                 subsidy_pool_row = cur.fetchone()
-                                current_subsidy_pool = Decimal(
-                                    str(subsidy_pool_row['balance'] or 0)) if subsidy_pool_row else Decimal('0')
+                                current_subsidy_pool = _to_decimal(subsidy_pool_row['balance']) if subsidy_pool_row else Decimal('0')
 
                                 if current_subsidy_pool < platform_subsidy_amount:
                                     logger.error(f"补贴池余额不足，无法发放用户26的平台积分补贴")
@@ -1647,7 +1741,7 @@ class FinanceService:
                                 cur.execute(
                                     "SELECT subsidy_points FROM users WHERE id = %s", (26,)
                                 )
-                                user26_subsidy_balance = Decimal(str(cur.fetchone()['subsidy_points'] or 0))
+                                user26_subsidy_balance = _to_decimal(cur.fetchone()['subsidy_points'])
                                 cur.execute(
                                     """INSERT INTO points_log (user_id, change_amount, balance_after, type, reason, related_order, created_at) 
                                        VALUES (%s, %s, %s, 'company', %s, NULL, NOW())""",
@@ -1690,13 +1784,80 @@ class FinanceService:
             logger.error(f"❌ 日补贴发放失败: {e}", exc_info=True)
             return False
 
+    def _flush_daily_subsidy_batch(self, cur, batch: List[tuple], points_value: Decimal,
+                                   daily_available: Decimal, today: date) -> None:
+        """写入一批日补贴：用户点数/积分一条 CASE UPDATE，补贴池一次扣减，流水与补贴记录多行写入。
+
+        用户按 id 升序读取、批内按 id 升序更新，重叠执行的发放任务以相同顺序加锁，避免死锁。
+
+        batch 每项为 (user_id, member_points, points_to_add, points_to_deduct)，必须使用调用方的 cur。
+        """
+        user_ids = [row[0] for row in batch]
+        placeholders = ",".join(["%s"] * len(user_ids))
+        case_sql = " ".join(["WHEN %s THEN %s"] * len(batch))
+        add_params = [v for user_id, _, points_to_add, _ in batch for v in (user_id, points_to_add)]
+        deduct_params = [v for user_id, _, _, points_to_deduct in batch for v in (user_id, points_to_deduct)]
+        cur.execute(
+            f"""UPDATE users SET subsidy_points = COALESCE(subsidy_points, 0) + CASE id {case_sql} END,
+                                 true_total_points = true_total_points + CASE id {case_sql} END,
+                                 member_points = member_points - CASE id {case_sql} END
+                WHERE id IN ({placeholders})
+                ORDER BY id""",
+            (*add_params, *add_params, *deduct_params, *user_ids)
+        )
+
+        cur.execute(f"SELECT id, member_points FROM users WHERE id IN ({placeholders})", user_ids)
+        new_balances = {row['id']: _to_decimal(row['member_points']) for row in cur.fetchall()}
+
+        # 补贴池：锁定后按批次总额一次扣减，逐用户流水的 balance_after 按扣减顺序递推
+        batch_total = sum((row[2] for row in batch), Decimal('0'))
+        cur.execute("SELECT balance FROM finance_accounts WHERE account_type = 'subsidy_pool' FOR UPDATE")
+        pool_row = cur.fetchone()
+        pool_balance = _to_decimal(pool_row['balance']) if pool_row else _D_ZERO
+        if pool_balance < batch_total:
+            logger.error(f"补贴池余额不足，无法发放本批{len(batch)}名用户的补贴")
+            raise FinanceException("补贴池余额不足，发放失败")
+        cur.execute(
+            "UPDATE finance_accounts SET balance = balance - %s WHERE account_type = 'subsidy_pool'",
+            (batch_total,)
+        )
+
+        flow_params = []
+        points_log_rows = []
+        subsidy_record_rows = []
+        for user_id, member_points, points_to_add, points_to_deduct in batch:
+            pool_balance -= points_to_add
+            flow_params.extend((-points_to_add, pool_balance, f"日补贴发放 - 用户{user_id}获得{points_to_add:.4f}点数"))
+            points_log_rows.append(
+                (user_id, -points_to_deduct, new_balances.get(user_id, _D_ZERO), 'member',
+                 f"日补贴扣减积分（本次积分值:{points_value:.4f}）", None)
+            )
+            subsidy_record_rows.append(
+                (user_id, today, points_to_add, member_points, points_to_deduct,
+                 f"日补贴（每日可分配金额{daily_available:.4f}）")
+            )
+
+        flow_values = ", ".join(["('subsidy_pool', NULL, %s, %s, 'expense', %s, NOW())"] * len(batch))
+        cur.execute(
+            "INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, flow_type, remark, created_at) "
+            f"VALUES {flow_values}",
+            flow_params
+        )
+        self._insert_points_log_bulk(cur, points_log_rows)
+        cur.executemany(
+            """INSERT INTO weekly_subsidy_records 
+               (user_id, week_start, subsidy_amount, points_before, points_deducted, remark)
+               VALUES (%s, %s, %s, %s, %s, %s)""",
+            subsidy_record_rows
+        )
+
     # ==================== 关键修改4：退款逻辑使用member_points ====================
     def refund_order(self, order_no: str) -> bool:
         try:
             # 先读取订单信息（只读），随后通过条件更新来避免长时间持有行锁
             result = self.session.execute(
-                "SELECT order_number, status, is_member_order, user_id, total_amount, merchant_id, original_amount FROM orders WHERE order_number = %s",
-                {"order_number": order_no}
+                "SELECT id, order_number, status, is_member_order, user_id, total_amount, merchant_id, original_amount FROM orders WHERE order_number = %s",
+                (order_no,)
             )
             order = result.fetchone()
 
@@ -1706,72 +1867,66 @@ class FinanceService:
             # 尝试将订单状态置为 refunded（条件更新保证并发安全且不会长时间锁行）
             res = self.session.execute(
                 "UPDATE orders SET status = 'refunded' WHERE order_number = %s AND status != 'refunded'",
-                {"order_number": order_no}
+                (order_no,)
             )
             if res.rowcount == 0:
                 raise FinanceException("订单已被并发处理或状态已改变")
 
             is_member = order.is_member_order
             user_id = order.user_id
-            amount = Decimal(str(order.total_amount))
+            amount = _to_decimal(order.total_amount)
             merchant_id = order.merchant_id
 
-            logger.debug(f"订单退款: {order_no} (会员商品: {is_member})")
+            logger.debug("订单退款: %s (会员商品: %s)", order_no, is_member)
 
             if is_member:
                 result = self.session.execute(
-                    "SELECT referrer_id FROM user_referrals WHERE user_id = %s",
-                    {"user_id": user_id}
+                    _REFERRER_OF_SQL,
+                    (user_id,)
                 )
                 referrer = result.fetchone()
                 if referrer and referrer.referrer_id:
-                    reward_amount = Decimal(str(order.original_amount)) * Decimal('0.50')
+                    # user_id / reward_amount 为 team_rewards 建表必备列，直接查询，无需另开连接探测表结构
+                    result = self.session.execute(
+                        "SELECT user_id, reward_amount FROM team_rewards WHERE order_id = %s ORDER BY user_id, id",
+                        (order.id,)
+                    )
+                    rewards = result.fetchall()
+
+                    # 扣减前按 id 升序一次锁定推荐人、团队奖励用户及购买者，
+                    # 保证并发退款时用户行锁的获取顺序一致，避免死锁
+                    lock_ids = sorted({referrer.referrer_id, user_id} | {reward.user_id for reward in rewards})
+                    placeholders = ",".join(["%s"] * len(lock_ids))
+                    self.session.execute(
+                        f"SELECT id FROM users WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE",
+                        lock_ids
+                    ).fetchall()
+
+                    reward_amount = _to_decimal(order.original_amount) * Decimal('0.50')
                     self.session.execute(
                         """UPDATE users SET promotion_balance = promotion_balance - %s
                            WHERE id = %s AND promotion_balance >= %s""",
-                        {"amount": reward_amount, "user_id": referrer.referrer_id}
+                        (reward_amount, referrer.referrer_id, reward_amount)
                     )
 
-                    # 动态构造 SELECT 语句（使用临时连接获取表结构，不影响当前事务）
-                    with get_conn() as temp_conn:
-                        with temp_conn.cursor() as temp_cur:
-                            select_fields, existing_columns = _build_team_rewards_select(temp_cur, ['reward_amount'])
-                            # 确保包含 user_id 字段（如果不存在则添加默认值 0）
-                            if 'user_id' not in existing_columns:
-                                select_fields = "0 AS user_id, " + select_fields
-                            else:
-                                # 如果 user_id 存在，确保它在最前面
-                                fields_list = [f.strip() for f in select_fields.split(",")]
-                                # 移除 user_id（如果存在）
-                                fields_list = [f for f in fields_list if
-                                               f != 'user_id' and not f.startswith('user_id ')]
-                                select_fields = "user_id, " + ", ".join(fields_list)
-
-                    result = self.session.execute(
-                        f"SELECT {select_fields} FROM team_rewards WHERE order_id = %s",
-                        {"order_id": order.id}
-                    )
-                    rewards = result.fetchall()
                     for reward in rewards:
                         self.session.execute(
                             """UPDATE users SET promotion_balance = promotion_balance - %s
                                WHERE id = %s AND promotion_balance >= %s""",
-                            {"amount": reward.reward_amount, "user_id": reward.user_id}
+                            (reward.reward_amount, reward.user_id, reward.reward_amount)
                         )
 
                     # 关键修改：退款时扣减member_points（不再是points）
-                    user_points = Decimal(str(order.original_amount))
-                    self.session.execute(
-                        "UPDATE users SET member_points = GREATEST(member_points - %s, 0) WHERE id = %s",
-                        {"points": user_points, "user_id": user_id}
-                    )
+                    user_points = _to_decimal(order.original_amount)
                     self.session.execute(
-                        "UPDATE users SET member_level = GREATEST(member_level - 1, 0) WHERE id = %s",
-                        {"user_id": user_id}
+                        """UPDATE users SET member_points = GREATEST(member_points - %s, 0),
+                                            member_level = GREATEST(member_level - 1, 0)
+                           WHERE id = %s""",
+                        (user_points, user_id)
                     )
                     logger.info(f"⚠️ 用户{user_id}退款后降级")
 
-                merchant_amount = amount * Decimal('0.80')
+                merchant_amount = amount * _MERCHANT_SPLIT_RATIO
 
                 if is_member:
                     self._check_pool_balance('platform_revenue_pool', merchant_amount)
@@ -1783,7 +1938,7 @@ class FinanceService:
                         self._check_user_balance(merchant_id, merchant_amount, 'merchant_balance')
                         self.session.execute(
                             "UPDATE users SET merchant_balance = merchant_balance - %s WHERE id = %s",
-                            {"amount": merchant_amount, "merchant_id": merchant_id}
+                            (merchant_amount, merchant_id)
                         )
 
                 # ===== 新增：回冲各子资金池 =====
@@ -1791,10 +1946,10 @@ class FinanceService:
 
                 self.session.execute(
                     "UPDATE orders SET refund_status = 'refunded', updated_at = NOW() WHERE id = %s",
-                    {"order_id": order.id}
+                    (order.id,)
                 )
 
-            logger.debug(f"订单退款成功: {order_no}")
+            logger.debug("订单退款成功: %s", order_no)
             return True
 
         except Exception as e:
@@ -1832,7 +1987,7 @@ class FinanceService:
 
             user_id = order['user_id']
             order_id = order['id']
-            pending_points = Decimal(str(order.get('pending_points') or 0))
+            pending_points = _to_decimal(order.get('pending_points'))
             pending_coupon_ids_json = order.get('pending_coupon_ids')
 
             # 2. 退回使用的积分（加回用户积分余额）
@@ -1910,11 +2065,11 @@ class FinanceService:
                 (user_id, order_id, offline_grant_reason, offline_grant_reason),
             )
             row = cur.fetchone()
-            total_granted = Decimal(str(row['total_granted'] or 0))
+            total_granted = _to_decimal(row['total_granted'])
             if total_granted > 0:
                 # 查询当前余额
                 cur.execute("SELECT member_points FROM users WHERE id = %s", (user_id,))
-                current_points = Decimal(str(cur.fetchone()['member_points'] or 0))
+                current_points = _to_decimal(cur.fetchone()['member_points'])
                 actual_deduct = min(total_granted, current_points)
                 if actual_deduct > 0:
                     cur.execute("""
@@ -1956,40 +2111,31 @@ class FinanceService:
             result = self.session.execute(
                 """INSERT INTO withdrawals (user_id, amount, tax_amount, actual_amount, status)
                    VALUES (%s, %s, %s, %s, %s)""",
-                {
-                    "user_id": user_id,
-                    "amount": amount_decimal,
-                    "tax_amount": tax_amount,
-                    "actual_amount": actual_amount,
-                    "status": status
-                }
+                (user_id, amount_decimal, tax_amount, actual_amount, status)
             )
             withdrawal_id = result.lastrowid
 
             self.session.execute(
-                f"UPDATE users SET {_quote_identifier(balance_field)} = {_quote_identifier(balance_field)} - :amount WHERE id = :user_id",
-                {"amount": amount_decimal, "user_id": user_id}
-            )
-
-            self._record_flow(
-                account_type=balance_field,
-                related_user=user_id,
-                change_amount=-amount_decimal,
-                flow_type='expense',
-                remark=f"{withdrawal_type}_提现申请冻结 #{withdrawal_id}"
+                f"UPDATE users SET {_quote_identifier(balance_field)} = {_quote_identifier(balance_field)} - %s WHERE id = %s",
+                (amount_decimal, user_id)
             )
 
             self.session.execute(
                 "UPDATE finance_accounts SET balance = balance + %s WHERE account_type = 'company_balance'",
-                {"amount": tax_amount}
+                (tax_amount,)
             )
 
-            self._record_flow(
-                account_type='company_balance',
-                related_user=user_id,
-                change_amount=tax_amount,
-                flow_type='income',
-                remark=f"{withdrawal_type}_提现个税 #{withdrawal_id}"
+            # 冻结流水与个税流水一条语句写入，balance_after 均取更新后的余额
+            self.session.execute(
+                "INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, flow_type, remark, created_at) "
+                f"SELECT %s, %s, %s, COALESCE((SELECT {_quote_identifier(balance_field)} FROM users WHERE id = %s), 0), "
+                "'expense', %s, NOW() "
+                "UNION ALL "
+                "SELECT 'company_balance', %s, %s, "
+                "COALESCE((SELECT balance FROM finance_accounts WHERE account_type = 'company_balance'), 0), "
+                "'income', %s, NOW()",
+                (balance_field, user_id, -amount_decimal, user_id, f"{withdrawal_type}_提现申请冻结 #{withdrawal_id}",
+                 user_id, tax_amount, f"{withdrawal_type}_提现个税 #{withdrawal_id}")
             )
 
             self.session.commit()
@@ -2005,30 +2151,9 @@ class FinanceService:
         """审核提现申请"""
         # ============= 关键修复：移除 try...except，让 FinanceException 直接抛出 =============
 
-        # 查询表结构（只读操作，无需事务）
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SHOW COLUMNS FROM withdrawals")
-                columns = cur.fetchall()
-
         # 执行审核（需要事务）
         with get_conn() as conn:
             with conn.cursor() as cur:
-                # 动态构造SELECT语句并锁定行
-                asset_keywords = ['balance', 'points', 'amount', 'total', 'frozen', 'available', 'tax']
-                select_fields = []
-
-                for col in columns:
-                    field_name = col['Field']
-                    field_type = col['Type'].upper()
-                    is_asset_field = any(keyword in field_name.lower() for keyword in asset_keywords)
-                    is_numeric_type = 'DECIMAL' in field_type or 'INT' in field_type
-
-                    if is_asset_field and is_numeric_type:
-                        select_fields.append(f"COALESCE(`{field_name}`, 0) AS `{field_name}`")
-                    else:
-                        select_fields.append(f"`{field_name}`")
-
                 # 使用条件更新避免长时间锁定行：先尝试原子性更新状态
                 new_status = 'approved' if approve else 'rejected'
                 cur.execute(
@@ -2040,16 +2165,21 @@ class FinanceService:
                 if cur.rowcount == 0:
                     raise FinanceException("提现记录不存在或已处理")
 
-                # 读取记录以便后续处理（短查询）
-                cur.execute(f"SELECT {build_select_list(select_fields)} FROM withdrawals WHERE id = %s",
-                            (withdrawal_id,))
+                # 条件更新成功后只读取后续处理所需的字段（行锁已由 UPDATE 持有，无需 FOR UPDATE）
+                cur.execute(
+                    "SELECT user_id, COALESCE(amount, 0) AS amount, COALESCE(actual_amount, 0) AS actual_amount "
+                    "FROM withdrawals WHERE id = %s",
+                    (withdrawal_id,)
+                )
                 withdraw = cur.fetchone()
 
+                # 流水与余额退回都在同一游标/事务内完成，不再另开连接
                 if approve:
-                    self._record_flow(
+                    self._insert_account_flow(
+                        cur,
                         account_type='withdrawal',
                         related_user=withdraw['user_id'],
-                        change_amount=Decimal(str(withdraw['actual_amount'])),
+                        change_amount=_to_decimal(withdraw['actual_amount']),
                         flow_type='income',
                         remark=f"提现到账 #{withdrawal_id}"
                     )
@@ -2063,10 +2193,11 @@ class FinanceService:
                         (withdraw['amount'], withdraw['user_id'])
                     )
 
-                    self._record_flow(
+                    self._insert_account_flow(
+                        cur,
                         account_type=balance_field,
                         related_user=withdraw['user_id'],
-                        change_amount=Decimal(str(withdraw['amount'])),
+                        change_amount=_to_decimal(withdraw['amount']),
                         flow_type='income',
                         remark=f"提现拒绝退回 #{withdrawal_id}"
                     )
@@ -2078,51 +2209,32 @@ class FinanceService:
 
         # 移除 try...except 块，让 FinanceException 直接向上抛出
 
-    def _record_flow(self, account_type: str, related_user: Optional[int],
-                     change_amount: Decimal, flow_type: str,
-                     remark: str, account_id: Optional[int] = None) -> None:
-        # 兼容封装：使用内部统一的 account_flow 插入函数
-        self._insert_account_flow(account_type=account_type,
-                                  related_user=related_user,
-                                  change_amount=change_amount,
-                                  flow_type=flow_type,
-                                  remark=remark,
-                                  account_id=account_id)
-
     def _insert_account_flow(self, cur, account_type: str, related_user: Optional[int],
                              change_amount: Decimal, flow_type: str,
                              remark: str, account_id: Optional[int] = None) -> None:
-        """插入流水记录（必须使用同一个cur）"""
-        # 修复：移除多余的 cur 参数，直接从 cur 查询余额
-        if related_user and account_type in ['promotion_balance', 'merchant_balance']:
-            # 查询用户余额字段
-            select_sql = build_dynamic_select(
-                cur,
-                "users",
-                where_clause="id=%s",
-                select_fields=[account_type]
+        """插入流水记录（必须使用同一个cur）
+
+        balance_after 通过 INSERT ... SELECT 的子查询在同一条语句中取得，避免先查余额再插入的两次往返。
+        """
+        if related_user and account_type in ('promotion_balance', 'merchant_balance'):
+            # 用户余额字段（account_type 已在白名单内）
+            cur.execute(
+                _user_balance_sql(account_type)[2],
+                (account_id, account_type, related_user, change_amount, related_user, flow_type, remark)
             )
-            cur.execute(select_sql, (related_user,))
-            row = cur.fetchone()
-            balance_after = Decimal(str(row.get(account_type, 0) or 0)) if row else Decimal('0')
         else:
-            # 查询平台资金池余额
-            cur.execute("SELECT balance FROM finance_accounts WHERE account_type = %s", (account_type,))
-            row = cur.fetchone()
-            balance_after = Decimal(str(row['balance'] if row and row['balance'] is not None else 0))
-
-        cur.execute(
-            """INSERT INTO account_flow (account_id, account_type, related_user, change_amount, balance_after, flow_type, remark, created_at)
-               VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())""",
-            (account_id, account_type, related_user, change_amount, balance_after, flow_type, remark)
-        )
+            # 平台资金池余额
+            cur.execute(
+                _INSERT_POOL_FLOW_SQL,
+                (account_id, account_type, related_user, change_amount, account_type, flow_type, remark)
+            )
 
     def _add_pool_balance(self, cur, account_type: str, amount: Decimal, remark: str,
                           related_user: Optional[int] = None) -> Decimal:
         # 使用同一个事务读写，避免跨连接导致未提交余额不可见
         cur.execute("SELECT balance FROM finance_accounts WHERE account_type = %s FOR UPDATE", (account_type,))
         row = cur.fetchone()
-        current_balance = Decimal(str(row['balance'] if row and row['balance'] is not None else 0)) if row else Decimal(
+        current_balance = _to_decimal(row['balance'] if row and row['balance'] is not None else 0) if row else Decimal(
             '0')
 
         # 若账户不存在则先创建，初始余额按当前余额（0）+amount
@@ -2141,94 +2253,129 @@ class FinanceService:
                 message=f"资金池 {account_type} 余额不足，当前: {current_balance:.4f}，需要扣减: {abs(amount):.4f}"
             )
 
-        # 执行余额更新
+        # 执行余额更新；行已被 FOR UPDATE 锁定，更新后余额即 current_balance + amount，无需再回读
         cur.execute(
             "UPDATE finance_accounts SET balance = balance + %s WHERE account_type = %s",
             (amount, account_type)
         )
-
-        # 获取更新后的余额（同一事务）
-        cur.execute("SELECT balance FROM finance_accounts WHERE account_type = %s", (account_type,))
-        row = cur.fetchone()
-        balance_after = Decimal(str(row['balance'] if row and row['balance'] is not None else 0))
+        balance_after = current_balance + amount
 
         # 记录流水
         flow_type = 'income' if amount >= 0 else 'expense'
-        self._insert_account_flow(cur, account_type=account_type, related_user=related_user,
-                                  change_amount=amount, flow_type=flow_type, remark=remark)
+        cur.execute(
+            _INSERT_FLOW_SQL,
+            (account_type, related_user, amount, balance_after, flow_type, remark)
+        )
 
-        logger.debug(f"资金池 {account_type} 余额变更: {amount:.4f}，当前余额: {balance_after:.4f}")
+        logger.debug("资金池 %s 余额变更: %.4f，当前余额: %.4f", account_type, amount, balance_after)
         return balance_after
 
+    def _add_pool_balance_bulk(self, cur, rows: List[tuple], related_user: Optional[int] = None) -> None:
+        """批量变更资金池余额：一次锁定、一条 CASE UPDATE、一条多行流水（必须使用调用方的 cur）。
+
+        rows 每项为 (account_type, amount, remark)，同一账户可出现多次，按顺序逐行校验余额并递推 balance_after。
+        """
+        if not rows:
+            return
+        account_types = list(dict.fromkeys(row[0] for row in rows))
+        placeholders = ",".join(["%s"] * len(account_types))
+        cur.execute(
+            f"SELECT account_type, balance FROM finance_accounts WHERE account_type IN ({placeholders}) FOR UPDATE",
+            account_types
+        )
+        balances = {row['account_type']: _to_decimal(row['balance']) for row in cur.fetchall()}
+
+        missing = [account_type for account_type in account_types if account_type not in balances]
+        if missing:
+            cur.executemany("INSERT INTO finance_accounts (account_type, balance) VALUES (%s, 0)", missing)
+            balances.update((account_type, _D_ZERO) for account_type in missing)
+
+        totals: Dict[str, Decimal] = {}
+        flow_params = []
+        for account_type, amount, remark in rows:
+            current_balance = balances[account_type]
+            if amount < 0 and current_balance + amount < 0:
+                raise InsufficientBalanceException(
+                    f"finance_account:{account_type}",
+                    abs(amount),
+                    current_balance,
+                    message=f"资金池 {account_type} 余额不足，当前: {current_balance:.4f}，需要扣减: {abs(amount):.4f}"
+                )
+            balances[account_type] = current_balance + amount
+            totals[account_type] = totals.get(account_type, _D_ZERO) + amount
+            flow_params.extend((account_type, related_user, amount, balances[account_type],
+                                'income' if amount >= 0 else 'expense', remark))
+
+        case_sql = " ".join(["WHEN %s THEN %s"] * len(totals))
+        cur.execute(
+            f"UPDATE finance_accounts SET balance = balance + CASE account_type {case_sql} END "
+            f"WHERE account_type IN ({placeholders})",
+            (*(v for item in totals.items() for v in item), *account_types)
+        )
+        values_sql = ", ".join(["(%s, %s, %s, %s, %s, %s, NOW())"] * len(rows))
+        cur.execute(
+            "INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, flow_type, remark, created_at) "
+            f"VALUES {values_sql}",
+            flow_params
+        )
+
     # 关键修改：points_log插入支持DECIMAL(12,4)精度
     def _insert_points_log(self, user_id: int, change_amount: Decimal, balance_after: Decimal, type: str, reason: str,
                            related_order: Optional[int] = None) -> None:
         """插入 `points_log` 记录。change_amount 和 balance_after 使用 Decimal 类型，支持小数点后4位精度。"""
         self.session.execute(
-            """INSERT INTO points_log (user_id, change_amount, balance_after, type, reason, related_order, created_at)
-               VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
-            {
-                "user_id": user_id,
-                "change": change_amount,
-                "balance": balance_after,
-                "type": type,
-                "reason": reason,
-                "related_order": related_order
-            }
+            _INSERT_POINTS_LOG_SQL,
+            (user_id, change_amount, balance_after, type, reason, related_order)
         )
 
+    def _insert_points_log_bulk(self, cur, rows: List[tuple], chunk_size: int = 1000) -> None:
+        """批量插入 `points_log`，一条多行 VALUES 语句写入一批记录（必须使用调用方的 cur）。
+
+        rows 每项为 (user_id, change_amount, balance_after, type, reason, related_order)。
+        """
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            values_sql = ", ".join(["(%s, %s, %s, %s, %s, %s, NOW())"] * len(chunk))
+            cur.execute(
+                "INSERT INTO points_log (user_id, change_amount, balance_after, type, reason, related_order, created_at) "
+                f"VALUES {values_sql}",
+                tuple(v for row in chunk for v in row)
+            )
+
     # 关键修改：使用COALESCE处理DECIMAL字段
-    def _update_user_balance(self, user_id: int, field: str, delta: Decimal) -> Decimal:
+    def _update_user_balance(self, user_id: int, field: str, delta: Decimal, cur=None) -> Decimal:
         """对 `users` 表的指定余额字段做增减，并返回更新后的值。
-        注意：`field` 必须是受信任的字段名（由调用处保证）。"""
-        # 安全地引用字段名并使用命名参数执行更新
-        from core.table_access import _quote_identifier
+        注意：`field` 必须是受信任的字段名（由调用处保证）。
 
-        quoted_field = _quote_identifier(field)
-        self.session.execute(
-            f"UPDATE users SET {quoted_field} = COALESCE({quoted_field}, 0) + :delta WHERE id = :user_id",
-            {"delta": delta, "user_id": user_id}
-        )
-        # 使用动态表访问获取更新后的值
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                select_sql = build_dynamic_select(
-                    cur,
-                    "users",
-                    where_clause="id=%s",
-                    select_fields=[field]
-                )
-                cur.execute(select_sql, (user_id,))
-                row = cur.fetchone()
-                return Decimal(str(row.get(field, 0) or 0)) if row else Decimal('0')
-
-    def _get_balance_after(self, account_type: str, related_user: Optional[int] = None) -> Decimal:
-        if related_user and account_type in ['promotion_balance', 'merchant_balance']:
-            field = account_type
-            # 使用动态表访问获取余额
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    select_sql = build_dynamic_select(
-                        cur,
-                        "users",
-                        where_clause="id=%s",
-                        select_fields=[field]
-                    )
-                    cur.execute(select_sql, (related_user,))
-                    row = cur.fetchone()
-                    return Decimal(str(row.get(field, 0) or 0)) if row else Decimal('0')
+        传入 cur 时在调用方的事务/连接内执行；否则使用 self.session 的连接。
+        更新与回读在同一连接上完成，不再另开连接、也不再做表结构探测。"""
+        update_sql, select_sql, _ = _user_balance_sql(field)
+        if cur is not None:
+            cur.execute(update_sql, (delta, user_id))
+            cur.execute(select_sql, (user_id,))
+            row = cur.fetchone()
+        else:
+            self.session.execute(update_sql, (delta, user_id))
+            row = self.session.execute(select_sql, (user_id,)).fetchone()
+        return _to_decimal(row['balance']) if row else Decimal('0')
+
+    def _get_balance_after(self, account_type: str, related_user: Optional[int] = None, cur=None) -> Decimal:
+        """查询变动后的余额；传入 cur 时复用调用方的连接/事务，否则使用 self.session 的连接。"""
+        if related_user and account_type in ('promotion_balance', 'merchant_balance'):
+            sql = _user_balance_sql(account_type)[1]
+            params = (related_user,)
+        else:
+            sql = "SELECT COALESCE(balance, 0) AS balance FROM finance_accounts WHERE account_type = %s"
+            params = (account_type,)
+        if cur is not None:
+            cur.execute(sql, params)
+            row = cur.fetchone()
         else:
-            return self.get_account_balance(account_type)
+            row = self.session.execute(sql, params).fetchone()
+        return _to_decimal(row['balance']) if row else Decimal('0')
 
-    # 在 get_public_welfare_balance 方法中添加
     def get_public_welfare_balance(self) -> Decimal:
-        # ========== 临时日志开始 ==========
-        logger.info("🔍 DEBUG: get_public_welfare_balance 被调用")
-        result = self.get_account_balance('public_welfare')
-        logger.info(f"🔍 DEBUG: get_account_balance 返回: {result} (类型: {type(result)})")
-        return result
-        # ========== 临时日志结束 ==========
-        # return self.get_account_balance('public_welfare')
+        return self.get_account_balance('public_welfare')
 
     # ==================== 可配置资金池分配（新增） ====================
     def get_pool_allocations(self) -> Dict[str, Decimal]:
@@ -2250,11 +2397,12 @@ class FinanceService:
             with conn.cursor() as cur:
                 # 确保表有 config_params 列；如果没有则尝试添加（容错）
                 try:
-                    cur.execute("SHOW COLUMNS FROM finance_accounts LIKE 'config_params'")
-                    if not cur.fetchone():
+                    # 表结构走 table_access 缓存，列已存在时不再每次 SHOW COLUMNS
+                    if 'config_params' not in get_table_structure(cur, "finance_accounts")['fields']:
                         try:
                             cur.execute("ALTER TABLE finance_accounts ADD COLUMN config_params JSON DEFAULT NULL")
                             conn.commit()
+                            clear_table_cache("finance_accounts")
                         except Exception as e:
                             logger.debug(f"无法添加 config_params 列: {e}")
 
@@ -2285,27 +2433,17 @@ class FinanceService:
                             parsed = cp
                         # 支持两种存储形态：{"allocation":"0.01"} 或 直接为字符串数值
                         if isinstance(parsed, dict) and 'allocation' in parsed:
-                            cfg_map[at] = Decimal(str(parsed['allocation']))
+                            cfg_map[at] = _to_decimal(parsed['allocation'])
                         else:
                             # 可能以前误存为单行 allocations_config map
                             # parsed 可能是 {'city_pool':'0.01',...}
                             if isinstance(parsed, dict) and at in parsed:
-                                cfg_map[at] = Decimal(str(parsed[at]))
+                                cfg_map[at] = _to_decimal(parsed[at])
                     except Exception:
                         logger.debug(f"解析 finance_accounts.account_type={at} config_params 失败，忽略")
 
         # 默认配置（数值为相对于总额的占比）
-        defaults = {
-            'merchant_balance': Decimal('0.80'),
-            'public_welfare': Decimal('0.01'),
-            'maintain_pool': Decimal('0.01'),
-            'subsidy_pool': Decimal('0.12'),
-            'director_pool': Decimal('0.02'),
-            'shop_pool': Decimal('0.01'),
-            'city_pool': Decimal('0.01'),
-            'branch_pool': Decimal('0.005'),
-            'fund_pool': Decimal('0.015')
-        }
+        defaults = {'merchant_balance': _MERCHANT_SPLIT_RATIO, **_DEFAULT_POOL_ALLOCATIONS}
 
         # 用读取到的行优先覆盖默认值
         result: Dict[str, Decimal] = defaults.copy()
@@ -2394,71 +2532,80 @@ class FinanceService:
 
     def get_public_welfare_flow(self, limit: int = 50) -> List[Dict[str, Any]]:
         with get_conn() as conn:
-            with conn.cursor() as cur:
+            # 服务端游标逐行读取并直接格式化，不再先 fetchall 缓冲一份原始行
+            with conn.cursor(pymysql.cursors.SSDictCursor) as cur:
                 cur.execute(
                     """SELECT id, related_user, change_amount, balance_after, flow_type, remark, created_at
                        FROM account_flow WHERE account_type = %s
                        ORDER BY created_at DESC LIMIT %s""",
                     ("public_welfare", limit)
                 )
-                flows = cur.fetchall()
-                result = []
-                for f in flows:
+                zero = Decimal('0')
+                return [{
+                    "id": i,
+                    "related_user": u,
+                    "change_amount": float(c),
+                    "balance_after": float(b) if b else None,
                     # 新增：计算操作前余额
-                    pre_balance = Decimal(str(f['balance_after'] or 0)) - Decimal(str(f['change_amount'] or 0))
-                    result.append({
-                        "id": f['id'],
-                        "related_user": f['related_user'],
-                        "change_amount": float(f['change_amount']),
-                        "balance_after": float(f['balance_after']) if f['balance_after'] else None,
-                        "pre_balance": float(pre_balance),  # 新增字段
-                        "flow_type": f['flow_type'],
-                        "remark": f['remark'],
-                        "created_at": f['created_at'].strftime("%Y-%m-%d %H:%M:%S")
-                    })
-                return result
+                    "pre_balance": float((b or zero) - (c or zero)),  # 新增字段
+                    "flow_type": t,
+                    "remark": r,
+                    "created_at": dt.isoformat(sep=" ", timespec="seconds")
+                } for i, u, c, b, t, r, dt in map(_flow_row_fields, cur)]
 
-    def get_public_welfare_report(self, start_date: str, end_date: str) -> Dict[str, Any]:
+    def get_public_welfare_report(self, start_date: str, end_date: str,
+                                  page: int = 1, page_size: int = 20) -> Dict[str, Any]:
         with get_conn() as conn:
             with conn.cursor() as cur:
+                offset = (page - 1) * page_size
+                range_lo, range_hi = _date_range(start_date, end_date)
+
                 # 汇总查询
                 cur.execute(
                     """SELECT COUNT(*) as total_transactions,
                               SUM(CASE WHEN flow_type = 'income' THEN change_amount ELSE 0 END) as total_income,
                               SUM(CASE WHEN flow_type = 'expense' THEN change_amount ELSE 0 END) as total_expense
                        FROM account_flow WHERE account_type = 'public_welfare'
-                       AND DATE(created_at) BETWEEN %s AND %s""",
-                    (start_date, end_date)
+                       AND created_at >= %s AND created_at < %s""",
+                    (range_lo, range_hi)
                 )
                 summary = cur.fetchone()
+                total_count = summary['total_transactions'] or 0
 
-                # 明细查询
+            # 明细查询：分页 + 服务端游标，逐行流式读取并格式化，避免整段区间一次性缓冲
+            with conn.cursor(pymysql.cursors.SSDictCursor) as cur:
                 cur.execute(
                     """SELECT id, related_user, change_amount, balance_after, flow_type, remark, created_at
                        FROM account_flow WHERE account_type = 'public_welfare'
-                       AND DATE(created_at) BETWEEN %s AND %s
-                       ORDER BY created_at DESC""",
-                    (start_date, end_date)
+                       AND created_at >= %s AND created_at < %s
+                       ORDER BY created_at DESC LIMIT %s OFFSET %s""",
+                    (range_lo, range_hi, page_size, offset)
                 )
-                details = cur.fetchall()
+                details = [{
+                    "id": i,
+                    "related_user": u,
+                    "change_amount": float(c),
+                    "balance_after": float(b) if b else None,
+                    "flow_type": t,
+                    "remark": r,
+                    "created_at": dt.isoformat(sep=" ", timespec="seconds")
+                } for i, u, c, b, t, r, dt in map(_flow_row_fields, cur)]
 
-                return {
-                    "summary": {
-                        "total_transactions": summary['total_transactions'] or 0,
-                        "total_income": float(summary['total_income'] or 0),
-                        "total_expense": float(summary['total_expense'] or 0),
-                        "net_balance": float((summary['total_income'] or 0) - (summary['total_expense'] or 0))
-                    },
-                    "details": [{
-                        "id": d['id'],
-                        "related_user": d['related_user'],
-                        "change_amount": float(d['change_amount']),
-                        "balance_after": float(d['balance_after']) if d['balance_after'] else None,
-                        "flow_type": d['flow_type'],
-                        "remark": d['remark'],
-                        "created_at": d['created_at'].strftime("%Y-%m-%d %H:%M:%S")
-                    } for d in details]
-                }
+            return {
+                "summary": {
+                    "total_transactions": total_count,
+                    "total_income": float(summary['total_income'] or 0),
+                    "total_expense": float(summary['total_expense'] or 0),
+                    "net_balance": float((summary['total_income'] or 0) - (summary['total_expense'] or 0))
+                },
+                "pagination": {
+                    "page": page,
+                    "page_size": page_size,
+                    "total": total_count,
+                    "total_pages": (total_count + page_size - 1) // page_size
+                },
+                "details": details
+            }
 
     def set_referrer(self, user_id: int, referrer_id: int) -> bool:
         try:
@@ -2473,28 +2620,23 @@ class FinanceService:
                     )
                     cur.execute(select_sql, (referrer_id,))
                     row = cur.fetchone()
-                    referrer = type('obj', (object,),
-                                    {'member_level': row.get('member_level', 0) or 0 if row else 0})() if row else None
-            if not referrer:
+            if not row:
                 raise FinanceException(f"推荐人不存在: {referrer_id}")
 
             if user_id == referrer_id:
                 raise FinanceException("不能设置自己为推荐人")
 
+            # user_id 唯一：已存在推荐关系时 ON DUPLICATE KEY 不改动任何行（rowcount=0），一条语句完成判重与写入
             result = self.session.execute(
-                "SELECT referrer_id FROM user_referrals WHERE user_id = %s",
-                {"user_id": user_id}
+                "INSERT INTO user_referrals (user_id, referrer_id) VALUES (%s, %s) "
+                "ON DUPLICATE KEY UPDATE user_id = user_id",
+                (user_id, referrer_id)
             )
-            if result.fetchone():
+            if result.rowcount != 1:
                 raise FinanceException("用户已存在推荐人，无法重复设置")
 
-            self.session.execute(
-                "INSERT INTO user_referrals (user_id, referrer_id) VALUES (%s, %s)",
-                {"user_id": user_id, "referrer_id": referrer_id}
-            )
-
             self.session.commit()
-            logger.debug(f"用户{user_id}的推荐人设置为{referrer_id}（{referrer.member_level}星）")
+            logger.debug(f"用户{user_id}的推荐人设置为{referrer_id}（{row.get('member_level', 0) or 0}星）")
             return True
 
         except Exception as e:
@@ -2546,44 +2688,37 @@ class FinanceService:
         try:
             logger.debug("荣誉董事晋升审核")
 
-            result = self.session.execute("SELECT id FROM users WHERE member_level = 6")
-            six_star_users = result.fetchall()
+            # 一条递归 CTE 同时为所有尚未晋升的6星用户统计直推6星数与6层内团队6星数
+            result = self.session.execute(
+                """WITH RECURSIVE team AS (
+                   SELECT ur.referrer_id AS root_id, ur.user_id, 1 AS level
+                   FROM user_referrals ur JOIN users r ON r.id = ur.referrer_id
+                   WHERE r.member_level = 6 AND r.status != 9
+                   UNION ALL
+                   SELECT t.root_id, ur.user_id, t.level + 1
+                   FROM user_referrals ur JOIN team t ON ur.referrer_id = t.user_id
+                   WHERE t.level < 6
+                   )
+                   SELECT t.root_id,
+                          COUNT(DISTINCT CASE WHEN t.level = 1 THEN t.user_id END) AS direct_count,
+                          COUNT(DISTINCT t.user_id) AS total_count
+                   FROM team t JOIN users u ON t.user_id = u.id
+                   WHERE u.member_level = 6
+                   GROUP BY t.root_id
+                   HAVING direct_count >= 3 AND total_count >= 10"""
+            )
+            candidates = result.fetchall()
 
             promoted_count = 0
-            for user in six_star_users:
-                user_id = user.id
-
-                result = self.session.execute(
-                    """SELECT COUNT(DISTINCT u.id) as count
-                       FROM user_referrals ur JOIN users u ON ur.user_id = u.id
-                       WHERE ur.referrer_id = %s AND u.member_level = 6""",
-                    {"user_id": user_id}
-                )
-                direct_count = result.fetchone().count
-
+            if candidates:
+                placeholders = ",".join(["%s"] * len(candidates))
                 result = self.session.execute(
-                    """WITH RECURSIVE team AS (
-                       SELECT user_id, referrer_id, 1 as level FROM user_referrals WHERE referrer_id = %s
-                       UNION ALL
-                       SELECT ur.user_id, ur.referrer_id, t.level + 1
-                       FROM user_referrals ur JOIN team t ON ur.referrer_id = t.user_id
-                       WHERE t.level < 6
-                       )
-                       SELECT COUNT(DISTINCT t.user_id) as count
-                       FROM team t JOIN users u ON t.user_id = u.id
-                       WHERE u.member_level = 6""",
-                    {"user_id": user_id}
+                    f"UPDATE users SET status = 9 WHERE id IN ({placeholders}) AND status != 9",
+                    [row.root_id for row in candidates]
                 )
-                total_count = result.fetchone().count
-
-                if direct_count >= 3 and total_count >= 10:
-                    result = self.session.execute(
-                        "UPDATE users SET status = 9 WHERE id = %s AND status != 9",
-                        {"user_id": user_id}
-                    )
-                    if result.rowcount > 0:
-                        promoted_count += 1
-                        logger.info(f"用户{user_id}晋升为荣誉董事！（直接:{direct_count}, 团队:{total_count}）")
+                promoted_count = result.rowcount
+                for row in candidates:
+                    logger.info(f"用户{row.root_id}晋升为荣誉董事！（直接:{row.direct_count}, 团队:{row.total_count}）")
 
             self.session.commit()
             logger.info(f"荣誉董事审核完成: 晋升{promoted_count}人")
@@ -2647,33 +2782,37 @@ class FinanceService:
                     }
                 }
 
-    def get_user_coupons(self, user_id: int, status: str = 'unused') -> List[Dict[str, Any]]:
-        """查询用户优惠券列表，包含使用范围限制信息"""
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """SELECT id, coupon_type, amount, applicable_product_type, status, valid_from, valid_to, used_at, created_at
-                       FROM coupons WHERE user_id = %s AND status = %s
-                       ORDER BY created_at DESC""",
-                    (user_id, status)
-                )
-                coupons = cur.fetchall()
-                return [{
-                    "id": c['id'],
-                    "coupon_type": c['coupon_type'],
-                    "amount": float(c['amount']),
-                    "applicable_product_type": c['applicable_product_type'],  # 新增
-                    "applicable_product_type_text": {  # 友好显示
-                        'all': '不限制',
-                        'normal_only': '仅普通商品',
-                        'member_only': '仅会员商品'
-                    }.get(c['applicable_product_type'], '未知'),
-                    "status": c['status'],
-                    "valid_from": c['valid_from'].strftime("%Y-%m-%d"),
-                    "valid_to": c['valid_to'].strftime("%Y-%m-%d"),
-                    "used_at": c['used_at'].strftime("%Y-%m-%d %H:%M:%S") if c['used_at'] else None,
-                    "created_at": c['created_at'].strftime("%Y-%m-%d %H:%M:%S")
-                } for c in coupons]
+    def get_user_coupons(self, user_id: int, status: str = 'unused', cur=None) -> List[Dict[str, Any]]:
+        """查询用户优惠券列表，包含使用范围限制信息
+
+        传入 cur 时复用调用方的连接执行查询，不再另取连接。"""
+        if cur is None:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    return self.get_user_coupons(user_id, status, cur=cur)
+        cur.execute(
+            """SELECT id, coupon_type, amount, applicable_product_type, status, valid_from, valid_to, used_at, created_at
+               FROM coupons WHERE user_id = %s AND status = %s
+               ORDER BY created_at DESC""",
+            (user_id, status)
+        )
+        coupons = cur.fetchall()
+        return [{
+            "id": c['id'],
+            "coupon_type": c['coupon_type'],
+            "amount": float(c['amount']),
+            "applicable_product_type": c['applicable_product_type'],  # 新增
+            "applicable_product_type_text": {  # 友好显示
+                'all': '不限制',
+                'normal_only': '仅普通商品',
+                'member_only': '仅会员商品'
+            }.get(c['applicable_product_type'], '未知'),
+            "status": c['status'],
+            "valid_from": c['valid_from'].isoformat(),
+            "valid_to": c['valid_to'].isoformat(),
+            "used_at": c['used_at'].isoformat(sep=" ", timespec="seconds") if c['used_at'] else None,
+            "created_at": c['created_at'].isoformat(sep=" ", timespec="seconds")
+        } for c in coupons]
 
     def get_expiring_coupons(self, user_id: int, days: int = 3) -> List[Dict[str, Any]]:
         """
@@ -2705,9 +2844,9 @@ class FinanceService:
                     "coupon_type": c['coupon_type'],
                     "amount": float(c['amount']),
                     "applicable_product_type": c['applicable_product_type'],
-                    "valid_from": c['valid_from'].strftime("%Y-%m-%d"),
-                    "valid_to": c['valid_to'].strftime("%Y-%m-%d"),
-                    "created_at": c['created_at'].strftime("%Y-%m-%d %H:%M:%S")
+                    "valid_from": c['valid_from'].isoformat(),
+                    "valid_to": c['valid_to'].isoformat(),
+                    "created_at": c['created_at'].isoformat(sep=" ", timespec="seconds")
                 } for c in coupons]
 
     def settle_expired_unused_coupons(self) -> Dict[str, Any]:
@@ -2732,7 +2871,7 @@ class FinanceService:
                 for r in rows:
                     cid = int(r['id'])
                     uid = int(r['user_id'])
-                    amt = Decimal(str(r['amount'] or 0))
+                    amt = _to_decimal(r['amount'])
                     cur.execute(
                         """
                         UPDATE coupons SET status = %s
@@ -2756,7 +2895,7 @@ class FinanceService:
                         )
                         cur.execute("SELECT member_points FROM users WHERE id = %s", (uid,))
                         bal_row = cur.fetchone()
-                        new_bal = Decimal(str(bal_row['member_points'] or 0))
+                        new_bal = _to_decimal(bal_row['member_points'])
                         cur.execute(
                             """INSERT INTO points_log (user_id, change_amount, balance_after, type, reason, related_order, created_at)
                                VALUES (%s, %s, %s, 'member', %s, NULL, NOW())""",
@@ -2776,84 +2915,70 @@ class FinanceService:
     # 供线下模块调用的快捷接口
     # ----------------------------------
 
-    def list_available(self, user_id: int, amount: int = 0) -> List[Dict[str, Any]]:
+    def list_available(self, user_id: int, amount: int = 0, cur=None) -> List[Dict[str, Any]]:
         """
         查询用户当前可用的优惠券列表（线下收银台用）
         :param user_id: 用户ID
         :param amount: 订单金额（分），用于过滤门槛
+        :param cur: 可选，调用方已持有的游标（复用其连接）
         :return: 优惠券列表，元素格式同 get_user_coupons
         """
-        return self.get_user_coupons(user_id, status='unused')
+        return self.get_user_coupons(user_id, status='unused', cur=cur)
 
     # ==================== 关键修改7：财务报告使用member_points ====================
     def get_finance_report(self) -> Dict[str, Any]:
         with get_conn() as conn:
             with conn.cursor() as cur:
-                # 用户资产
+                # 用户资产 + 商家资产 + 优惠券统计合并为一次往返：
+                # users 表只扫描一次，商家资产用条件聚合；coupons 聚合作为派生表交叉连接（两侧均恒为一行）
                 # 关键修改：SUM(member_points)替代SUM(points)
-                cur.execute("SELECT SUM(member_points) as points, SUM(promotion_balance) as balance FROM users")
-                user = cur.fetchone()
-
-                # 商家资产
-                cur.execute("""SELECT SUM(merchant_points) as points, SUM(merchant_balance) as balance
-                              FROM users WHERE merchant_points > 0 OR merchant_balance > 0""")
-                merchant = cur.fetchone()
-
-                # 平台资金池 - 动态构造查询，对资产字段做降级默认值
-                # 先获取表结构
-                cur.execute("SHOW COLUMNS FROM finance_accounts")
-                columns = cur.fetchall()
-
-                # 识别资产字段关键词（数值类型字段）
-                asset_keywords = ['balance', 'points', 'amount', 'total', 'frozen', 'available']
-                from core.table_access import _quote_identifier
-
-                select_fields = []
-                for col in columns:
-                    field_name = col['Field']
-                    field_type = col['Type'].upper()
-                    # 如果是资产相关字段（字段名包含资产关键词）且为数值类型，添加降级默认值
-                    is_asset_field = any(keyword in field_name.lower() for keyword in asset_keywords)
-                    is_numeric_type = 'DECIMAL' in field_type or 'INT' in field_type or 'FLOAT' in field_type or 'DOUBLE' in field_type
-
-                    if is_asset_field and is_numeric_type:
-                        select_fields.append(
-                            f"COALESCE({_quote_identifier(field_name)}, 0) AS {_quote_identifier(field_name)}")
-                    else:
-                        select_fields.append(_quote_identifier(field_name))
+                cur.execute(
+                    """SELECT ua.points, ua.balance, ua.merchant_points, ua.merchant_balance,
+                              cs.coupon_count, cs.coupon_total
+                       FROM (SELECT SUM(member_points) AS points,
+                                    SUM(promotion_balance) AS balance,
+                                    SUM(CASE WHEN merchant_points > 0 OR merchant_balance > 0
+                                             THEN merchant_points END) AS merchant_points,
+                                    SUM(CASE WHEN merchant_points > 0 OR merchant_balance > 0
+                                             THEN merchant_balance END) AS merchant_balance
+                             FROM users) ua
+                       CROSS JOIN (SELECT COUNT(*) AS coupon_count, SUM(amount) AS coupon_total
+                                   FROM coupons WHERE status = 'unused') cs"""
+                )
+                assets = cur.fetchone()
 
-                # 动态构造 SELECT 语句
-                select_sql = f"SELECT {build_select_list(select_fields)} FROM {_quote_identifier('finance_accounts')}"
-                cur.execute(select_sql)
+                # 平台资金池 - 表结构固定，直接使用静态 SELECT；只取余额为正的账户，积分类账户标记在 SQL 中算出
+                cur.execute(
+                    """SELECT account_name, account_type, balance,
+                              account_type LIKE '%points%' AS is_points
+                       FROM finance_accounts WHERE balance > 0"""
+                )
                 pools = cur.fetchall()
 
-                # 优惠券统计
-                cur.execute("""SELECT COUNT(*) as count, SUM(amount) as total_amount
-                              FROM coupons WHERE status = 'unused'""")
-                coupons = cur.fetchone()
-
-                public_welfare_balance = self.get_public_welfare_balance()
-
+                # 公益基金余额直接取自上面的资金池查询结果（未返回即余额不为正，按 0 处理），无需再单独查询
+                public_welfare_balance = Decimal('0')
                 platform_pools = []
                 for pool in pools:
-                    if pool['balance'] > 0:
-                        balance = int(pool['balance']) if 'points' in pool['account_type'] else float(pool['balance'])
-                        platform_pools.append({
-                            "name": pool['account_name'],
-                            "type": pool['account_type'],
-                            "balance": balance
-                        })
+                    if pool['account_type'] == 'public_welfare':
+                        public_welfare_balance = pool['balance']
+                    platform_pools.append({
+                        "name": pool['account_name'],
+                        "type": pool['account_type'],
+                        "balance": int(pool['balance']) if pool['is_points'] else float(pool['balance'])
+                    })
 
+                # 兼容字段 total_points 与 total_member_points 同值，只转换一次
+                total_member_points = float(assets['points'] or 0)
                 return {
                     "user_assets": {
                         # 关键修改：返回member_points
-                        "total_member_points": float(user['points'] or 0),  # 修改：明确member_points
-                        "total_points": float(user['points'] or 0),  # 兼容旧接口
-                        "total_balance": float(user['balance'] or 0)
+                        "total_member_points": total_member_points,  # 修改：明确member_points
+                        "total_points": total_member_points,  # 兼容旧接口
+                        "total_balance": float(assets['balance'] or 0)
                     },
                     "merchant_assets": {
-                        "total_merchant_points": float(merchant['points'] or 0),
-                        "total_balance": float(merchant['balance'] or 0)
+                        "total_merchant_points": float(assets['merchant_points'] or 0),
+                        "total_balance": float(assets['merchant_balance'] or 0)
                     },
                     "platform_pools": platform_pools,
                     "public_welfare_fund": {
@@ -2864,63 +2989,40 @@ class FinanceService:
                         "remark": "该账户自动汇入1%交易额"
                     },
                     "coupons_summary": {
-                        "unused_count": coupons['count'] or 0,
-                        "total_amount": float(coupons['total_amount'] or 0),
+                        "unused_count": assets['coupon_count'] or 0,
+                        "total_amount": float(assets['coupon_total'] or 0),
                         "remark": "周补贴改为发放点数"
                     }
                 }
 
     def get_account_flow_report(self, limit: int = 50) -> List[Dict[str, Any]]:
         with get_conn() as conn:
-            with conn.cursor() as cur:
-                # 获取表结构
-                cur.execute("SHOW COLUMNS FROM account_flow")
-                columns = cur.fetchall()
-
-                # 识别资产字段（DECIMAL 类型字段）
-                asset_fields = set()
-                all_fields = []
-                for col in columns:
-                    field_name = col['Field']
-                    field_type = col['Type'].upper()
-                    all_fields.append(field_name)
-                    # 判断是否为资产字段（DECIMAL 类型）
-                    if 'DECIMAL' in field_type or 'FLOAT' in field_type or 'DOUBLE' in field_type:
-                        asset_fields.add(field_name)
-
-                # 动态构造 SELECT 语句，对资产字段做降级默认值处理
-                from core.table_access import _quote_identifier
-                select_parts = []
-                for field in all_fields:
-                    if field in asset_fields:
-                        select_parts.append(f"COALESCE({_quote_identifier(field)}, 0) AS {_quote_identifier(field)}")
-                    else:
-                        select_parts.append(_quote_identifier(field))
-
-                sql = f"SELECT {build_select_list(select_parts)} FROM {_quote_identifier('account_flow')} ORDER BY created_at DESC LIMIT %s"
-                cur.execute(sql, (limit,))
-                flows = cur.fetchall()
-
-                # 格式化返回结果
-                result = []
-                for f in flows:
-                    item = {}
-                    for field in all_fields:
-                        value = f[field]
-                        if field in asset_fields:
-                            # 资产字段转换为 float
-                            item[field] = float(value) if value is not None else 0.0
-                        elif field == 'created_at' and value:
-                            # 日期字段格式化
-                            if isinstance(value, datetime):
-                                item[field] = value.strftime("%Y-%m-%d %H:%M:%S")
-                            else:
-                                item[field] = str(value)
-                        else:
-                            item[field] = value
-                    result.append(item)
+            # 服务端游标逐行读取，不在客户端额外缓冲整个结果集
+            with conn.cursor(pymysql.cursors.SSDictCursor) as cur:
+                # 表结构固定，直接使用静态 SELECT，对资产字段做降级默认值处理
+                cur.execute(
+                    """SELECT id, account_id, related_user, account_type,
+                              COALESCE(change_amount, 0) AS change_amount,
+                              COALESCE(balance_after, 0) AS balance_after,
+                              flow_type, remark, created_at
+                       FROM account_flow ORDER BY created_at DESC LIMIT %s""",
+                    (limit,)
+                )
 
-                return result
+                # 列集合固定：只有两个资产字段与 created_at 需要转换，直接就地改写游标返回的行，
+                # 省去逐字段遍历与重建字典（资产字段已由 COALESCE 保证非空）
+                fmt_datetime = datetime.isoformat
+                flows = []
+                for f in cur:
+                    f['change_amount'] = float(f['change_amount'])
+                    f['balance_after'] = float(f['balance_after'])
+                    created_at = f['created_at']
+                    if created_at:
+                        f['created_at'] = fmt_datetime(created_at, " ", "seconds") \
+                            if isinstance(created_at, datetime) else str(created_at)
+                    flows.append(f)
+
+                return flows
 
     # ========== 完整函数 1：获取手动调整配置（辅助函数） ==========
     def _get_adjusted_unilevel_amount(self) -> Optional[Decimal]:
@@ -2938,7 +3040,7 @@ class FinanceService:
                             import json
                             config = json.loads(row['config_params'])
                             if 'fixed_amount_per_weight' in config:
-                                return Decimal(str(config['fixed_amount_per_weight']))
+                                return _to_decimal(config['fixed_amount_per_weight'])
                         except (json.JSONDecodeError, KeyError, TypeError):
                             pass
         except Exception as e:
@@ -2976,15 +3078,17 @@ class FinanceService:
             with conn.cursor() as cur:
                 cur.execute("SET time_zone = '+08:00'")
 
-                cur.execute("SELECT SUM(COALESCE(member_points,0)) AS total FROM users")
-                total_member_points = Decimal(str(cur.fetchone().get('total', 0) or 0))
-
-                cur.execute("SELECT SUM(COALESCE(merchant_points,0)) AS total FROM users")
-                total_merchant_points = Decimal(str(cur.fetchone().get('total', 0) or 0))
+                cur.execute(
+                    "SELECT SUM(COALESCE(member_points,0)) AS member_total, "
+                    "SUM(COALESCE(merchant_points,0)) AS merchant_total FROM users"
+                )
+                points_row = cur.fetchone()
+                total_member_points = _to_decimal(points_row['member_total'])
+                total_merchant_points = _to_decimal(points_row['merchant_total'])
 
                 cur.execute("SELECT balance FROM finance_accounts WHERE account_type = 'company_points'")
                 cp_row = cur.fetchone() or {}
-                company_points_balance = Decimal(str(cp_row.get('balance', 0) or 0))
+                company_points_balance = _to_decimal(cp_row.get('balance', 0))
 
                 cur.execute("""
                     SELECT uu.user_id, uu.level, u.name, u.member_level
@@ -3026,7 +3130,7 @@ class FinanceService:
             }
 
         # 3. 计算总权重
-        total_weight = sum(Decimal(str(user['level'])) for user in unilevel_users)
+        total_weight = sum(_to_decimal(user['level']) for user in unilevel_users)
 
         # 4. 自动计算每个权重金额
         amount_per_weight_auto = pool_balance / total_weight if total_weight > 0 else Decimal('0')
@@ -3049,7 +3153,7 @@ class FinanceService:
         users_data = []
 
         for user in unilevel_users:
-            weight = Decimal(str(user['level']))
+            weight = _to_decimal(user['level'])
             theoretical_dividend = amount_per_weight * weight
             actual_dividend = min(theoretical_dividend, MAX_PER_USER)
 
@@ -3153,7 +3257,7 @@ class FinanceService:
                         capped_users = []
                         for user in unilevel_users:
                             weight = int(user['weight'])
-                            theoretical_amount = amount * Decimal(str(weight))
+                            theoretical_amount = amount * weight
 
                             if theoretical_amount > MAX_PER_USER:
                                 capped_users.append({
@@ -3233,7 +3337,7 @@ class FinanceService:
             return False
 
         # 计算总权重
-        total_weight = sum(Decimal(str(user['level'])) for user in unilevel_users)
+        total_weight = sum(_to_decimal(user['level']) for user in unilevel_users)
 
         # 查询分红池余额
         pool_balance = self.get_account_balance('director_pool')
@@ -3257,10 +3361,10 @@ class FinanceService:
                     f"当前余额¥{pool_balance:.4f}"
                 )
 
-            logger.info(f"使用手动调整金额: ¥{amount_per_weight:.4f}/权重")
+            logger.info("使用手动调整金额: ¥%.4f/权重", amount_per_weight)
         else:
             amount_per_weight = pool_balance / total_weight
-            logger.info(f"使用自动计算金额: ¥{amount_per_weight:.4f}/权重")
+            logger.info("使用自动计算金额: ¥%.4f/权重", amount_per_weight)
 
         # 执行分红发放
         try:
@@ -3268,63 +3372,69 @@ class FinanceService:
                 with conn.cursor() as cur:
                     total_distributed = Decimal('0')
                     total_limited = 0  # 记录被限制的用户数
+                    MAX_PER_USER = Decimal('10000.0000')
 
+                    # 先在内存中算出每人实发金额（含单人上限），再按批一次性写入用户点数、流水与分红池扣减
+                    payouts = []
                     for user in unilevel_users:
                         user_id = user['user_id']
-                        weight = Decimal(str(user['level']))
+                        weight = _to_decimal(user['level'])
 
                         # 计算理论发放金额
                         theoretical_amount = amount_per_weight * weight
 
                         # ==================== 新增：限制单个用户上限10,000元 ====================
-                        MAX_PER_USER = Decimal('10000.0000')
                         actual_amount = min(theoretical_amount, MAX_PER_USER)
 
                         if actual_amount != theoretical_amount:
                             total_limited += 1
                             logger.warning(
-                                f"用户{user_id}联创分红金额超限: {theoretical_amount:.4f} -> {actual_amount:.4f} "
-                                f"(权重:{weight}, 上限:{MAX_PER_USER})"
+                                "用户%s联创分红金额超限: %.4f -> %.4f (权重:%s, 上限:%s)",
+                                user_id, theoretical_amount, actual_amount, weight, MAX_PER_USER
                             )
                         # ===================================================================
 
-                        points_to_add = actual_amount
+                        payouts.append((user_id, weight, actual_amount))
+                        total_distributed += actual_amount
+                        logger.debug("用户%s获得联创星级分红: %.4f点数", user_id, actual_amount)
+
+                    # 按用户 id 升序分批写入，保证行锁获取顺序一致
+                    payouts.sort(key=itemgetter(0))
+                    for start in range(0, len(payouts), _SUBSIDY_BATCH_SIZE):
+                        batch = payouts[start:start + _SUBSIDY_BATCH_SIZE]
+                        user_ids = [user_id for user_id, _, _ in batch]
+                        placeholders = ",".join(["%s"] * len(batch))
+                        case_sql = " ".join(["WHEN %s THEN %s"] * len(batch))
+                        case_params = [v for user_id, _, amount in batch for v in (user_id, amount)]
 
-                        # 给用户发放点数
+                        # 给用户发放点数，同时更新真实总点数
                         cur.execute(
-                            "UPDATE users SET points = COALESCE(points, 0) + %s WHERE id = %s",
-                            (points_to_add, user_id)
+                            f"""UPDATE users SET points = COALESCE(points, 0) + CASE id {case_sql} END,
+                                                 true_total_points = true_total_points + CASE id {case_sql} END
+                                WHERE id IN ({placeholders})
+                                ORDER BY id""",
+                            (*case_params, *case_params, *user_ids)
                         )
 
-                        # 同时更新真实总点数
+                        # 记录流水
+                        flow_values = ", ".join(["('director_pool', %s, %s, 0, 'income', %s, NOW())"] * len(batch))
                         cur.execute(
-                            "UPDATE users SET true_total_points = true_total_points + %s WHERE id = %s",
-                            (points_to_add, user_id)
+                            "INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, "
+                            f"flow_type, remark, created_at) VALUES {flow_values}",
+                            [v for user_id, weight, amount in batch
+                             for v in (user_id, amount, f"联创{weight}星级分红（权重{weight}/{total_weight}）")]
                         )
 
-                        # 记录流水
-                        cur.execute("""
-                            INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, 
-                            flow_type, remark, created_at)
-                            VALUES (%s, %s, %s, %s, %s, %s, NOW())
-                        """, ('director_pool', user_id, points_to_add, 0, 'income',
-                              f"联创{weight}星级分红（权重{weight}/{total_weight}）"))
-
-                        # 【关键修复】从 honor_director 池扣除发放的 points_to_add
-                        # 使用 _add_pool_balance（带余额保护）
+                        # 【关键修复】从分红池扣除发放的点数（带余额保护，整批一次锁定与扣减）
                         try:
-                            self._add_pool_balance(
-                                cur, 'director_pool', -points_to_add,
-                                f"联创星级分红发放 - 用户{user_id}获得{points_to_add:.4f}点数",
-                                related_user=None
-                            )
+                            self._add_pool_balance_bulk(cur, [
+                                ('director_pool', -amount, f"联创星级分红发放 - 用户{user_id}获得{amount:.4f}点数")
+                                for user_id, _, amount in batch
+                            ])
                         except InsufficientBalanceException:
-                            logger.error(f"联创分红池余额不足，无法发放用户{user_id}的分红")
+                            logger.error(f"联创分红池余额不足，无法发放本批{len(batch)}名用户的分红")
                             raise FinanceException("联创分红池余额不足，发放失败")
 
-                        total_distributed += points_to_add
-                        logger.debug(f"用户{user_id}获得联创星级分红: {points_to_add:.4f}点数")
-
                     conn.commit()
 
             # 分红成功后，清除手动调整配置（避免下次误用）
@@ -3334,10 +3444,10 @@ class FinanceService:
 
             # ==================== 新增：记录被限制的用户数 ====================
             if total_limited > 0:
-                logger.info(f"联创星级分红完成: 共{len(unilevel_users)}人，发放点数{total_distributed:.4f}，"
-                            f"其中{total_limited}人达到上限10,000元")
+                logger.info("联创星级分红完成: 共%s人，发放点数%.4f，其中%s人达到上限10,000元",
+                            len(unilevel_users), total_distributed, total_limited)
             else:
-                logger.info(f"联创星级分红完成: 共{len(unilevel_users)}人，发放点数{total_distributed:.4f}")
+                logger.info("联创星级分红完成: 共%s人，发放点数%.4f", len(unilevel_users), total_distributed)
             # ===================================================================
 
             return True
@@ -3364,53 +3474,31 @@ class FinanceService:
 
                 cur.execute(sql, tuple(params))
                 flows = cur.fetchall()
+                get = itemgetter('id', 'user_id', 'change_amount', 'balance_after', 'type', 'reason',
+                                 'related_order', 'created_at')
                 return [{
-                    "id": f['id'],
-                    "user_id": f['user_id'],
-                    "change_amount": float(f['change_amount']),
-                    "balance_after": float(f['balance_after']),
-                    "type": f['type'],
-                    "reason": f['reason'],
-                    "related_order": f['related_order'],
-                    "created_at": f['created_at'].strftime("%Y-%m-%d %H:%M:%S")
-                } for f in flows]
+                    "id": i,
+                    "user_id": u,
+                    "change_amount": float(c),
+                    "balance_after": float(b),
+                    "type": t,
+                    "reason": r,
+                    "related_order": o,
+                    "created_at": dt.isoformat(sep=" ", timespec="seconds")
+                } for i, u, c, b, t, r, o, dt in map(get, flows)]
 
     def get_weekly_subsidy_records(self, user_id: Optional[int] = None, limit: int = 50) -> List[Dict[str, Any]]:
-        """查询周补贴记录，动态构造 SELECT 语句，对资产字段做降级默认值处理"""
+        """查询周补贴记录，使用静态 SELECT 语句，对资产字段做降级默认值处理"""
         with get_conn() as conn:
-            with conn.cursor() as cur:
-                # 先获取表结构
-                cur.execute("SHOW COLUMNS FROM weekly_subsidy_records")
-                columns = cur.fetchall()
-                column_names = [col['Field'] for col in columns]
-
-                # 识别资产字段关键词（数值类型字段）
-                asset_keywords = ['amount', 'points', 'balance', 'total', 'frozen', 'available']
-                from core.table_access import _quote_identifier
-
-                select_fields = []
-                asset_fields = []
-                for col in columns:
-                    field_name = col['Field']
-                    field_type = col['Type'].upper()
-                    # 如果是资产相关字段（字段名包含资产关键词）且为数值类型，添加降级默认值
-                    is_asset_field = any(keyword in field_name.lower() for keyword in asset_keywords)
-                    is_numeric_type = 'DECIMAL' in field_type or 'INT' in field_type or 'FLOAT' in field_type or 'DOUBLE' in field_type
-
-                    if is_asset_field and is_numeric_type:
-                        select_fields.append(
-                            f"COALESCE({_quote_identifier('wsr.' + field_name)}, 0) AS {_quote_identifier(field_name)}")
-                        asset_fields.append(field_name)
-                    else:
-                        select_fields.append(_quote_identifier('wsr.' + field_name))
-
-                # 添加用户名称字段
-                select_fields.append(f"{_quote_identifier('u.name')} AS {_quote_identifier('user_name')}")
-
-                # 构造完整的 SELECT 语句
+            # 服务端游标逐行读取，不在客户端额外缓冲整个结果集
+            with conn.cursor(pymysql.cursors.SSDictCursor) as cur:
                 params = [limit]
-                sql = f"""SELECT {build_select_list(select_fields)}
-                         FROM weekly_subsidy_records wsr 
+                sql = """SELECT wsr.id, wsr.user_id, wsr.week_start,
+                                COALESCE(wsr.subsidy_amount, 0) AS subsidy_amount,
+                                COALESCE(wsr.points_before, 0) AS points_before,
+                                COALESCE(wsr.points_deducted, 0) AS points_deducted,
+                                wsr.coupon_id, wsr.remark, wsr.created_at, u.name AS user_name
+                         FROM weekly_subsidy_records wsr
                          LEFT JOIN users u ON wsr.user_id = u.id"""
                 if user_id:
                     sql += " WHERE wsr.user_id = %s"
@@ -3418,99 +3506,128 @@ class FinanceService:
                 sql += " ORDER BY wsr.week_start DESC, wsr.id DESC LIMIT %s"
 
                 cur.execute(sql, tuple(params))
-                records = cur.fetchall()
 
-                # 动态构造返回结果
-                result = []
-                for r in records:
-                    record_dict = {}
-                    for col_name in column_names:
-                        value = r.get(col_name)
-                        # 对资产字段转换为 float，其他字段保持原样
-                        if col_name in asset_fields:
-                            record_dict[col_name] = float(value) if value is not None else 0.0
-                        elif col_name == 'week_start' and value:
-                            record_dict[col_name] = value.strftime("%Y-%m-%d") if hasattr(value, 'strftime') else str(
-                                value)
-                        else:
-                            record_dict[col_name] = value
-                    # 添加用户名称
-                    record_dict['user_name'] = r.get('user_name')
-                    result.append(record_dict)
+                # 列集合固定：资产字段已由 COALESCE 保证非空，直接就地改写游标返回的行，不再逐列重建字典
+                records = []
+                for r in cur:
+                    r['subsidy_amount'] = float(r['subsidy_amount'])
+                    r['points_before'] = float(r['points_before'])
+                    r['points_deducted'] = float(r['points_deducted'])
+                    week_start = r['week_start']
+                    if week_start:
+                        r['week_start'] = week_start.isoformat() if hasattr(week_start, 'isoformat') else str(week_start)
+                    records.append(r)
 
-                return result
+                return records
 
     # ==================== 关键修改9：积分抵扣报表使用member_points ====================
-    def get_points_deduction_report(self, start_date: str, end_date: str, page: int = 1, page_size: int = 20) -> Dict[
-        str, Any]:
+    def get_points_deduction_report(self, start_date: str, end_date: str, page: int = 1, page_size: int = 20,
+                                    include_total: bool = True) -> Dict[str, Any]:
+        """积分抵扣明细报表。
+
+        默认返回总数与汇总；传 include_total=False 时跳过统计（需扫描整个区间的连接结果），
+        只多取一行判断 has_more，适用于"加载更多"式分页。
+        """
         with get_conn() as conn:
             with conn.cursor() as cur:
                 offset = (page - 1) * page_size
+                range_lo, range_hi = _date_range(start_date, end_date)
+                get = itemgetter('order_id', 'order_number', 'user_id', 'user_name', 'member_level',
+                                 'original_amount', 'points_discount', 'total_amount', 'points_used', 'created_at')
 
-                # 总数查询
-                cur.execute(
-                    """SELECT COUNT(*) as total
-                       FROM orders o JOIN points_log pl ON o.id = pl.related_order
-                       WHERE o.points_discount > 0 AND pl.type = 'member' AND pl.reason = '积分抵扣支付'
-                       AND DATE(o.created_at) BETWEEN %s AND %s""",
-                    (start_date, end_date)
-                )
-                total_count = cur.fetchone()['total']
-
-                # 明细查询
-                cur.execute(
-                    """SELECT o.id as order_id, o.order_number, o.user_id, u.name as user_name, u.member_level,
-                              o.original_amount, o.points_discount, o.total_amount, ABS(pl.change_amount) as points_used, o.created_at
-                       FROM orders o JOIN points_log pl ON o.id = pl.related_order JOIN users u ON o.user_id = u.id
-                       WHERE o.points_discount > 0 AND pl.type = 'member' AND pl.reason = '积分抵扣支付'
-                       AND DATE(o.created_at) BETWEEN %s AND %s
-                       ORDER BY o.created_at DESC LIMIT %s OFFSET %s""",
-                    (start_date, end_date, page_size, offset)
-                )
-                records = cur.fetchall()
+                if not include_total:
+                    # 延迟关联：先在 orders 上按 created_at 索引取出一页订单，再只对这一页关联 points_log/users
+                    cur.execute(
+                        """SELECT o.id as order_id, o.order_number, o.user_id, u.name as user_name, u.member_level,
+                                  o.original_amount, o.points_discount, o.total_amount, ABS(pl.change_amount) as points_used, o.created_at
+                           FROM (SELECT id, order_number, user_id, original_amount, points_discount, total_amount, created_at
+                                 FROM orders
+                                 WHERE points_discount > 0 AND created_at >= %s AND created_at < %s
+                                   AND EXISTS (SELECT 1 FROM points_log
+                                               WHERE related_order = orders.id AND type = 'member' AND reason = '积分抵扣支付')
+                                 ORDER BY created_at DESC LIMIT %s OFFSET %s) o
+                           JOIN points_log pl ON o.id = pl.related_order AND pl.type = 'member' AND pl.reason = '积分抵扣支付'
+                           JOIN users u ON o.user_id = u.id
+                           ORDER BY o.created_at DESC""",
+                        (range_lo, range_hi, page_size + 1, offset)
+                    )
+                    records = cur.fetchall()
+                    has_more = len(records) > page_size
+                    records = records[:page_size]
+                    summary = None
+                    pagination = {
+                        "page": page,
+                        "page_size": page_size,
+                        "has_more": has_more
+                    }
+                else:
+                    # 明细 + 总数 + 汇总合并为一次查询：窗口函数在分页前对整个结果集计算
+                    cur.execute(
+                        """SELECT o.id as order_id, o.order_number, o.user_id, u.name as user_name, u.member_level,
+                                  o.original_amount, o.points_discount, o.total_amount, ABS(pl.change_amount) as points_used, o.created_at,
+                                  COUNT(*) OVER () AS total_orders,
+                                  SUM(ABS(pl.change_amount)) OVER () AS total_points,
+                                  SUM(o.points_discount) OVER () AS total_discount_amount
+                           FROM orders o JOIN points_log pl ON o.id = pl.related_order JOIN users u ON o.user_id = u.id
+                           WHERE o.points_discount > 0 AND pl.type = 'member' AND pl.reason = '积分抵扣支付'
+                           AND o.created_at >= %s AND o.created_at < %s
+                           ORDER BY o.created_at DESC LIMIT %s OFFSET %s""",
+                        (range_lo, range_hi, page_size, offset)
+                    )
+                    records = cur.fetchall()
 
-                # 汇总查询
-                cur.execute(
-                    """SELECT COUNT(*) as total_orders, SUM(ABS(pl.change_amount)) as total_points,
-                              SUM(o.points_discount) as total_discount_amount
-                       FROM orders o JOIN points_log pl ON o.id = pl.related_order
-                       WHERE o.points_discount > 0 AND pl.type = 'member' AND pl.reason = '积分抵扣支付'
-                       AND DATE(o.created_at) BETWEEN %s AND %s""",
-                    (start_date, end_date)
-                )
-                summary = cur.fetchone()
+                    if records:
+                        totals = records[0]
+                    elif offset > 0:
+                        # 页码越界时明细为空，窗口汇总随之丢失，此时再补一次汇总查询
+                        cur.execute(
+                            """SELECT COUNT(*) as total_orders, SUM(ABS(pl.change_amount)) as total_points,
+                                      SUM(o.points_discount) as total_discount_amount
+                               FROM orders o JOIN points_log pl ON o.id = pl.related_order JOIN users u ON o.user_id = u.id
+                               WHERE o.points_discount > 0 AND pl.type = 'member' AND pl.reason = '积分抵扣支付'
+                               AND o.created_at >= %s AND o.created_at < %s""",
+                            (range_lo, range_hi)
+                        )
+                        totals = cur.fetchone()
+                    else:
+                        totals = {'total_orders': 0, 'total_points': 0, 'total_discount_amount': 0}
+                    total_count = totals['total_orders'] or 0
 
-                return {
-                    "summary": {
-                        "total_orders": summary['total_orders'] or 0,
+                    summary = {
+                        "total_orders": total_count,
                         # 关键修改：返回float类型的积分总量
-                        "total_points_used": float(summary['total_points'] or 0),
-                        "total_discount_amount": float(summary['total_discount_amount'] or 0)
-                    },
-                    "pagination": {
+                        "total_points_used": float(totals['total_points'] or 0),
+                        "total_discount_amount": float(totals['total_discount_amount'] or 0)
+                    }
+                    pagination = {
                         "page": page,
                         "page_size": page_size,
                         "total": total_count,
                         "total_pages": (total_count + page_size - 1) // page_size
-                    },
+                    }
+
+                return {
+                    "summary": summary,
+                    "pagination": pagination,
                     # 关键修改：将 order_no 改为 order_number
                     "records": [{
-                        "order_id": r['order_id'],
-                        "order_no": r['order_number'],  # 修复字段名
-                        "user_id": r['user_id'],
-                        "user_name": r['user_name'],
-                        "member_level": r['member_level'],
-                        "original_amount": float(r['original_amount']),
-                        "points_discount": float(r['points_discount']),
-                        "total_amount": float(r['total_amount']),
-                        "points_used": float(r['points_used'] or 0),
-                        "created_at": r['created_at'].strftime("%Y-%m-%d %H:%M:%S")
-                    } for r in records]
+                        "order_id": oid,
+                        "order_no": ono,  # 修复字段名
+                        "user_id": uid,
+                        "user_name": uname,
+                        "member_level": level,
+                        "original_amount": float(original),
+                        "points_discount": float(discount),
+                        "total_amount": float(total),
+                        "points_used": float(used or 0),
+                        "created_at": dt.isoformat(sep=" ", timespec="seconds")
+                    } for oid, ono, uid, uname, level, original, discount, total, used, dt in map(get, records)]
                 }
 
     # ==================== 关键修改10：交易链报表 ====================
     def get_transaction_chain_report(self, user_id: int, order_no: Optional[str] = None) -> Dict[str, Any]:
-        with get_conn() as conn:
+        # 只读展示接口：DECIMAL 列由驱动直接解码为 float
+        with get_conn(conv=FLOAT_DECIMAL_CONV) as conn:
             with conn.cursor() as cur:
                 # 订单查询
                 if order_no:
@@ -3542,82 +3659,92 @@ class FinanceService:
                         },
                         "chain": []  # 空链
                     }
-                # 构建推荐链
-                chain = []
-                current_id = user_id
-                level = 0
-
-                while current_id and level < MAX_TEAM_LAYER:
-                    cur.execute(
-                        """SELECT u.id, u.name, u.member_level, ur.referrer_id
-                           FROM users u LEFT JOIN user_referrals ur ON u.id = ur.user_id
-                           WHERE u.id = %s""",
-                        (current_id,)
-                    )
-                    user_info = cur.fetchone()
-                    if not user_info:
-                        break
+                # 各层团队奖励与直推奖励先取回（动态 SELECT 只需构造一次）
+                select_fields, existing_columns = _build_team_rewards_select(cur, ['reward_amount'])
+                # 确保包含 created_at 字段（如果不存在则使用 NULL）
+                if 'created_at' not in existing_columns:
+                    select_fields = select_fields + ", NULL AS created_at"
 
-                    level += 1
-
-                    # 动态构造 SELECT 语句
-                    select_fields, existing_columns = _build_team_rewards_select(cur, ['reward_amount'])
-                    # 确保包含 created_at 字段（如果不存在则使用 NULL）
-                    if 'created_at' not in existing_columns:
-                        select_fields = select_fields + ", NULL AS created_at"
-
-                    cur.execute(
-                        f"SELECT {select_fields} FROM team_rewards WHERE order_id = %s AND layer = %s",
-                        (order['id'], level)
-                    )
-                    team_reward = cur.fetchone()
-
-                    referral_reward = None
-                    if level == 1:
-                        cur.execute(
-                            """SELECT amount FROM pending_rewards
-                               WHERE order_id = %s AND reward_type = 'referral' AND status = 'approved'""",
-                            (order['id'],)
-                        )
-                        ref_reward = cur.fetchone()
-                        if ref_reward:
-                            referral_reward = float(ref_reward['amount'])
+                cur.execute(
+                    f"SELECT {select_fields} FROM team_rewards WHERE order_id = %s AND layer BETWEEN 1 AND %s",
+                    (order['id'], MAX_TEAM_LAYER)
+                )
+                team_rewards_by_layer = {}
+                for row in cur.fetchall():
+                    team_rewards_by_layer.setdefault(row['layer'], row)
 
+                referral_reward = None
+                cur.execute(
+                    """SELECT amount FROM pending_rewards
+                       WHERE order_id = %s AND reward_type = 'referral' AND status = 'approved'""",
+                    (order['id'],)
+                )
+                ref_reward = cur.fetchone()
+                if ref_reward:
+                    referral_reward = ref_reward['amount']
+
+            # 构建推荐链：递归 CTE 一次取回整条推荐人链，服务端游标边读边构造
+            # 递归部分通过 path 排除已出现的用户，防止推荐关系成环时重复展开
+            chain = []
+            visited = set()
+            total_team = 0.0
+            with conn.cursor(pymysql.cursors.SSDictCursor) as ss_cur:
+                ss_cur.execute(
+                    """WITH RECURSIVE ref_chain AS (
+                           SELECT u.id, u.name, u.member_level, ur.referrer_id, 1 AS layer,
+                                  CAST(u.id AS CHAR(1024)) AS path
+                           FROM users u LEFT JOIN user_referrals ur ON u.id = ur.user_id
+                           WHERE u.id = %s
+                           UNION ALL
+                           SELECT u.id, u.name, u.member_level, ur.referrer_id, c.layer + 1,
+                                  CONCAT(c.path, ',', u.id)
+                           FROM ref_chain c
+                           JOIN users u ON u.id = c.referrer_id
+                           LEFT JOIN user_referrals ur ON u.id = ur.user_id
+                           WHERE c.layer < %s AND FIND_IN_SET(u.id, c.path) = 0
+                       )
+                       SELECT id, name, member_level, referrer_id, layer FROM ref_chain ORDER BY layer""",
+                    (user_id, MAX_TEAM_LAYER)
+                )
+                for user_info in ss_cur:
+                    visited.add(user_info['id'])
+                    level = user_info['layer']
+                    team_reward = team_rewards_by_layer.get(level)
+                    team_amount = (team_reward['reward_amount'] or 0.0) if team_reward else 0.0
+                    total_team += team_amount
                     chain.append({
                         "layer": level,
                         "user_id": user_info['id'],
                         "name": user_info['name'],
                         "member_level": user_info['member_level'],
                         "is_referrer": (level == 1),
-                        "referral_reward": referral_reward,
+                        "referral_reward": referral_reward if level == 1 else None,
                         "team_reward": {
-                            "amount": float(team_reward['reward_amount']) if team_reward else 0.00,
+                            "amount": team_amount,
                             "has_reward": team_reward is not None
                         },
                         "referrer_id": user_info['referrer_id']
                     })
 
-                    if not user_info['referrer_id']:
-                        break
-                    current_id = user_info['referrer_id']
+            if chain and chain[-1]['referrer_id'] in visited:
+                logger.warning(f"用户 {user_id} 的推荐链出现循环（用户{chain[-1]['referrer_id']}），已截断")
 
-                total_referral = chain[0]['referral_reward'] if chain and chain[0]['referral_reward'] else 0.00
-                total_team = sum(item['team_reward']['amount'] for item in chain)
+            total_referral = chain[0]['referral_reward'] if chain and chain[0]['referral_reward'] else 0.00
 
-                # 关键修改：将 order_no 改为 order_number
-                return {
-                    "order_id": order['id'],
-                    "order_no": order['order_number'],  # 修复字段名
-                    "is_member_order": bool(order['is_member_order']),
-                    "total_amount": float(order['total_amount']),
-                    "original_amount": float(order['original_amount']),
-                    "reward_summary": {
-                        "total_referral_reward": total_referral,
-                        "total_team_reward": total_team,
-                        "grand_total": total_referral + total_team
-                    },
-                    "chain": chain
-                }
+            # 关键修改：将 order_no 改为 order_number
+            return {
+                "order_id": order['id'],
+                "order_no": order['order_number'],  # 修复字段名
+                "is_member_order": bool(order['is_member_order']),
+                "total_amount": order['total_amount'],
+                "original_amount": order['original_amount'],
+                "reward_summary": {
+                    "total_referral_reward": total_referral,
+                    "total_team_reward": total_team,
+                    "grand_total": total_referral + total_team
+                },
+                "chain": chain
+            }
 
     # ==================== 1. 优惠券直接发放 ====================
     # ==================== 新增：内部发放方法（使用外部游标） ====================
@@ -3628,9 +3755,6 @@ class FinanceService:
         """
         内部方法：在已有事务游标上发放单张优惠券。
         """
-        from datetime import datetime, timedelta
-        from core.table_access import build_dynamic_select
-
         # 1. 检查 true_total_points 余额
         select_sql = build_dynamic_select(
             cur,
@@ -3643,7 +3767,7 @@ class FinanceService:
         if not user_row:
             raise FinanceException(f"用户不存在: {user_id}")
 
-        current_balance = Decimal(str(user_row.get('true_total_points', 0) or 0))
+        current_balance = _to_decimal(user_row.get('true_total_points', 0))
         if current_balance < amount:
             raise FinanceException(
                 f"用户 {user_id} true_total_points 余额不足，当前余额: {current_balance:.4f}，需要 {amount:.4f}"
@@ -3668,9 +3792,7 @@ class FinanceService:
 
         # 4. 记录扣除流水
         cur.execute(
-            """INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, 
-               flow_type, remark, created_at)
-               VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
+            _INSERT_FLOW_SQL,
             ('true_total_points', user_id, -amount, new_balance, 'expense',
              f"发放优惠券扣除 - 优惠券#{coupon_id}，金额¥{amount:.2f}，类型:{applicable_product_type}")
         )
@@ -3853,11 +3975,11 @@ class FinanceService:
                     where.append("af.related_user = %s")
                     params.append(user_id)
                 if start_date:
-                    where.append("DATE(af.created_at) >= %s")
-                    params.append(start_date)
+                    where.append("af.created_at >= %s")
+                    params.append(_day_start(start_date))
                 if end_date:
-                    where.append("DATE(af.created_at) <= %s")
-                    params.append(end_date)
+                    where.append("af.created_at < %s")
+                    params.append(_day_start(end_date) + timedelta(days=1))
 
                 # 总数
                 count_sql = f"SELECT COUNT(*) as total FROM account_flow af WHERE {' AND '.join(where)}"
@@ -3882,7 +4004,7 @@ class FinanceService:
                 records = []
                 for r in rows:
                     # 计算操作前余额
-                    pre_balance = Decimal(str(r['balance_after'] or 0)) - Decimal(str(r['change_amount'] or 0))
+                    pre_balance = _to_decimal(r['balance_after']) - _to_decimal(r['change_amount'])
                     records.append({
                         "log_id": r['id'],
                         "pool_type": r['account_type'],
@@ -3892,7 +4014,7 @@ class FinanceService:
                         "balance_after": float(r['balance_after']) if r['balance_after'] else None,
                         "pre_balance": float(pre_balance),  # 新增字段
                         "remark": r['remark'],
-                        "created_at": r['created_at'].strftime("%Y-%m-%d %H:%M:%S")
+                        "created_at": r['created_at'].isoformat(sep=" ", timespec="seconds")
                     })
 
                 return {
@@ -3952,7 +4074,7 @@ class FinanceService:
                             "points_issued": str(r['points_issued']),
                             "current_points_balance": str(r['current_points'] or 0),
                             "status": "已自动发放",
-                            "created_at": r['created_at'].strftime("%Y-%m-%d %H:%M:%S"),
+                            "created_at": r['created_at'].isoformat(sep=" ", timespec="seconds"),
                             "points_field": "referral_points",
                             "remark": r['remark']
                         } for r in records
@@ -3982,12 +4104,12 @@ class FinanceService:
                     params.append(f"{reward_type}_points")
 
                 if start_date:
-                    where_conditions.append("DATE(af.created_at) >= %s")
-                    params.append(start_date)
+                    where_conditions.append("af.created_at >= %s")
+                    params.append(_day_start(start_date))
 
                 if end_date:
-                    where_conditions.append("DATE(af.created_at) <= %s")
-                    params.append(end_date)
+                    where_conditions.append("af.created_at < %s")
+                    params.append(_day_start(end_date) + timedelta(days=1))
 
                 where_sql = " AND ".join(where_conditions)
 
@@ -4049,7 +4171,7 @@ class FinanceService:
                             "points_issued": str(r['points_issued']),
                             "current_points_balance": str(r['current_points'] or 0),
                             "remark": r['remark'],
-                            "created_at": r['created_at'].strftime("%Y-%m-%d %H:%M:%S"),
+                            "created_at": r['created_at'].isoformat(sep=" ", timespec="seconds"),
                             "points_field": r['account_type'],
                             "status": "已自动发放"
                         } for r in records
@@ -4095,9 +4217,7 @@ class FinanceService:
 
                     # 5. 记录使用流水
                     cur.execute(
-                        """INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, 
-                           flow_type, remark, created_at)
-                           VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
+                        _INSERT_FLOW_SQL,
                         ('coupon', user_id, Decimal('0'), Decimal('0'), 'expense',
                          f"用户使用优惠券 - 优惠券#{coupon_id}，金额¥{float(coupon['amount'])}, 类型:{coupon['applicable_product_type']}")
                     )
@@ -4127,8 +4247,8 @@ class FinanceService:
         with get_conn() as conn:
             with conn.cursor() as cur:
                 # 构建WHERE条件 - ✅ 使用表别名w.避免歧义
-                where_conditions = ["DATE(w.created_at) BETWEEN %s AND %s"]  # ✅ w.created_at
-                params = [start_date, end_date]
+                where_conditions = ["w.created_at >= %s AND w.created_at < %s"]  # ✅ w.created_at
+                params = [*_date_range(start_date, end_date)]
 
                 if user_id:
                     where_conditions.append("w.user_id = %s")  # ✅ w.user_id
@@ -4215,8 +4335,8 @@ class FinanceService:
                                 "approved": "已批准",
                                 "rejected": "已拒绝"
                             }.get(r['status'], "未知"),
-                            "created_at": r['created_at'].strftime("%Y-%m-%d %H:%M:%S"),
-                            "processed_at": r['processed_at'].strftime("%Y-%m-%d %H:%M:%S") if r[
+                            "created_at": r['created_at'].isoformat(sep=" ", timespec="seconds"),
+                            "processed_at": r['processed_at'].isoformat(sep=" ", timespec="seconds") if r[
                                 'processed_at'] else None,
                             "audit_remark": r['audit_remark']
                         } for r in records
@@ -4250,12 +4370,12 @@ class FinanceService:
             params.append(user_id)
 
         if start_date:
-            where_conditions.append("DATE(pl.created_at) >= %s")
-            params.append(start_date)
+            where_conditions.append("pl.created_at >= %s")
+            params.append(_day_start(start_date))
 
         if end_date:
-            where_conditions.append("DATE(pl.created_at) <= %s")
-            params.append(end_date)
+            where_conditions.append("pl.created_at < %s")
+            params.append(_day_start(end_date) + timedelta(days=1))
 
         where_sql = " AND ".join(where_conditions)
 
@@ -4282,7 +4402,7 @@ class FinanceService:
                     """, (user_id, start_date))
                     opening_row = cur.fetchone()
                     if opening_row:
-                        opening_balance = Decimal(str(opening_row['balance_after'] or 0))
+                        opening_balance = _to_decimal(opening_row['balance_after'])
 
                 # 3. 查询明细（分页）
                 offset = (page - 1) * page_size
@@ -4328,7 +4448,7 @@ class FinanceService:
                 if user_id:
                     # 【查询单个用户】从明细记录或用户表获取期末余额
                     if records:
-                        closing_balance = Decimal(str(records[0]['balance_after'] or 0))
+                        closing_balance = _to_decimal(records[0]['balance_after'])
                     else:
                         cur.execute("""
                             SELECT COALESCE(member_points, 0) as current_balance
@@ -4336,7 +4456,7 @@ class FinanceService:
                             WHERE id = %s
                         """, (user_id,))
                         balance_row = cur.fetchone()
-                        closing_balance = Decimal(str(balance_row['current_balance'] if balance_row else 0))
+                        closing_balance = _to_decimal(balance_row['current_balance'] if balance_row else 0)
                 else:
                     # 【查询所有用户】计算总积分作为期末余额
                     cur.execute("""
@@ -4344,7 +4464,7 @@ class FinanceService:
                         FROM users
                     """)
                     total_row = cur.fetchone()
-                    closing_balance = Decimal(str(total_row['total_balance'] if total_row else 0))
+                    closing_balance = _to_decimal(total_row['total_balance'] if total_row else 0)
 
                 # 6. 获取用户信息
                 user_info = None
@@ -4383,7 +4503,7 @@ class FinanceService:
                             "flow_type": "收入" if r['change_amount'] > 0 else "支出",
                             "reason": r['reason'],
                             "related_order_id": r['related_order'],
-                            "created_at": r['created_at'].strftime("%Y-%m-%d %H:%M:%S") if r['created_at'] else None
+                            "created_at": r['created_at'].isoformat(sep=" ", timespec="seconds") if r['created_at'] else None
                         } for r in records
                     ]
                 }
@@ -4399,14 +4519,14 @@ class FinanceService:
                 # 查询平台余额
                 cur.execute("SELECT balance FROM finance_accounts WHERE account_type = %s", (account_type,))
                 account_row = cur.fetchone()
-                actual_current_balance = Decimal(str(account_row['balance'] if account_row else 0))
+                actual_current_balance = _to_decimal(account_row['balance'] if account_row else 0)
 
                 # 智能过滤：只对 honor_director 强制过滤
                 where_conditions = [
                     "account_type = %s",
-                    "DATE(created_at) BETWEEN %s AND %s"
+                    "created_at >= %s AND created_at < %s"
                 ]
-                params = [account_type, start_date, end_date]
+                params = [account_type, *_date_range(start_date, end_date)]
 
                 # 只有联创分红池才过滤 related_user=NULL
                 if account_type == 'honor_director':
@@ -4456,8 +4576,8 @@ class FinanceService:
                         return f"查询失败:{uid}"
 
                 # 计算净变动（保持Decimal类型）
-                total_income = Decimal(str(summary['total_income'] or 0))
-                total_expense = Decimal(str(summary['total_expense'] or 0))
+                total_income = _to_decimal(summary['total_income'])
+                total_expense = _to_decimal(summary['total_expense'])
                 net_change = total_income - total_expense
 
                 # 账户类型中文名称映射
@@ -4504,11 +4624,11 @@ class FinanceService:
                             "balance_after": r['balance_after'],  # 保持原始Decimal类型
                             "flow_type": r['flow_type'],
                             "remark": r['remark'],
-                            "created_at": r['created_at'].strftime("%Y-%m-%d %H:%M:%S")
+                            "created_at": r['created_at'].isoformat(sep=" ", timespec="seconds")
                         } for r in records
                     ],
                     "data_source": "finance_accounts + account_flow",
-                    "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    "last_updated": datetime.now().isoformat(sep=" ", timespec="seconds")
                 }
 
     # ==================== 联创星级点数流水报表 ====================
@@ -4540,12 +4660,12 @@ class FinanceService:
                     query_params.append(level)
 
                 if start_date:
-                    where_conditions.append("DATE(af.created_at) >= %s")
-                    query_params.append(start_date)
+                    where_conditions.append("af.created_at >= %s")
+                    query_params.append(_day_start(start_date))
 
                 if end_date:
-                    where_conditions.append("DATE(af.created_at) <= %s")
-                    query_params.append(end_date)
+                    where_conditions.append("af.created_at < %s")
+                    query_params.append(_day_start(end_date) + timedelta(days=1))
 
                 where_sql = " AND ".join(where_conditions)
 
@@ -4622,7 +4742,7 @@ class FinanceService:
                             "level_name": f"{r['unilevel_level']}星级联创",
                             "points": float(r['points'] or 0),
                             "period_date": r['created_at'].strftime("%Y-%m-%d"),
-                            "created_at": r['created_at'].strftime("%Y-%m-%d %H:%M:%S"),
+                            "created_at": r['created_at'].isoformat(sep=" ", timespec="seconds"),
                             "remark": r['remark']
                         } for r in records
                     ]
@@ -4630,7 +4750,7 @@ class FinanceService:
 
     def clear_fund_pools(self, pool_types: List[str]) -> Dict[str, Any]:
         """清空指定的资金池（增加余额保护）"""
-        logger.info(f"开始清空资金池: {pool_types}")
+        logger.info("开始清空资金池: %s", pool_types)
 
         if not pool_types:
             raise FinanceException("必须指定要清空的资金池类型")
@@ -4641,27 +4761,28 @@ class FinanceService:
             if pool_type not in valid_pools:
                 raise FinanceException(f"无效的资金池类型: {pool_type}")
 
-        # 事务外查询余额
+        # 事务外一次查询全部池子的余额与名称
+        placeholders = ",".join(["%s"] * len(pool_types))
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"SELECT account_type, account_name, balance FROM finance_accounts "
+                    f"WHERE account_type IN ({placeholders})",
+                    tuple(pool_types)
+                )
+                accounts = {row['account_type']: row for row in cur.fetchall()}
+
         pools_to_clear = []
-        for pool_type in pool_types:
-            current_balance = self.get_account_balance(pool_type)
+        for pool_type in dict.fromkeys(pool_types):
+            account = accounts.get(pool_type)
+            current_balance = _to_decimal(account['balance']) if account else _D_ZERO
             if current_balance <= 0:
-                logger.debug(f"资金池 {pool_type} 余额为0，跳过")
+                logger.debug("资金池 %s 余额为0，跳过", pool_type)
                 continue
 
-            # 获取账户名称
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        "SELECT account_name FROM finance_accounts WHERE account_type = %s",
-                        (pool_type,)
-                    )
-                    account = cur.fetchone()
-                    account_name = account['account_name'] if account else pool_type
-
             pools_to_clear.append({
                 "account_type": pool_type,
-                "account_name": account_name,
+                "account_name": account['account_name'] or pool_type,
                 "balance": current_balance
             })
 
@@ -4672,41 +4793,36 @@ class FinanceService:
                 "total_cleared": 0.0
             }
 
-        cleared_pools = []
-        total_cleared = Decimal('0')
-
         try:
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    for pool_info in pools_to_clear:
-                        pool_type = pool_info["account_type"]
-                        account_name = pool_info["account_name"]
-                        current_balance = pool_info["balance"]
-
-                        # 执行清空操作（使用 _add_pool_balance 带余额保护）
-                        try:
-                            self._add_pool_balance(
-                                cur, pool_type, -current_balance,
-                                f"手动清空资金池 - 清空金额¥{current_balance:.2f}",
-                                related_user=None
-                            )
-
-                            cleared_pools.append({
-                                "account_type": pool_type,
-                                "account_name": account_name,
-                                "amount_cleared": float(current_balance),
-                                "previous_balance": float(current_balance)
-                            })
-                            total_cleared += current_balance
-
-                            logger.info(f"已清空资金池 {pool_type}: ¥{current_balance:.2f}")
-                        except InsufficientBalanceException:
-                            logger.error(f"资金池 {pool_type} 余额不足，无法清空")
-                            raise FinanceException(f"资金池 {pool_type} 余额不足，清空失败")
+                    # 一次锁定、一次 UPDATE、一次多行流水 INSERT 清空全部池子（带余额保护）
+                    try:
+                        self._add_pool_balance_bulk(cur, [
+                            (pool_info["account_type"], -pool_info["balance"],
+                             f"手动清空资金池 - 清空金额¥{pool_info['balance']:.2f}")
+                            for pool_info in pools_to_clear
+                        ])
+                    except InsufficientBalanceException as e:
+                        logger.error(f"资金池余额不足，无法清空: {e}")
+                        raise FinanceException("资金池余额不足，清空失败")
 
                     conn.commit()
 
-            logger.info(f"资金池清空完成: 共清空 {len(cleared_pools)} 个，总计 ¥{total_cleared:.2f}")
+            cleared_pools = []
+            total_cleared = Decimal('0')
+            for pool_info in pools_to_clear:
+                current_balance = pool_info["balance"]
+                cleared_pools.append({
+                    "account_type": pool_info["account_type"],
+                    "account_name": pool_info["account_name"],
+                    "amount_cleared": float(current_balance),
+                    "previous_balance": float(current_balance)
+                })
+                total_cleared += current_balance
+                logger.info("已清空资金池 %s: ¥%.2f", pool_info['account_type'], current_balance)
+
+            logger.info("资金池清空完成: 共清空 %s 个，总计 ¥%.2f", len(cleared_pools), total_cleared)
 
             return {
                 "cleared_pools": cleared_pools,
@@ -4818,7 +4934,7 @@ class FinanceService:
                         "record_id": r['id'],
                         "user_id": r['user_id'],
                         "user_name": r['user_name'],
-                        "week_start": r['week_start'].strftime("%Y-%m-%d"),
+                        "week_start": r['week_start'].isoformat(),
                         "subsidy_amount": float(r['subsidy_amount'] or 0),
                         "points_issued": float(r['points_deducted'] or 0),
                         "distribution_type": r['distribution_type'],
@@ -4844,8 +4960,8 @@ class FinanceService:
                     "summary": {
                         "report_type": "weekly_subsidy_with_platform_points",
                         "query_week": f"{year}-W{week:02d}",
-                        "week_start": week_start.strftime("%Y-%m-%d"),
-                        "week_end": week_end.strftime("%Y-%m-%d"),
+                        "week_start": week_start.isoformat(),
+                        "week_end": week_end.isoformat(),
                         "total_users": summary['total_users'] or 0,
                         "total_subsidy_amount": float(summary['total_subsidy_amount'] or 0),
                         "total_points_deducted": float(summary['total_points_deducted'] or 0),
@@ -4952,8 +5068,8 @@ class FinanceService:
                     "summary": {
                         "report_type": "monthly_subsidy_with_platform_points",
                         "query_month": f"{year}-{month:02d}",
-                        "month_start": month_start.strftime("%Y-%m-%d"),
-                        "month_end": month_end.strftime("%Y-%m-%d"),
+                        "month_start": month_start.isoformat(),
+                        "month_end": month_end.isoformat(),
                         "total_users": summary['total_users'] or 0,
                         "total_subsidy_amount": float(summary['total_subsidy_amount'] or 0),
                         "total_points_deducted": float(summary['total_points_deducted'] or 0),
@@ -4973,7 +5089,7 @@ class FinanceService:
                             "record_id": r['id'],
                             "user_id": r['user_id'],
                             "user_name": r['user_name'],
-                            "week_start": r['week_start'].strftime("%Y-%m-%d"),
+                            "week_start": r['week_start'].isoformat(),
                             "subsidy_amount": float(r['subsidy_amount'] or 0),
                             "points_deducted": float(r['points_deducted'] or 0),
                             "distribution_type": r['distribution_type'],
@@ -5021,8 +5137,8 @@ class FinanceService:
         with get_conn() as conn:
             with conn.cursor() as cur:
                 # 构建WHERE条件
-                where_conditions = ["DATE(pl.created_at) BETWEEN %s AND %s", "pl.type = 'member'"]
-                params = [week_start, week_end]
+                where_conditions = ["pl.created_at >= %s AND pl.created_at < %s", "pl.type = 'member'"]
+                params = [*_date_range(week_start, week_end)]
 
                 if user_id:
                     where_conditions.append("pl.user_id = %s")
@@ -5074,8 +5190,8 @@ class FinanceService:
                     "summary": {
                         "report_type": "member_points_weekly",
                         "query_week": f"{year}-W{week:02d}",
-                        "week_start": week_start.strftime("%Y-%m-%d"),
-                        "week_end": week_end.strftime("%Y-%m-%d"),
+                        "week_start": week_start.isoformat(),
+                        "week_end": week_end.isoformat(),
                         "total_users": summary['total_users'] or 0,
                         "total_income": float(summary['total_income'] or 0),
                         "total_expense": float(summary['total_expense'] or 0),
@@ -5096,7 +5212,7 @@ class FinanceService:
                             "balance_after": float(r['balance_after'] or 0),
                             "reason": r['reason'],
                             "related_order": r['related_order'],
-                            "created_at": r['created_at'].strftime("%Y-%m-%d %H:%M:%S"),
+                            "created_at": r['created_at'].isoformat(sep=" ", timespec="seconds"),
                             "flow_type": "收入" if r['change_amount'] > 0 else "支出"
                         } for r in records
                     ]
@@ -5131,8 +5247,8 @@ class FinanceService:
         with get_conn() as conn:
             with conn.cursor() as cur:
                 # 构建WHERE条件
-                where_conditions = ["DATE(pl.created_at) BETWEEN %s AND %s", "pl.type = 'member'"]
-                params = [month_start, month_end]
+                where_conditions = ["pl.created_at >= %s AND pl.created_at < %s", "pl.type = 'member'"]
+                params = [*_date_range(month_start, month_end)]
 
                 if user_id:
                     where_conditions.append("pl.user_id = %s")
@@ -5184,8 +5300,8 @@ class FinanceService:
                     "summary": {
                         "report_type": "member_points_monthly",
                         "query_month": f"{year}-{month:02d}",
-                        "month_start": month_start.strftime("%Y-%m-%d"),
-                        "month_end": month_end.strftime("%Y-%m-%d"),
+                        "month_start": month_start.isoformat(),
+                        "month_end": month_end.isoformat(),
                         "total_users": summary['total_users'] or 0,
                         "total_income": float(summary['total_income'] or 0),
                         "total_expense": float(summary['total_expense'] or 0),
@@ -5206,7 +5322,7 @@ class FinanceService:
                             "balance_after": float(r['balance_after'] or 0),
                             "reason": r['reason'],
                             "related_order": r['related_order'],
-                            "created_at": r['created_at'].strftime("%Y-%m-%d %H:%M:%S"),
+                            "created_at": r['created_at'].isoformat(sep=" ", timespec="seconds"),
                             "flow_type": "收入" if r['change_amount'] > 0 else "支出"
                         } for r in records
                     ]
@@ -5233,8 +5349,8 @@ class FinanceService:
 
         with get_conn() as conn:
             with conn.cursor() as cur:
-                where_conditions = ["DATE(pl.created_at) BETWEEN %s AND %s", "pl.type = 'merchant'"]
-                params = [week_start, week_end]
+                where_conditions = ["pl.created_at >= %s AND pl.created_at < %s", "pl.type = 'merchant'"]
+                params = [*_date_range(week_start, week_end)]
 
                 if user_id:
                     where_conditions.append("pl.user_id = %s")
@@ -5282,8 +5398,8 @@ class FinanceService:
                     "summary": {
                         "report_type": "merchant_points_weekly",
                         "query_week": f"{year}-W{week:02d}",
-                        "week_start": week_start.strftime("%Y-%m-%d"),
-                        "week_end": week_end.strftime("%Y-%m-%d"),
+                        "week_start": week_start.isoformat(),
+                        "week_end": week_end.isoformat(),
                         "total_users": summary['total_users'] or 0,
                         "total_income": float(summary['total_income'] or 0),
                         "total_expense": float(summary['total_expense'] or 0),
@@ -5304,7 +5420,7 @@ class FinanceService:
                             "balance_after": float(r['balance_after'] or 0),
                             "reason": r['reason'],
                             "related_order": r['related_order'],
-                            "created_at": r['created_at'].strftime("%Y-%m-%d %H:%M:%S"),
+                            "created_at": r['created_at'].isoformat(sep=" ", timespec="seconds"),
                             "flow_type": "收入" if r['change_amount'] > 0 else "支出"
                         } for r in records
                     ]
@@ -5324,8 +5440,8 @@ class FinanceService:
 
         with get_conn() as conn:
             with conn.cursor() as cur:
-                where_conditions = ["DATE(pl.created_at) BETWEEN %s AND %s", "pl.type = 'merchant'"]
-                params = [month_start, month_end]
+                where_conditions = ["pl.created_at >= %s AND pl.created_at < %s", "pl.type = 'merchant'"]
+                params = [*_date_range(month_start, month_end)]
 
                 if user_id:
                     where_conditions.append("pl.user_id = %s")
@@ -5373,8 +5489,8 @@ class FinanceService:
                     "summary": {
                         "report_type": "merchant_points_monthly",
                         "query_month": f"{year}-{month:02d}",
-                        "month_start": month_start.strftime("%Y-%m-%d"),
-                        "month_end": month_end.strftime("%Y-%m-%d"),
+                        "month_start": month_start.isoformat(),
+                        "month_end": month_end.isoformat(),
                         "total_users": summary['total_users'] or 0,
                         "total_income": float(summary['total_income'] or 0),
                         "total_expense": float(summary['total_expense'] or 0),
@@ -5395,7 +5511,7 @@ class FinanceService:
                             "balance_after": float(r['balance_after'] or 0),
                             "reason": r['reason'],
                             "related_order": r['related_order'],
-                            "created_at": r['created_at'].strftime("%Y-%m-%d %H:%M:%S"),
+                            "created_at": r['created_at'].isoformat(sep=" ", timespec="seconds"),
                             "flow_type": "收入" if r['change_amount'] > 0 else "支出"
                         } for r in records
                     ]
@@ -5423,30 +5539,22 @@ class FinanceService:
                 pool_balance = self.get_account_balance('subsidy_pool')
 
                 # 2. 计算系统总积分
-                structure = get_table_structure(cur, "users", use_cache=False)
-
-                # 用户积分总计
-                if "member_points" in structure['fields']:
-                    cur.execute(
-                        "SELECT SUM(COALESCE(member_points, 0)) as total FROM users WHERE COALESCE(member_points, 0) > 0")
-                    row = cur.fetchone()
-                    total_user_points = Decimal(str(row.get('total', 0) or 0))
-                else:
-                    total_user_points = Decimal('0')
-
-                # 商家积分总计
-                if "merchant_points" in structure['fields']:
-                    cur.execute(
-                        "SELECT SUM(COALESCE(merchant_points, 0)) as total FROM users WHERE COALESCE(merchant_points, 0) > 0")
-                    row = cur.fetchone()
-                    total_merchant_points = Decimal(str(row.get('total', 0) or 0))
-                else:
-                    total_merchant_points = Decimal('0')
+                structure = get_table_structure(cur, "users")
+
+                # 用户积分总计与商家积分总计（均仅计正数），一次扫描 users；字段不存在时按 0 计
+                member_expr = ("SUM(CASE WHEN member_points > 0 THEN member_points END)"
+                               if "member_points" in structure['fields'] else "0")
+                merchant_expr = ("SUM(CASE WHEN merchant_points > 0 THEN merchant_points END)"
+                                 if "merchant_points" in structure['fields'] else "0")
+                cur.execute(f"SELECT {member_expr} AS member_total, {merchant_expr} AS merchant_total FROM users")
+                row = cur.fetchone()
+                total_user_points = _to_decimal(row['member_total'])
+                total_merchant_points = _to_decimal(row['merchant_total'])
 
                 # 公司积分池（平台积分）
                 cur.execute("SELECT balance as total FROM finance_accounts WHERE account_type = 'company_points'")
                 row = cur.fetchone()
-                company_points = Decimal(str(row.get('total', 0) or 0))
+                company_points = _to_decimal(row.get('total', 0))
 
                 # 平台总和积分 = 商家积分的20% + 消费者积分的100% + 平台储备积分
                 weighted_merchant_points = total_merchant_points
@@ -5488,8 +5596,7 @@ class FinanceService:
                     # 检查补贴池余额是否充足
                     cur.execute("SELECT balance FROM finance_accounts WHERE account_type = 'subsidy_pool'")
                     subsidy_pool_row = cur.fetchone()
-                    current_subsidy_pool = Decimal(
-                        str(subsidy_pool_row['balance'] or 0)) if subsidy_pool_row else Decimal('0')
+                    current_subsidy_pool = _to_decimal(subsidy_pool_row['balance']) if subsidy_pool_row else Decimal('0')
 
                     can_distribute = current_subsidy_pool >= platform_subsidy_amount
 
@@ -5547,7 +5654,7 @@ class FinanceService:
                 total_estimated_subsidy = Decimal('0')  # 追踪总预估补贴金额
 
                 for user in users:
-                    user_points = Decimal(str(user.get('member_points') or 0))
+                    user_points = _to_decimal(user.get('member_points'))
                     estimated_coupon = user_points * points_value
                     total_estimated_subsidy += estimated_coupon
 
@@ -5561,7 +5668,7 @@ class FinanceService:
 
                 # 累加用户26的预估补贴（如果可发放）
                 if user26_preview and user26_preview.get('can_distribute'):
-                    total_estimated_subsidy += Decimal(str(user26_preview['estimated_subsidy_amount']))
+                    total_estimated_subsidy += _to_decimal(user26_preview['estimated_subsidy_amount'])
 
                 logger.info(f"全用户周补贴预览生成完成: 共{len(user_records)}条普通用户记录 + 用户26平台积分发放预览")
 
@@ -5569,8 +5676,8 @@ class FinanceService:
                     "summary": {
                         "report_type": "weekly_subsidy_preview_all_users",
                         "query_week": f"{year}-W{week:02d}",
-                        "week_start": week_start.strftime("%Y-%m-%d"),
-                        "week_end": week_end.strftime("%Y-%m-%d"),
+                        "week_start": week_start.isoformat(),
+                        "week_end": week_end.isoformat(),
                         "total_users_with_points": total_users,
                         "subsidy_pool_balance": float(pool_balance),
                         "total_system_points": float(total_points),
@@ -5625,8 +5732,8 @@ class FinanceService:
         with get_conn() as conn:
             with conn.cursor() as cur:
                 # 1. 构建WHERE条件
-                where_conditions = ["DATE(o.created_at) BETWEEN %s AND %s"]
-                params = [start_date, end_date]
+                where_conditions = ["o.created_at >= %s AND o.created_at < %s"]
+                params = [*_date_range(start_date, end_date)]
 
                 if user_id:
                     where_conditions.append("o.user_id = %s")
@@ -5729,7 +5836,7 @@ class FinanceService:
                         WHERE type = 'member' AND change_amount > 0
                           AND related_order IN ({placeholders})
                     """, params_tuple)
-                    total_user_points = Decimal(str(cur.fetchone()['total_user_points'] or 0))
+                    total_user_points = _to_decimal(cur.fetchone()['total_user_points'])
 
                     # 总抵扣积分
                     cur.execute(f"""
@@ -5738,7 +5845,7 @@ class FinanceService:
                             WHERE type = 'member' AND change_amount < 0
                                 AND related_order IN ({placeholders})
                     """, params_tuple)
-                    total_deducted_points = Decimal(str(cur.fetchone()['total_deducted_points'] or 0))
+                    total_deducted_points = _to_decimal(cur.fetchone()['total_deducted_points'])
 
                     # 总商户积分
                     cur.execute(f"""
@@ -5747,13 +5854,13 @@ class FinanceService:
                             WHERE type = 'merchant'
                                 AND related_order IN ({placeholders})
                     """, params_tuple)
-                    total_merchant_points = Decimal(str(cur.fetchone()['total_merchant_points'] or 0))
+                    total_merchant_points = _to_decimal(cur.fetchone()['total_merchant_points'])
 
                 # 平台积分（company_points）计入总用户积分
                 try:
                     cur.execute("SELECT balance FROM finance_accounts WHERE account_type = 'company_points'")
                     cp_row = cur.fetchone() or {}
-                    platform_points = Decimal(str(cp_row.get('balance', 0) or 0))
+                    platform_points = _to_decimal(cp_row.get('balance', 0))
                 except Exception as e:
                     logger.debug(f"查询平台积分失败，忽略: {e}")
 
@@ -5793,7 +5900,7 @@ class FinanceService:
                         "net_sales": float(order['total_amount']),
                         "user_points_earned": addons['user_earned'],
                         "merchant_points_earned": addons['merchant_earned'],
-                        "created_at": order['created_at'].strftime("%Y-%m-%d %H:%M:%S"),
+                        "created_at": order['created_at'].isoformat(sep=" ", timespec="seconds"),
                         "deduction_rate": f"{deduction_rate:.1f}%"
                     })
 
@@ -5865,7 +5972,7 @@ class FinanceService:
                         "summary": {
                             "total_users": 0,
                             "report_type": "all_points_flow",
-                            "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                            "generated_at": datetime.now().isoformat(sep=" ", timespec="seconds")
                         },
                         "users": []
                     }
@@ -5901,15 +6008,14 @@ class FinanceService:
                     for row in cur.fetchall():
                         uid = row['related_user']
                         account_type = row['account_type']
-                        net_change = Decimal(str(row['total_income'] or 0)) - Decimal(
-                            str(abs(row['total_expense'] or 0)))
+                        net_change = _to_decimal(row['total_income']) - abs(_to_decimal(row['total_expense']))
 
                         if uid in income_map:
                             # true_total_points 的支出是负数
                             if account_type == 'true_total_points':
-                                income_map[uid][account_type] = -Decimal(str(abs(row['total_expense'] or 0)))
+                                income_map[uid][account_type] = -abs(_to_decimal(row['total_expense']))
                             else:
-                                income_map[uid][account_type] = Decimal(str(row['total_income'] or 0))
+                                income_map[uid][account_type] = _to_decimal(row['total_income'])
 
                     # 从 weekly_subsidy_records 查询周补贴点数收入
                     cur.execute(f"""
@@ -5924,7 +6030,7 @@ class FinanceService:
                     for row in cur.fetchall():
                         uid = row['user_id']
                         if uid in income_map:
-                            income_map[uid]['subsidy_points'] = Decimal(str(row['total_subsidy_income'] or 0))
+                            income_map[uid]['subsidy_points'] = _to_decimal(row['total_subsidy_income'])
 
                 # 组装结果（不包含积分流水）
                 result = []
@@ -5939,11 +6045,11 @@ class FinanceService:
                     })
 
                     # 当前余额
-                    subsidy_balance = Decimal(str(user['subsidy_balance']))
-                    referral_balance = Decimal(str(user['referral_balance']))
-                    team_balance = Decimal(str(user['team_balance']))
-                    unilevel_balance = Decimal(str(user['unilevel_balance']))
-                    true_total_balance = Decimal(str(user['true_total_balance']))
+                    subsidy_balance = _to_decimal(user['subsidy_balance'])
+                    referral_balance = _to_decimal(user['referral_balance'])
+                    team_balance = _to_decimal(user['team_balance'])
+                    unilevel_balance = _to_decimal(user['unilevel_balance'])
+                    true_total_balance = _to_decimal(user['true_total_balance'])
 
                     # 各项点数累计收入
                     subsidy_income = user_income['subsidy_points']
@@ -6009,7 +6115,7 @@ class FinanceService:
                     "summary": {
                         "total_users": len(result),
                         "report_type": "all_points_flow",
-                        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        "generated_at": datetime.now().isoformat(sep=" ", timespec="seconds"),
                         "remark": "仅包含点数流水，不包含积分流水（如周补贴扣减积分）"
                     },
                     "users": result
@@ -6052,12 +6158,12 @@ class FinanceService:
                     """, params_tuple)
 
                     for row in cur.fetchall():
-                        income_map[row['related_user']] = Decimal(str(row['total_income']))
+                        income_map[row['related_user']] = _to_decimal(row['total_income'])
 
                 result = []
                 for user in users:
                     uid = user['id']
-                    current_balance = Decimal(str(user['current_balance']))
+                    current_balance = _to_decimal(user['current_balance'])
                     total_earned = income_map.get(uid, Decimal('0'))
                     total_used = max(Decimal('0'), total_earned - current_balance)
 
@@ -6074,7 +6180,7 @@ class FinanceService:
                     "summary": {
                         "total_users": len(result),
                         "report_type": "subsidy_points",
-                        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                        "generated_at": datetime.now().isoformat(sep=" ", timespec="seconds")
                     },
                     "users": result
                 }
@@ -6116,12 +6222,12 @@ class FinanceService:
                     """, params_tuple)
 
                     for row in cur.fetchall():
-                        income_map[row['related_user']] = Decimal(str(row['total_income']))
+                        income_map[row['related_user']] = _to_decimal(row['total_income'])
 
                 result = []
                 for user in users:
                     uid = user['id']
-                    current_balance = Decimal(str(user['current_balance']))
+                    current_balance = _to_decimal(user['current_balance'])
                     total_earned = income_map.get(uid, Decimal('0'))
                     total_used = max(Decimal('0'), total_earned - current_balance)
 
@@ -6138,7 +6244,7 @@ class FinanceService:
                     "summary": {
                         "total_users": len(result),
                         "report_type": "unilevel_points",
-                        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                        "generated_at": datetime.now().isoformat(sep=" ", timespec="seconds")
                     },
                     "users": result
                 }
@@ -6197,7 +6303,7 @@ class FinanceService:
                         uid = row['related_user']
                         if uid not in income_map:
                             income_map[uid] = {}
-                        income_map[uid][row['account_type']] = Decimal(str(row['total_income']))
+                        income_map[uid][row['account_type']] = _to_decimal(row['total_income'])
 
                 result = []
                 for user in users:
@@ -6205,12 +6311,12 @@ class FinanceService:
                     user_income = income_map.get(uid, {})
 
                     # 推荐奖励
-                    referral_balance = Decimal(str(user['referral_balance']))
+                    referral_balance = _to_decimal(user['referral_balance'])
                     referral_earned = user_income.get('referral_points', Decimal('0'))
                     referral_used = max(Decimal('0'), referral_earned - referral_balance)
 
                     # 团队奖励
-                    team_balance = Decimal(str(user['team_balance']))
+                    team_balance = _to_decimal(user['team_balance'])
                     team_earned = user_income.get('team_reward_points', Decimal('0'))
                     team_used = max(Decimal('0'), team_earned - team_balance)
 
@@ -6246,7 +6352,7 @@ class FinanceService:
                     "summary": {
                         "total_users": len(result),
                         "report_type": "referral_and_team_points",
-                        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                        "generated_at": datetime.now().isoformat(sep=" ", timespec="seconds")
                     },
                     "users": result
                 }
@@ -6283,14 +6389,14 @@ class FinanceService:
                     params_wsr.append(user_id)
 
                 if start_date:
-                    where_af.append("DATE(af.created_at) >= %s")
-                    params_account_flow.append(start_date)
+                    where_af.append("af.created_at >= %s")
+                    params_account_flow.append(_day_start(start_date))
                     where_wsr.append("DATE(wsr.week_start) >= %s")
                     params_wsr.append(start_date)
 
                 if end_date:
-                    where_af.append("DATE(af.created_at) <= %s")
-                    params_account_flow.append(end_date)
+                    where_af.append("af.created_at < %s")
+                    params_account_flow.append(_day_start(end_date) + timedelta(days=1))
                     where_wsr.append("DATE(wsr.week_start) <= %s")
                     params_wsr.append(end_date)
 
@@ -6551,7 +6657,7 @@ class FinanceService:
                     if not user_row:
                         raise FinanceException(f"用户不存在: {user_id}")
 
-                    current_balance = Decimal(str(user_row.get('true_total_points', 0) or 0))
+                    current_balance = _to_decimal(user_row.get('true_total_points', 0))
                     user_name = user_row.get('name', f'用户{user_id}')
 
                     # 2. 检查余额是否充足
@@ -6579,13 +6685,11 @@ class FinanceService:
                         "SELECT balance FROM finance_accounts WHERE account_type = 'public_welfare'"
                     )
                     welfare_balance_row = cur.fetchone()
-                    welfare_balance_after = Decimal(str(welfare_balance_row.get('balance', 0) or 0))
+                    welfare_balance_after = _to_decimal(welfare_balance_row.get('balance', 0))
 
                     # 6. 记录用户点数扣除流水（支出）
                     cur.execute(
-                        """INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, 
-                           flow_type, remark, created_at)
-                           VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
+                        _INSERT_FLOW_SQL,
                         ('true_total_points', user_id, -donation_amount, new_balance, 'expense',
                          f"用户捐赠true_total_points到公益基金 - 捐赠金额¥{donation_amount:.4f}")
                     )
@@ -6593,9 +6697,7 @@ class FinanceService:
 
                     # 7. 记录公益基金账户收入流水
                     cur.execute(
-                        """INSERT INTO account_flow (account_type, related_user, change_amount, balance_after, 
-                           flow_type, remark, created_at)
-                           VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
+                        _INSERT_FLOW_SQL,
                         ('public_welfare', user_id, donation_amount, welfare_balance_after, 'income',
                          f"用户 {user_name}(ID:{user_id}) 捐赠true_total_points - 捐赠金额¥{donation_amount:.4f}")
                     )
@@ -6678,9 +6780,9 @@ class FinanceService:
                         # 构建WHERE条件
                         where_conditions = [
                             "account_type = %s",
-                            "DATE(created_at) BETWEEN %s AND %s"
+                            "created_at >= %s AND created_at < %s"
                         ]
-                        params = [pool_type, start_date, end_date]
+                        params = [pool_type, *_date_range(start_date, end_date)]
 
                         # 只有联创分红池过滤 related_user=NULL
                         if pool_type == 'honor_director':
@@ -6712,7 +6814,7 @@ class FinanceService:
                             (pool_type,)
                         )
                         balance_row = cur.fetchone()
-                        ending_balance = Decimal(str(balance_row['balance'] if balance_row else 0))
+                        ending_balance = _to_decimal(balance_row['balance'] if balance_row else 0)
 
                         # 添加到汇总
                         account_name_map = {
@@ -6784,7 +6886,7 @@ class FinanceService:
                         order_flows.append({
                             'flow_id': f"order_{record['order_id']}_user_points",
                             'related_user': record['user_id'],
-                            'change_amount': Decimal(str(record['user_points_earned'])),
+                            'change_amount': _to_decimal(record['user_points_earned']),
                             'balance_after': None,  # 订单流水不记录余额
                             'flow_type': 'income',
                             'remark': f"订单#{record['order_no']} 用户获得积分{record['user_points_earned']:.4f}",
@@ -6797,7 +6899,7 @@ class FinanceService:
                         order_flows.append({
                             'flow_id': f"order_{record['order_id']}_points_deduction",
                             'related_user': record['user_id'],
-                            'change_amount': -Decimal(str(record['points_deduction'])),
+                            'change_amount': -_to_decimal(record['points_deduction']),
                             'balance_after': None,
                             'flow_type': 'expense',
                             'remark': f"订单#{record['order_no']} 积分抵扣¥{record['points_deduction']:.2f}",
@@ -6809,7 +6911,7 @@ class FinanceService:
                     order_flows.append({
                         'flow_id': f"order_{record['order_id']}_platform_income",
                         'related_user': record['user_id'],
-                        'change_amount': Decimal(str(record['net_sales'])),
+                        'change_amount': _to_decimal(record['net_sales']),
                         'balance_after': None,
                         'flow_type': 'income',
                         'remark': f"订单#{record['order_no']} 平台收入¥{record['net_sales']:.2f}（总销售额）",
@@ -6891,7 +6993,7 @@ class FinanceService:
             "summary": {
                 "report_type": "platform_flow_summary",
                 "query_period": f"{start_date} 至 {end_date}",
-                "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "generated_at": datetime.now().isoformat(sep=" ", timespec="seconds"),
                 "total_active_pools": active_pools,
                 "grand_total": {
                     "total_income": grand_total_income,
@@ -7047,11 +7149,11 @@ class FinanceService:
                     member_where.append("pl.user_id = %s")
                     member_params.append(user_id)
                 if start_date:
-                    member_where.append("DATE(pl.created_at) >= %s")
-                    member_params.append(start_date)
+                    member_where.append("pl.created_at >= %s")
+                    member_params.append(_day_start(start_date))
                 if end_date:
-                    member_where.append("DATE(pl.created_at) <= %s")
-                    member_params.append(end_date)
+                    member_where.append("pl.created_at < %s")
+                    member_params.append(_day_start(end_date) + timedelta(days=1))
 
                 member_sql = f"""
                     SELECT 
@@ -7076,11 +7178,11 @@ class FinanceService:
                     merchant_where.append("pl.user_id = %s")
                     merchant_params.append(user_id)
                 if start_date:
-                    merchant_where.append("DATE(pl.created_at) >= %s")
-                    merchant_params.append(start_date)
+                    merchant_where.append("pl.created_at >= %s")
+                    merchant_params.append(_day_start(start_date))
                 if end_date:
-                    merchant_where.append("DATE(pl.created_at) <= %s")
-                    merchant_params.append(end_date)
+                    merchant_where.append("pl.created_at < %s")
+                    merchant_params.append(_day_start(end_date) + timedelta(days=1))
 
                 merchant_sql = f"""
                     SELECT 
@@ -7105,11 +7207,11 @@ class FinanceService:
                     company_where.append("af.related_user = %s")
                     company_params.append(user_id)
                 if start_date:
-                    company_where.append("DATE(af.created_at) >= %s")
-                    company_params.append(start_date)
+                    company_where.append("af.created_at >= %s")
+                    company_params.append(_day_start(start_date))
                 if end_date:
-                    company_where.append("DATE(af.created_at) <= %s")
-                    company_params.append(end_date)
+                    company_where.append("af.created_at < %s")
+                    company_params.append(_day_start(end_date) + timedelta(days=1))
 
                 company_sql = f"""
                     SELECT 
@@ -7459,8 +7561,8 @@ class FinanceService:
                     "status_text": status_map.get(record["status"], record["status"]),
                     "bank_memo": record["bank_memo"],
                     "remark": record["remark"],
-                    "created_at": record["created_at"].strftime("%Y-%m-%d %H:%M:%S") if record["created_at"] else None,
-                    "updated_at": record["updated_at"].strftime("%Y-%m-%d %H:%M:%S") if record["updated_at"] else None,
+                    "created_at": record["created_at"].isoformat(sep=" ", timespec="seconds") if record["created_at"] else None,
+                    "updated_at": record["updated_at"].isoformat(sep=" ", timespec="seconds") if record["updated_at"] else None,
                 }
 
                 if record["status"] == "FAIL" and record["fail_reason"]:
@@ -7489,11 +7591,11 @@ class FinanceService:
                 params = []
 
                 if start_date:
-                    where_conditions.append("DATE(created_at) >= %s")
-                    params.append(start_date)
+                    where_conditions.append("created_at >= %s")
+                    params.append(_day_start(start_date))
                 if end_date:
-                    where_conditions.append("DATE(created_at) <= %s")
-                    params.append(end_date)
+                    where_conditions.append("created_at < %s")
+                    params.append(_day_start(end_date) + timedelta(days=1))
                 if status:
                     where_conditions.append("status = %s")
                     params.append(status)
@@ -7540,8 +7642,8 @@ class FinanceService:
                         "bank_memo": r["bank_memo"],
                         "remark": r["remark"],
                         "fail_reason": r["fail_reason"],
-                        "created_at": r["created_at"].strftime("%Y-%m-%d %H:%M:%S") if r["created_at"] else None,
-                        "updated_at": r["updated_at"].strftime("%Y-%m-%d %H:%M:%S") if r["updated_at"] else None,
+                        "created_at": r["created_at"].isoformat(sep=" ", timespec="seconds") if r["created_at"] else None,
+                        "updated_at": r["updated_at"].isoformat(sep=" ", timespec="seconds") if r["updated_at"] else None,
                     })
 
                 # 汇总统计
@@ -7750,7 +7852,7 @@ class FinanceService:
                         coupon_sheet.cell(row=row_idx, column=4, value=float(row['amount']))
                         coupon_sheet.cell(row=row_idx, column=5, value=row['applicable_product_type'])
                         coupon_sheet.cell(row=row_idx, column=6,
-                                          value=row['used_at'].strftime("%Y-%m-%d %H:%M:%S") if row['used_at'] else "")
+                                          value=row['used_at'].isoformat(sep=" ", timespec="seconds") if row['used_at'] else "")
                         coupon_sheet.cell(row=row_idx, column=7, value=row['order_number'] or "")
                     self._auto_adjust_columns(coupon_sheet)
 
@@ -7792,7 +7894,7 @@ class FinanceService:
                         points_sheet.cell(row=row_idx, column=8, value=row['reason'] or row['remark'] or "")
                         points_sheet.cell(row=row_idx, column=9, value=row['related_order'] or "")
                         points_sheet.cell(row=row_idx, column=10,
-                                          value=row['created_at'].strftime("%Y-%m-%d %H:%M:%S") if row[
+                                          value=row['created_at'].isoformat(sep=" ", timespec="seconds") if row[
                                               'created_at'] else "")
                     self._auto_adjust_columns(points_sheet)
 
@@ -7930,7 +8032,7 @@ class FinanceService:
                 row = cur.fetchone()
                 if not row:
                     raise FinanceException("用户不存在")
-                return Decimal(str(row.get('true_total_points', 0) or 0))
+                return _to_decimal(row.get('true_total_points', 0))
 
     def exchange_coupons(self, user_id: int, count: int) -> int:
         """
@@ -7954,7 +8056,7 @@ class FinanceService:
                 if not row:
                     raise FinanceException("用户不存在")
 
-                balance = Decimal(str(row['true_total_points'] or 0))
+                balance = _to_decimal(row['true_total_points'])
                 if balance < count:
                     raise InsufficientBalanceException(
                         f"user:{user_id}:true_total_points",
@@ -8116,18 +8218,12 @@ def _build_team_rewards_select(cursor, asset_fields: List[str] = None) -> tuple:
     if asset_fields is None:
         asset_fields = ['reward_amount']
 
-    # 获取表结构
-    cursor.execute("SHOW COLUMNS FROM team_rewards")
-    columns = cursor.fetchall()
-    existing_columns = {col['Field'] for col in columns}
+    # 表结构走 table_access 的缓存（schema 变更时由 clear_table_cache 失效），避免每次 SHOW COLUMNS
+    fields = get_table_structure(cursor, "team_rewards")['fields']
+    existing_columns = set(fields)
 
     # 构造 SELECT 字段列表
-    from core.table_access import _quote_identifier
-
-    select_fields = []
-    for col in columns:
-        field_name = col['Field']
-        select_fields.append(_quote_identifier(field_name))
+    select_fields = [_quote_identifier(field_name) for field_name in fields]
 
     # 对于资产字段，如果不存在则添加默认值
     for asset_field in asset_fields:
@@ -8146,26 +8242,14 @@ def split_order_funds(order_number: str, total: Decimal, is_vip: bool, cursor=No
         is_vip: 是否为会员订单
         cursor: 数据库游标（可选），如果提供则在同一事务中执行
     """
-    from core.database import get_conn
-
     if cursor is not None:
-        cur = cursor
-        use_external_cursor = True
-    else:
-        use_external_cursor = False
+        _execute_split(cursor, order_number, total)
+        return
 
-    try:
-        if not use_external_cursor:
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    _execute_split(cur, order_number, total)
-                    conn.commit()
-        else:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
             _execute_split(cur, order_number, total)
-    except Exception as e:
-        if not use_external_cursor:
-            raise
-        raise
+            conn.commit()
 
 
 def _execute_split(cur, order_number: str, total: Decimal):
@@ -8180,9 +8264,9 @@ def _execute_split(cur, order_number: str, total: Decimal):
     try:
         svc = FinanceService()
         allocs = svc.get_pool_allocations()
-        merchant = total * allocs.get('merchant_balance', Decimal('0.8'))
+        merchant = total * allocs.get('merchant_balance', _MERCHANT_SPLIT_RATIO)
     except Exception:
-        merchant = total * Decimal("0.8")
+        merchant = total * _MERCHANT_SPLIT_RATIO
 
     # 单元级日志：记录订单与初始分配信息
     try:
@@ -8204,31 +8288,17 @@ def _execute_split(cur, order_number: str, total: Decimal):
     # 记录完整支付链路（100% 收入 → 80% 商家 + 20% 各池）
     svc = FinanceService()
 
-    # ① 平台收入池 +100%
-    svc._add_pool_balance(cur, 'platform_revenue_pool', total,
-                          f"订单分账: {order_number} 用户支付¥{total:.2f}", None)
-
-    # ② 平台收入池 -80%（商家部分）
-    svc._add_pool_balance(cur, 'platform_revenue_pool', -merchant,
-                          f"订单分账: {order_number} 商家结算¥{merchant:.2f}", None)
+    # ① 平台收入池 +100%；② 平台收入池 -80%（商家部分）—— 一次锁定、一条 UPDATE、一条两行流水
+    svc._add_pool_balance_bulk(cur, [
+        ('platform_revenue_pool', total, f"订单分账: {order_number} 用户支付¥{total:.2f}"),
+        ('platform_revenue_pool', -merchant, f"订单分账: {order_number} 商家结算¥{merchant:.2f}"),
+    ])
 
     # ③ 各子池 20% 支出（已在下方 for 循环里记收入，保持不动）
-    # 获取商家余额
-    select_sql = build_dynamic_select(
-        cur,
-        "users",
-        where_clause="id=1",
-        select_fields=["merchant_balance"]
-    )
-    cur.execute(select_sql)
-    merchant_balance_row = cur.fetchone()
-    merchant_balance_after = merchant_balance_row["merchant_balance"] if merchant_balance_row else merchant
-
-    # 记录商家流水到 account_flow
+    # 记录商家流水到 account_flow（balance_after 取更新后的商家余额）
     cur.execute(
-        """INSERT INTO account_flow (account_type, change_amount, balance_after, flow_type, remark, created_at)
-           VALUES (%s, %s, %s, %s, %s, NOW())""",
-        ("merchant_balance", merchant, merchant_balance_after, "income", f"订单分账: {order_number}")
+        _SPLIT_FLOW_INSERT_SQL + _SPLIT_MERCHANT_FLOW_ROW,
+        ("merchant_balance", merchant, merchant, "income", f"订单分账: {order_number}", order_number)
     )
 
     # 按每个子池的配置分配（allocs 中的键是 account_type）
@@ -8236,126 +8306,102 @@ def _execute_split(cur, order_number: str, total: Decimal):
         # pools_to_assign: keys except merchant_balance
         pools_to_assign = {k: v for k, v in allocs.items() if k != 'merchant_balance'}
     except Exception:
-        pools_to_assign = {
-            'public_welfare': Decimal('0.01'),
-            'maintain_pool': Decimal('0.01'),
-            'subsidy_pool': Decimal('0.12'),
-            'director_pool': Decimal('0.02'),
-            'shop_pool': Decimal('0.01'),
-            'city_pool': Decimal('0.01'),
-            'branch_pool': Decimal('0.005'),
-            'fund_pool': Decimal('0.015')
-        }
-
-    for account_type, ratio in pools_to_assign.items():
-        if account_type == 'public_welfare':
-            continue  # ← 新增：不再重复写公益基金
-        try:
-            amt = total * ratio
-            # 单元级日志：准备分配到指定资金池的金额与比例
-            logger.debug(f"_execute_split allocating to {account_type}: ratio={ratio} amt={amt:.2f}")
-
-            # 确保 finance_accounts 中存在该账户类型
-            cur.execute(
-                "INSERT INTO finance_accounts (account_name, account_type, balance) VALUES (%s, %s, 0) ON DUPLICATE KEY "
-                "UPDATE account_name=VALUES(account_name)",
-                (account_type, account_type)
-            )
-
-            # 更新资金池余额
-            cur.execute(
-                "UPDATE finance_accounts SET balance = balance + %s WHERE account_type = %s",
-                (amt, account_type)
-            )
+        pools_to_assign = _DEFAULT_POOL_ALLOCATIONS
+
+    # 公益基金已单独入账，这里不再重复写
+    amounts = [(account_type, total * ratio) for account_type, ratio in pools_to_assign.items()
+               if account_type != 'public_welfare']
+    if not amounts:
+        return
+    for account_type, amt in amounts:
+        # 单元级日志：准备分配到指定资金池的金额
+        logger.debug(f"_execute_split allocating to {account_type}: amt={amt:.2f}")
+
+    account_types = [account_type for account_type, _ in amounts]
+    placeholders = ", ".join(["%s"] * len(account_types))
+    try:
+        # 确保 finance_accounts 中存在这些账户类型（executemany 合并为一条多行 upsert）
+        _ensure_pool_accounts(cur, account_types)
 
-            # 获取更新后的余额
-            select_sql = build_dynamic_select(
-                cur,
-                "finance_accounts",
-                where_clause="account_type = %s",
-                select_fields=["balance"]
-            )
-            cur.execute(select_sql, (account_type,))
-            balance_row = cur.fetchone()
-            balance_after = balance_row["balance"] if balance_row else amt
+        # 一条 UPDATE 按 account_type 分别累加各池余额
+        case_sql = " ".join(["WHEN %s THEN balance + %s"] * len(amounts))
+        case_params = [v for account_type, amt in amounts for v in (account_type, amt)]
+        cur.execute(
+            f"UPDATE finance_accounts SET balance = CASE account_type {case_sql} ELSE balance END "
+            f"WHERE account_type IN ({placeholders})",
+            tuple(case_params + account_types)
+        )
 
-            # 记录流水到 account_flow
-            cur.execute(
-                """INSERT INTO account_flow (account_type, change_amount, balance_after, flow_type, remark, created_at)
-                   VALUES (%s, %s, %s, %s, %s, NOW())""",
-                (account_type, amt, balance_after, "income", f"订单分账: {order_number}")
-            )
-            # 单元级日志：记录分配后余额
-            try:
-                logger.debug(f"_execute_split {account_type} balance_after={Decimal(str(balance_after)):.2f}")
-            except Exception:
-                logger.debug(f"_execute_split {account_type} balance_after (unserializable): {balance_after}")
-        except Exception as e:
-            logger.error(f"分配到池子 {account_type} 时出错: {e}")
+        # 记录流水到 account_flow（多行 VALUES 一次写入，balance_after 取更新后的池余额）
+        remark = f"订单分账: {order_number}"
+        flow_params = []
+        for account_type, amt in amounts:
+            flow_params.extend((account_type, amt, account_type, amt, "income", remark, order_number))
+        cur.execute(
+            _SPLIT_FLOW_INSERT_SQL + ", ".join([_SPLIT_POOL_FLOW_ROW] * len(amounts)),
+            tuple(flow_params)
+        )
+    except Exception as e:
+        logger.error(f"分配到资金池 {account_types} 时出错: {e}")
 
 
 def reverse_split_on_refund(order_number: str):
     """退款回冲：撤销订单分账"""
-    from core.database import get_conn
-    from decimal import Decimal
-
     with get_conn() as conn:
         with conn.cursor() as cur:
-            # 从 account_flow 查询商家分得金额
+            # 按订单号（索引列）一次汇总商家及各资金池的分账收入，同时锁定该订单的全部流水行：
+            # 同一订单的并发回冲（如重复回调）在此串行化，后到者读到已写入的回冲流水后直接返回。
+            # 不锁 orders 行：调用方在各自连接上已持有该行锁，这里再锁会自我等待。
             cur.execute(
-                """SELECT SUM(change_amount) AS m FROM account_flow 
-                   WHERE account_type='merchant_balance' AND remark LIKE %s AND flow_type='income'""",
-                (f"订单分账: {order_number}%",)
+                """SELECT account_type,
+                          SUM(CASE WHEN flow_type = 'income' THEN change_amount ELSE 0 END) AS amt,
+                          SUM(flow_type = 'expense') AS reversed_rows
+                   FROM account_flow
+                   WHERE order_number = %s
+                   GROUP BY account_type
+                   FOR UPDATE""",
+                (order_number,)
             )
-            m = cur.fetchone()["m"] or Decimal("0")
+            rows = cur.fetchall()
+            if any(row['reversed_rows'] for row in rows):
+                logger.warning("订单 %s 的分账已回冲过，跳过重复回冲", order_number)
+                return
+            split_amounts = {row['account_type']: row['amt'] or _D_ZERO for row in rows}
+            remark = f"退款回冲: {order_number}"
 
+            m = split_amounts.get('merchant_balance', _D_ZERO)
             if m > 0:
                 # 回冲商家余额
                 cur.execute(
                     "UPDATE users SET merchant_balance=merchant_balance-%s WHERE id=1",
                     (m,)
                 )
-                # 获取回冲后的余额
-                cur.execute("SELECT merchant_balance FROM users WHERE id=1")
-                merchant_balance_after = cur.fetchone()["merchant_balance"]
-                # 记录回冲流水
+                # 记录回冲流水（balance_after 取回冲后的商家余额）
                 cur.execute(
-                    """INSERT INTO account_flow (account_type, change_amount, balance_after, flow_type, remark, created_at)
-                       VALUES (%s, %s, %s, %s, %s, NOW())""",
-                    ("merchant_balance", -m, merchant_balance_after, "expense", f"退款回冲: {order_number}")
+                    _SPLIT_FLOW_INSERT_SQL + _SPLIT_MERCHANT_FLOW_ROW,
+                    ("merchant_balance", -m, None, "expense", remark, order_number)
                 )
 
-            # 回冲各个资金池
-            pool_mapping = {
-                "public": "public_welfare",
-                "maintain": "maintain_pool",
-                "subsidy": "subsidy_pool",
-                "director": "director_pool",
-                "shop": "shop_pool",
-                "city": "city_pool",
-                "branch": "branch_pool",
-                "fund": "fund_pool"
-            }
-
-            for pool_key, account_type in pool_mapping.items():
+            # 回冲各个资金池：一条 UPDATE + 一条多行流水 INSERT
+            pool_amounts = [(account_type, split_amounts[account_type]) for _, account_type, _ in _POOL_SPEC
+                            if split_amounts.get(account_type, _D_ZERO) > 0]
+            if pool_amounts:
+                account_types = [account_type for account_type, _ in pool_amounts]
+                placeholders = ", ".join(["%s"] * len(account_types))
+                case_sql = " ".join(["WHEN %s THEN balance - %s"] * len(pool_amounts))
+                case_params = [v for account_type, amt in pool_amounts for v in (account_type, amt)]
                 cur.execute(
-                    """SELECT SUM(change_amount) AS amt FROM account_flow 
-                       WHERE account_type=%s AND remark LIKE %s AND flow_type='income'""",
-                    (account_type, f"订单分账: {order_number}%")
+                    f"UPDATE finance_accounts SET balance = CASE account_type {case_sql} ELSE balance END "
+                    f"WHERE account_type IN ({placeholders})",
+                    tuple(case_params + account_types)
+                )
+                flow_params = []
+                for account_type, pool_amt in pool_amounts:
+                    flow_params.extend((account_type, -pool_amt, account_type, None, "expense", remark, order_number))
+                cur.execute(
+                    _SPLIT_FLOW_INSERT_SQL + ", ".join([_SPLIT_POOL_FLOW_ROW] * len(pool_amounts)),
+                    tuple(flow_params)
                 )
-                pool_amt = cur.fetchone()["amt"] or Decimal("0")
-                if pool_amt > 0:
-                    cur.execute(
-                        "UPDATE finance_accounts SET balance = balance - %s WHERE account_type = %s",
-                        (pool_amt, account_type)
-                    )
-                    cur.execute("SELECT balance FROM finance_accounts WHERE account_type = %s", (account_type,))
-                    balance_after = cur.fetchone()["balance"]
-                    cur.execute(
-                        """INSERT INTO account_flow (account_type, change_amount, balance_after, flow_type, remark, created_at)
-                           VALUES (%s, %s, %s, %s, %s, NOW())""",
-                        (account_type, -pool_amt, balance_after, "expense", f"退款回冲: {order_number}")
-                    )
             conn.commit()
 
 
@@ -8368,8 +8414,6 @@ def get_balance(merchant_id: int = 1):
     返回:
         dict: 包含 merchant_balance, bank_name, bank_account 的字典
     """
-    from core.database import get_conn
-
     with get_conn() as conn:
         with conn.cursor() as cur:
             # 修改为从 users 表获取 merchant_balance 字段
@@ -8379,9 +8423,9 @@ def get_balance(merchant_id: int = 1):
             )
             row = cur.fetchone()
             if not row:
-                # 如果不存在，创建初始记录
+                # 如果不存在，创建初始记录；INSERT IGNORE 兜住并发调用同时未命中时的主键冲突
                 cur.execute(
-                    "INSERT INTO users (id, merchant_balance, bank_name, bank_account) VALUES (%s, 0, '', '')",
+                    "INSERT IGNORE INTO users (id, merchant_balance, bank_name, bank_account) VALUES (%s, 0, '', '')",
                     (merchant_id,)
                 )
                 conn.commit()
@@ -8397,24 +8441,14 @@ def bind_bank(bank_name: str, bank_account: str, merchant_id: int = 1):
         bank_account: 银行账号
         merchant_id: 商家ID，默认为1
     """
-    from core.database import get_conn
-
     with get_conn() as conn:
         with conn.cursor() as cur:
-            # 检查是否存在该商家
-            cur.execute("SELECT 1 FROM users WHERE id=%s", (merchant_id,))
-            if cur.fetchone():
-                # 更新现有记录
-                cur.execute(
-                    "UPDATE users SET bank_name=%s, bank_account=%s WHERE id=%s",
-                    (bank_name, bank_account, merchant_id)
-                )
-            else:
-                # 插入新记录
-                cur.execute(
-                    "INSERT INTO users (id, bank_name, bank_account) VALUES (%s, %s, %s)",
-                    (merchant_id, bank_name, bank_account)
-                )
+            # 存在则更新、不存在则插入：一条 upsert 完成，避免先查后写的并发竞态
+            cur.execute(
+                "INSERT INTO users (id, bank_name, bank_account) VALUES (%s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE bank_name = VALUES(bank_name), bank_account = VALUES(bank_account)",
+                (merchant_id, bank_name, bank_account)
+            )
             conn.commit()
 
 
@@ -8428,24 +8462,15 @@ def withdraw(amount: Decimal, merchant_id: int = 1) -> bool:
     返回:
         bool: 提现是否成功
     """
-    from core.database import get_conn
-
     with get_conn() as conn:
         with conn.cursor() as cur:
-            # 1. 查余额
+            # 条件扣减：余额校验与扣款在同一条 UPDATE 中完成，余额不足时不命中任何行
             cur.execute(
-                "SELECT merchant_balance FROM users WHERE id=%s",
-                (merchant_id,)
+                "UPDATE users SET merchant_balance=merchant_balance-%s WHERE id=%s AND merchant_balance>=%s",
+                (amount, merchant_id, amount)
             )
-            row = cur.fetchone()
-            if not row or Decimal(str(row["merchant_balance"] or 0)) < amount:
+            if cur.rowcount != 1:
                 return False
-
-            # 2. 扣余额
-            cur.execute(
-                "UPDATE users SET merchant_balance=merchant_balance-%s WHERE id=%s",
-                (amount, merchant_id)
-            )
             conn.commit()
             return True
 
@@ -8457,8 +8482,6 @@ def settle_to_merchant(amount: Decimal, merchant_id: int = 1):
         amount: 结算金额
         merchant_id: 商家ID，默认为1
     """
-    from core.database import get_conn
-
     with get_conn() as conn:
         with conn.cursor() as cur:
             # 修改为更新 users 表中的 merchant_balance 字段
@@ -8471,49 +8494,26 @@ def settle_to_merchant(amount: Decimal, merchant_id: int = 1):
 
 def generate_statement():
     """生成商家日账单"""
-    from core.database import get_conn
-    from datetime import date, timedelta
-
     with get_conn() as conn:
         with conn.cursor() as cur:
             yesterday = date.today() - timedelta(days=1)
+            day_lo, day_hi = _date_range(yesterday, yesterday)
 
-            # 动态构造 SELECT 语句
-            select_sql = build_dynamic_select(
-                cur,
-                "merchant_statement",
-                where_clause="merchant_id=1 AND date<%s",
-                order_by="date DESC",
-                limit="1"
-            )
-
-            # 获取期初余额
-            cur.execute(select_sql, (yesterday,))
-            row = cur.fetchone()
-            opening = Decimal(str(row["closing_balance"])) if row and row.get(
-                "closing_balance") is not None else Decimal("0")
-
-            # 获取当日收入（从 account_flow 表查询）
-            cur.execute(
-                """SELECT SUM(change_amount) AS income FROM account_flow 
-                   WHERE account_type='merchant_balance' AND flow_type='income' AND DATE(created_at)=%s""",
-                (yesterday,)
-            )
-            income = cur.fetchone()["income"] or Decimal("0")
-
-            # 当日提现（简化处理，实际应从提现表中查询）
-            withdraw_amount = Decimal("0")
-
-            # 计算期末余额
-            closing = opening + income - withdraw_amount
-
-            # 插入或更新账单
+            # 期初余额（上一份账单的期末余额）与当日收入（account_flow）在库内计算，一次写入账单
+            # 当日提现（简化处理，实际应从提现表中查询）记为 0
             cur.execute(
                 """INSERT INTO merchant_statement(merchant_id,date,opening_balance,income,withdraw,closing_balance)
-                   VALUES(%s,%s,%s,%s,%s,%s) ON DUPLICATE KEY UPDATE
+                   SELECT 1, %s, s.opening, s.income, 0, s.opening + s.income
+                   FROM (
+                       SELECT COALESCE((SELECT closing_balance FROM merchant_statement
+                                        WHERE merchant_id=1 AND date<%s
+                                        ORDER BY date DESC LIMIT 1), 0) AS opening,
+                              COALESCE((SELECT SUM(change_amount) FROM account_flow
+                                        WHERE account_type='merchant_balance' AND flow_type='income'
+                                        AND created_at >= %s AND created_at < %s), 0) AS income
+                   ) s
+                   ON DUPLICATE KEY UPDATE
                    opening_balance=VALUES(opening_balance),income=VALUES(income),withdraw=VALUES(withdraw),closing_balance=VALUES(closing_balance)""",
-                (1, yesterday, opening, income, withdraw_amount, closing)
+                (yesterday, yesterday, day_lo, day_hi)
             )
             conn.commit()
-
-
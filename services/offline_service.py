@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from typing import Optional, Union, TYPE_CHECKING, Any
 import os
 import json
+import secrets
 
 if TYPE_CHECKING:
     from wechatpayv3 import WeChatPay  # 仅为静态检查服务
@@ -26,6 +27,11 @@ from cryptography.hazmat.backends import default_backend
 
 logger = get_logger(__name__)
 
+
+def _new_order_no() -> str:
+    """线下订单号：OFF + 本地时间 yyyymmddHHMMSS + 6 位随机十六进制"""
+    return f"OFF{datetime.now():%Y%m%d%H%M%S}{secrets.token_hex(3)}"
+
 def _load_cert_serial_no(cert_path: str) -> str:
     try:
         path = Path(cert_path)
@@ -79,6 +85,19 @@ else:
     wxpay: WeChatPay | None = None
 
 
+def _check_qrcode_refreshable(cur, order_no: str, merchant_id: str) -> None:
+    """校验订单可刷新收款码（存在、待支付、未刷新过），否则抛 ValueError"""
+    cur.execute(
+        "SELECT refresh_count, status FROM offline_order WHERE order_no=%s AND merchant_id=%s",
+        (order_no, merchant_id)
+    )
+    row = cur.fetchone()
+    if not row or row["status"] != 1:
+        raise ValueError("订单不存在或状态异常")
+    if row["refresh_count"] >= 1:
+        raise ValueError("收款码已刷新一次，请重新创建订单")
+
+
 class OfflineService:
     # ---------- 1. 创建线下支付单 ----------
     @staticmethod
@@ -91,10 +110,9 @@ class OfflineService:
             invite_code: str = "",
             user_id: Optional[int] = None,
     ) -> dict:
-        import uuid
         # 当前登录用户（UUID 字符串）即为商户号
         current_user_id = str(user_id)  # Bearer UUID
-        order_no = f"OFF{datetime.now().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:6]}"
+        order_no = _new_order_no()
         expire = datetime.now() + timedelta(seconds=settings.qrcode_expire_seconds)
         path = f"pages/offline/pay?orderNo={order_no}&channel=1"
         scene = f"o={order_no}"
@@ -122,34 +140,29 @@ class OfflineService:
         expire = datetime.now() + timedelta(seconds=settings.qrcode_expire_seconds)
         current_user_id = str(user_id)
 
+        # 1. 预检：订单不存在、状态异常或已刷新过时直接返回，不消耗微信小程序码接口配额
         with get_conn() as conn:
             with conn.cursor(pymysql.cursors.DictCursor) as cur:
-                # 1. 查询当前状态（注意 status 后面要有空格或换行）
-                cur.execute(
-                    "SELECT refresh_count, status "  # ← 注意这里加了一个空格
-                    "FROM offline_order "
-                    "WHERE order_no=%s AND merchant_id=%s",
-                    (order_no, current_user_id)
-                )
-                row = cur.fetchone()
+                _check_qrcode_refreshable(cur, order_no, current_user_id)
 
-                if not row or row["status"] != 1:
-                    raise ValueError("订单不存在或状态异常")
-                if row["refresh_count"] >= 1:
-                    raise ValueError("收款码已刷新一次，请重新创建订单")
-
-                # 2. 生成新二维码
-                path = f"pages/offline/pay?orderNo={order_no}&channel=1"  # ← 修正了括号错误 ${...} → {...}
-                scene = f"o={order_no}"
-                new_qrcode_b64 = base64.b64encode(await get_wxacode(path=path, scene=scene)).decode()
+        # 2. 生成新二维码（不占用数据库连接等待微信接口）
+        path = f"pages/offline/pay?orderNo={order_no}&channel=1"
+        scene = f"o={order_no}"
+        new_qrcode_b64 = base64.b64encode(await get_wxacode(path=path, scene=scene)).decode()
 
-                # 3. 【关键缺失】更新数据库
+        with get_conn() as conn:
+            with conn.cursor(pymysql.cursors.DictCursor) as cur:
+                # 3. 条件更新：状态与刷新次数校验放进同一条 UPDATE，并发刷新时只有一个能命中
                 cur.execute(
                     "UPDATE offline_order "
                     "SET qrcode_url=%s, qrcode_expire=%s, refresh_count=refresh_count+1 "
-                    "WHERE order_no=%s AND merchant_id=%s",
+                    "WHERE order_no=%s AND merchant_id=%s AND status=1 AND refresh_count<1",
                     (f"data:image/png;base64,{new_qrcode_b64}", expire, order_no, current_user_id)
                 )
+                if cur.rowcount != 1:
+                    # 预检之后被并发刷新或状态已变化：再查一次给出具体原因
+                    _check_qrcode_refreshable(cur, order_no, current_user_id)
+                    raise ValueError("收款码已刷新一次，请重新创建订单")
                 conn.commit()
 
         return {"qrcode_b64": new_qrcode_b64, "expire_at": expire}
@@ -178,7 +191,7 @@ class OfflineService:
                     raise ValueError("订单不存在")
 
                 svc = FinanceService()
-                coupons = svc.list_available(user_id, order["amount"])
+                coupons = svc.list_available(user_id, order["amount"], cur=cur)
                 for c in coupons:
                     c["amount"] = float(c["amount"])
 
@@ -239,7 +252,7 @@ class OfflineService:
                 # 2. 验证并应用优惠券（支持多张叠加）
                 if target_coupon_ids:
                     fs = FinanceService()
-                    coupons = fs.get_user_coupons(user_id=user_id, status='unused')
+                    coupons = fs.get_user_coupons(user_id=user_id, status='unused', cur=cur)
                     coupon_by_id = {int(c["id"]): c for c in coupons}
 
                     total_discount = 0
@@ -319,11 +332,11 @@ class OfflineService:
                 coupon_discount=Decimal(coupon_discount) / 100
             )
             # 生成模拟支付参数（与线上订单保持一致）
-            import uuid, time
+            import time
             pay_params = {
                 "appId": settings.WECHAT_APP_ID,
                 "timeStamp": str(int(time.time())),
-                "nonceStr": uuid.uuid4().hex,
+                "nonceStr": secrets.token_hex(16),
                 "package": "prepay_id=ZERO_ORDER",
                 "signType": "RSA",
                 "paySign": "ZERO_ORDER_SIGN"
@@ -355,9 +368,9 @@ class OfflineService:
                 prepay_id = f"MOCK_PREPAY_{int(datetime.now().timestamp())}_{user_id}"
 
                 # 生成 Mock 支付参数（使用 RSA 签名格式，但值为 mock）
-                import uuid, time
+                import time
                 timestamp = str(int(time.time()))
-                nonce_str = uuid.uuid4().hex
+                nonce_str = secrets.token_hex(16)
 
                 pay_params = {
                     "appId": settings.WECHAT_APP_ID,
@@ -443,23 +456,29 @@ class OfflineService:
                     where_clause = "WHERE user_id=%s"
                     params = (current_user_id, size, offset)
 
-                # 查询总数
-                count_sql = f"SELECT COUNT(*) as total FROM offline_order {where_clause}"
-                cur.execute(count_sql, (params[0],))
-                total = cur.fetchone()["total"]
-
-                # 查询分页数据
+                # 分页数据 + 总数合并为一次查询：COUNT(*) OVER () 在分页前对整个结果集计数
                 data_sql = (
                     "SELECT order_no,store_name,amount,paid_amount,status,"
-                    "coupon_id,coupon_discount,created_at,pay_time "
+                    "coupon_id,coupon_discount,created_at,pay_time,"
+                    "COUNT(*) OVER () AS total "
                     f"FROM offline_order {where_clause} "
                     "ORDER BY id DESC LIMIT %s OFFSET %s"
                 )
                 cur.execute(data_sql, params)
                 rows = cur.fetchall()
 
+                if rows:
+                    total = rows[0]["total"]
+                elif offset > 0:
+                    # 页码越界时明细为空，窗口计数随之丢失，此时再补一次计数查询
+                    cur.execute(f"SELECT COUNT(*) as total FROM offline_order {where_clause}", (params[0],))
+                    total = cur.fetchone()["total"]
+                else:
+                    total = 0
+
                 # 格式化金额（分转元）
                 for row in rows:
+                    del row["total"]
                     row["amount_yuan"] = row["amount"] / 100 if row["amount"] else 0
                     row["paid_amount_yuan"] = row["paid_amount"] / 100 if row.get("paid_amount") else 0
                     row["coupon_discount_yuan"] = row["coupon_discount"] / 100 if row.get("coupon_discount") else 0
@@ -874,7 +893,6 @@ class OfflineService:
         :param coupon_ids: 多张优惠券ID（可选）
         :return: 订单号
         """
-        import uuid
         # ----- 新增：查询商家店铺名称 -----
         store_name = "默认店铺"  # 兜底值
         with get_conn() as conn:
@@ -884,7 +902,7 @@ class OfflineService:
                 if row:
                     store_name = row['store_name']
         # ------------------------------
-        order_no = f"OFF{datetime.now().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:6]}"
+        order_no = _new_order_no()
         merged = OfflineService._merge_offline_coupon_ids(coupon_ids=coupon_ids, coupon_id=coupon_id)
         primary = merged[0] if merged else None
         coupon_ids_json = json.dumps(merged) if merged else None
@@ -1,15 +1,17 @@
 import uuid
 import bcrypt
-from typing import Optional, Dict, Any
+import pymysql
+import functools
+from typing import Optional, Dict, Any, Tuple
 from enum import IntEnum
 from core.database import get_conn
-from core.table_access import build_dynamic_select, _quote_identifier, build_select_list
+from core.table_access import build_dynamic_select, get_table_structure, _quote_identifier, build_select_list
 from core.db_adapter import build_in_placeholders
 import string
-import random
+import secrets
 from core.logging import get_logger
 import os
-from core.config import AVATAR_UPLOAD_DIR
+from core.config import AVATAR_UPLOAD_DIR, BCRYPT_ROUNDS
 from fastapi import UploadFile, HTTPException
 from typing import List
 from pathlib import Path
@@ -27,20 +29,94 @@ class UserStatus(IntEnum):
 
 
 def hash_pwd(pwd: str) -> str:
-    """密码加密"""
-    return bcrypt.hashpw(pwd.encode(), bcrypt.gensalt()).decode()
+    """密码加密（成本因子取 BCRYPT_ROUNDS）"""
+    return bcrypt.hashpw(pwd.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+
+# 无密码账号（如微信注册用户）的占位哈希：非 bcrypt 格式，任何密码都无法校验通过
+LOCKED_PWD_HASH = "!"
+
+# 登录时手机号不存在也用它做一次 bcrypt 校验，避免通过响应耗时枚举已注册手机号
+_DUMMY_PWD_HASH = hash_pwd(secrets.token_hex(16))
 
 
 def verify_pwd(pwd: str, hashed: str) -> bool:
-    """密码校验"""
+    """密码校验（占位哈希直接拒绝，不做 bcrypt 计算）"""
+    if not hashed or hashed.startswith(LOCKED_PWD_HASH):
+        return False
     return bcrypt.checkpw(pwd.encode(), hashed.encode())
 
 
+def pwd_needs_rehash(hashed: str) -> bool:
+    """哈希的成本因子与当前 BCRYPT_ROUNDS 不一致时返回 True（格式 $2b$NN$...）"""
+    try:
+        return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+def rehash_pwd_if_needed(user_id: int, pwd: str, hashed: str) -> None:
+    """登录校验通过后，按当前成本因子重算并回写旧哈希（先算哈希再取连接）"""
+    if not pwd_needs_rehash(hashed):
+        return
+    new_hash = hash_pwd(pwd)
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE users SET password_hash=%s WHERE id=%s AND password_hash=%s",
+                        (new_hash, user_id, hashed))
+            conn.commit()
+
+
+# 推荐码字符表：去掉 0O1I 后恰好 32 个字符，随机字节取低 5 位即可均匀映射
+_CODE_ALPHABET = bytes(c for c in (string.ascii_uppercase + string.digits).encode() if c not in b"O0I1")
+
+
 def _generate_code(length: int = 6) -> str:
     """生成 6 位不含 0O1I 的随机码"""
-    chars = string.ascii_uppercase.replace('O', '').replace('I', '') + \
-            string.digits.replace('0', '').replace('1', '')
-    return ''.join(random.choices(chars, k=length))
+    return bytes(_CODE_ALPHABET[b & 31] for b in secrets.token_bytes(length)).decode()
+
+
+# 登录只取校验所需的窄列，按 mobile 单点查询
+_LOGIN_SQL = "SELECT id, password_hash, member_level, status FROM users WHERE mobile=%s LIMIT 1"
+
+# 推荐码撞唯一索引时的最大重试次数
+_REFERRAL_CODE_RETRIES = 5
+
+
+# 新用户行的固定初始值；其余列由调用方按业务传入，未给出的列插入 NULL
+_USER_ROW_DEFAULTS: Dict[str, Any] = {
+    "member_points": 0,
+    "merchant_points": 0,
+    "withdrawable_balance": 0,
+    "status": int(UserStatus.NORMAL),
+}
+
+
+@functools.lru_cache(maxsize=32)
+def _insert_users_sql(insert_cols: Tuple[str, ...]) -> str:
+    """按列组合生成 users 插入语句（列组合随表结构几乎不变，缓存复用）"""
+    cols_sql = ",".join([_quote_identifier(c) for c in insert_cols])
+    placeholders = ",".join(["%s"] * len(insert_cols))
+    return f"INSERT INTO {_quote_identifier('users')}({cols_sql}) VALUES ({placeholders})"
+
+
+def _insert_user_row(cur, insert_cols: List[str], row: Dict[str, Any]) -> int:
+    """按 insert_cols 插入 users 行并返回新 id；row 中未给出的列取 _USER_ROW_DEFAULTS 或 NULL。
+
+    推荐码不预先 SELECT 查重，直接插入；撞上 uk_referral_code 唯一索引时换码重试。
+    """
+    sql = _insert_users_sql(tuple(insert_cols))
+    vals = [row.get(c, _USER_ROW_DEFAULTS.get(c)) for c in insert_cols]
+    code_idx = insert_cols.index("referral_code") if "referral_code" in insert_cols else None
+    for _ in range(_REFERRAL_CODE_RETRIES):
+        try:
+            cur.execute(sql, tuple(vals))
+            return cur.lastrowid
+        except pymysql.err.IntegrityError as e:
+            if code_idx is None or e.args[0] != 1062 or "referral_code" not in str(e):
+                raise
+            vals[code_idx] = _generate_code()
+    raise RuntimeError("推荐码生成失败，请重试")
 
 
 class UserService:
@@ -48,6 +124,9 @@ class UserService:
     def register(mobile: str, pwd: str, name: Optional[str] = None,
                  referrer_mobile: Optional[str] = None) -> int:
         """用户注册（防自绑定/防注销/防无效推荐人）"""
+        # 密码哈希为纯 CPU 计算，放在取连接之前，避免占用连接池
+        pwd_hash = hash_pwd(pwd)
+
         with get_conn() as conn:
             with conn.cursor() as cur:
                 # ========== 1. 基础验证 ==========
@@ -87,88 +166,37 @@ class UserService:
                     referrer_id = ref["id"]
                     logger.info(f"注册绑定推荐人: 推荐人ID={referrer_id}, 被推荐人手机={mobile}")
 
-                # ========== 3. 密码处理 ==========
-                pwd_hash = hash_pwd(pwd)
-
-                # ========== 4. 动态列检查 ==========
-                cur.execute("SHOW COLUMNS FROM users")
-                cols = [r["Field"] for r in cur.fetchall()]
+                # ========== 3. 动态列检查 ==========
+                cols = get_table_structure(cur, "users")["fields"]
                 desired = [
                     "mobile", "password_hash", "name",
                     "member_points", "merchant_points", "withdrawable_balance",
-                    "status", "referral_code"
+                    "status", "referral_code", "referral_id"
                 ]
                 insert_cols = [c for c in desired if c in cols]
                 if "mobile" not in insert_cols or "password_hash" not in insert_cols:
                     raise RuntimeError("数据库 users 表缺少必要字段，请检查表结构")
 
-                # ========== 5. 生成唯一推荐码 ==========
-                code = None
-                if "referral_code" in insert_cols:
-                    while True:
-                        code = _generate_code()
-                        # 绕过 build_dynamic_select，直接写合法 SQL
-                        cur.execute(
-                            "SELECT 1 FROM users WHERE referral_code=%s LIMIT 1",
-                            (code,)
-                        )
-                        if not cur.fetchone():  # 没冲突即可用
-                            break
-
-                # ========== 6. 组装插入语句 ==========
-                vals = []
-                for col in insert_cols:
-                    if col == "mobile":
-                        vals.append(mobile)
-                    elif col == "password_hash":
-                        vals.append(pwd_hash)
-                    elif col == "name":
-                        vals.append(name if name is not None else "微信用户")
-                    elif col in ("member_points", "merchant_points"):
-                        vals.append(0)
-                    elif col == "withdrawable_balance":
-                        vals.append(0)
-                    elif col == "status":
-                        vals.append(int(UserStatus.NORMAL))
-                    elif col == "referral_code":
-                        vals.append(code)
-                    else:
-                        vals.append(None)
-
-                cols_sql = ",".join([_quote_identifier(c) for c in insert_cols])
-                placeholders = ",".join(["%s"] * len(insert_cols))
-                sql = f"INSERT INTO {_quote_identifier('users')}({cols_sql}) VALUES ({placeholders})"
-                cur.execute(sql, tuple(vals))
-                uid = cur.lastrowid
-
-                # ========== 7. 绑定推荐人关系 ==========
+                # ========== 4. 生成推荐码（唯一性由插入时的唯一索引保证） ==========
+                code = _generate_code() if "referral_code" in insert_cols else None
+
+                # ========== 5. 插入用户 ==========
+                uid = _insert_user_row(cur, insert_cols, {
+                    "mobile": mobile,
+                    "password_hash": pwd_hash,
+                    "name": name if name is not None else "微信用户",
+                    "referral_code": code,
+                    "referral_id": referrer_id,
+                })
+
+                # ========== 6. 绑定推荐人关系 ==========
+                # users.referral_id 已随插入写入；user_referrals 表与 referral_id 字段由启动时
+                # database_setup 保证存在，这里不执行 DDL（DDL 会隐式提交，把注册拆成两个事务）
                 if referrer_id:
-                    # 创建推荐关系表（如果不存在）
-                    cur.execute("""
-                        CREATE TABLE IF NOT EXISTS user_referrals (
-                            id INT AUTO_INCREMENT PRIMARY KEY,
-                            user_id INT NOT NULL,
-                            referrer_id INT NOT NULL,
-                            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                            UNIQUE KEY uk_uid (user_id),
-                            KEY idx_referrer (referrer_id)
-                        )
-                    """)
-
-                    # 写入推荐关系
                     cur.execute(
                         "INSERT INTO user_referrals(user_id, referrer_id) VALUES (%s,%s)",
                         (uid, referrer_id)
                     )
-
-                    # 同步更新 users.referral_id 字段（用于快速查询）
-                    cur.execute("SHOW COLUMNS FROM users LIKE 'referral_id'")
-                    if not cur.fetchone():
-                        cur.execute(
-                            "ALTER TABLE users ADD COLUMN referral_id INT DEFAULT NULL COMMENT '推荐人ID'"
-                        )
-                    cur.execute("UPDATE users SET referral_id=%s WHERE id=%s", (referrer_id, uid))
-
                     logger.info(f"✅ 注册成功并绑定推荐人: 新用户ID={uid}, 推荐人ID={referrer_id}")
 
                 conn.commit()
@@ -207,20 +235,20 @@ class UserService:
     def login(mobile: str, pwd: str) -> dict:
         with get_conn() as conn:
             with conn.cursor() as cur:
-                select_sql = build_dynamic_select(
-                    cur, "users", where_clause="mobile=%s",
-                    select_fields=["id", "password_hash", "member_level", "status"])
-                cur.execute(select_sql, (mobile,))
+                cur.execute(_LOGIN_SQL, (mobile,))
                 row = cur.fetchone()
-                if not row or not verify_pwd(pwd, row["password_hash"]):
-                    raise ValueError("手机号或密码错误")
-                status = row["status"]
-                if status == UserStatus.FROZEN:
-                    raise ValueError("账号已被冻结，请联系客服")
-                if status == UserStatus.DELETED:
-                    raise ValueError("账号已注销")
-                token = str(uuid.uuid4())
-                return {"uid": row["id"], "level": row["member_level"], "token": token}
+        # 连接归还后再做 bcrypt 校验；手机号不存在时也对占位哈希校验一次，使响应耗时一致
+        ok = verify_pwd(pwd, row["password_hash"] if row else _DUMMY_PWD_HASH)
+        if not row or not ok:
+            raise ValueError("手机号或密码错误")
+        status = row["status"]
+        if status == UserStatus.FROZEN:
+            raise ValueError("账号已被冻结，请联系客服")
+        if status == UserStatus.DELETED:
+            raise ValueError("账号已注销")
+        rehash_pwd_if_needed(row["id"], pwd, row["password_hash"])
+        token = secrets.token_urlsafe(24)
+        return {"uid": row["id"], "level": row["member_level"], "token": token}
 
     @staticmethod
     def upgrade_one_star(mobile: str) -> int:
@@ -246,21 +274,21 @@ class UserService:
     def bind_referrer(mobile: str, referrer_mobile: str):
         with get_conn() as conn:
             with conn.cursor() as cur:
-                select_sql = build_dynamic_select(
-                    cur, "users", where_clause="mobile=%s", select_fields=["id"])
-                cur.execute(select_sql, (mobile,))
-                u = cur.fetchone()
-                if not u:
-                    raise ValueError("被推荐人不存在")
-                cur.execute(select_sql, (referrer_mobile,))
-                ref = cur.fetchone()
-                if not ref:
-                    raise ValueError("推荐人不存在")
+                # 按两个手机号直接取 id 写入推荐关系，一条语句完成；未写入时再区分是哪一方不存在
                 cur.execute(
-                    "INSERT INTO user_referrals(user_id, referrer_id) VALUES (%s,%s) "
-                    "ON DUPLICATE KEY UPDATE referrer_id=%s",
-                    (u["id"], ref["id"], ref["id"])
+                    "INSERT INTO user_referrals(user_id, referrer_id) "
+                    "SELECT u.id, r.id FROM users u JOIN users r ON r.mobile=%s WHERE u.mobile=%s "
+                    "ON DUPLICATE KEY UPDATE referrer_id=VALUES(referrer_id)",
+                    (referrer_mobile, mobile)
                 )
+                if cur.rowcount == 0:
+                    cur.execute("SELECT 1 FROM users WHERE mobile=%s LIMIT 1", (mobile,))
+                    if not cur.fetchone():
+                        raise ValueError("被推荐人不存在")
+                    cur.execute("SELECT 1 FROM users WHERE mobile=%s LIMIT 1", (referrer_mobile,))
+                    if not cur.fetchone():
+                        raise ValueError("推荐人不存在")
+                conn.commit()
 
     @staticmethod
     def set_level(mobile: str, new_level: int, reason: str = "后台手动调整"):
@@ -284,16 +312,9 @@ class UserService:
 
     @staticmethod
     def grant_merchant(mobile: str) -> bool:
+        # is_merchant 字段由启动时 database_setup 的 required_columns 保证存在
         with get_conn() as conn:
             with conn.cursor() as cur:
-                cur.execute("SHOW COLUMNS FROM users LIKE 'is_merchant'")
-                if not cur.fetchone():
-                    try:
-                        cur.execute(
-                            "ALTER TABLE users ADD COLUMN is_merchant TINYINT(1) NOT NULL DEFAULT 0")
-                        conn.commit()
-                    except Exception:
-                        return False
                 cur.execute("UPDATE users SET is_merchant=1 WHERE mobile=%s", (mobile,))
                 conn.commit()
                 return cur.rowcount > 0
@@ -302,9 +323,6 @@ class UserService:
     def is_merchant(mobile: str) -> bool:
         with get_conn() as conn:
             with conn.cursor() as cur:
-                cur.execute("SHOW COLUMNS FROM users LIKE 'is_merchant'")
-                if not cur.fetchone():
-                    return False
                 select_sql = build_dynamic_select(
                     cur, "users", where_clause="mobile=%s", select_fields=["is_merchant"])
                 cur.execute(select_sql, (mobile,))
@@ -981,8 +999,7 @@ class UserService:
         with get_conn() as conn:
             with conn.cursor() as cur:
                 # 动态获取表结构
-                cur.execute("SHOW COLUMNS FROM users")
-                user_cols = [r["Field"] for r in cur.fetchall()]
+                user_cols = get_table_structure(cur, "users")["fields"]
 
                 # 基础查询字段（四个点数）
                 select_fields = [
@@ -1,187 +1,105 @@
 # services/wechat_service.py - 微信登录服务
 import uuid
 import pymysql
-import jwt
-import datetime
 import requests
+import httpx
 import base64
 import json
 from Crypto.Cipher import AES
-from typing import Optional, Dict, Any,Tuple
+from typing import Optional, Tuple
 from fastapi import HTTPException
 
 from core.logging import get_logger
 from core.database import get_conn
 from core.config import WECHAT_APP_ID, WECHAT_APP_SECRET
-from core.table_access import build_dynamic_select, _quote_identifier
-from services.user_service import hash_pwd, UserStatus, _generate_code
+from core.table_access import get_table_structure
+from services.user_service import LOCKED_PWD_HASH, _generate_code, _insert_user_row
 
 logger = get_logger(__name__)
 
+# 微信占位手机号一次探测的候选数量（wx_xxx, wx_xxx_1 ... wx_xxx_8）
+_MOBILE_CANDIDATES = 9
+
+_SELECT_BY_OPENID_SQL = "SELECT id, member_level FROM users WHERE openid=%s LIMIT 1"
+
+# 调用 jscode2session 的共享客户端：保持到 api.weixin.qq.com 的长连接，省去每次登录的 TCP/TLS 握手
+_wx_client = httpx.AsyncClient(
+    timeout=10.0,
+    limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=300),
+)
+
+
 class WechatService:
     """微信登录服务"""
 
     @staticmethod
-    def ensure_openid_column():
-        """确保 users 表存在 openid 字段（兼容旧库）"""
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SHOW COLUMNS FROM users LIKE 'openid'")
-                exists = cur.fetchone()
-                if not exists:
-                    try:
-                        cur.execute("ALTER TABLE users ADD COLUMN openid VARCHAR(64) UNIQUE")
-                        conn.commit()
-                    except pymysql.err.InternalError as e:
-                        if e.args[0] == 1060:  # 字段已存在
-                            return
-                        raise
+    def get_or_create_user(openid: str, nick_name: str) -> Tuple[int, int, bool]:
+        """按 openid 取用户，不存在则注册；返回 (user_id, member_level, is_new)
 
-    @staticmethod
-    def check_user_by_openid(openid: str) -> Optional[Dict[str, Any]]:
-        """通过openid查询用户"""
+        查询与插入共用一个连接；并发回调同时注册同一 openid 时，后插入的一方撞上
+        uk_openid 唯一索引（database_setup 启动时保证存在），回滚后回查已有用户。
+        """
         with get_conn() as conn:
             with conn.cursor() as cur:
-                select_sql = build_dynamic_select(
-                    cur,
-                    "users",
-                    where_clause="openid=%s",
-                    select_fields=["id"]
-                )
-                cur.execute(select_sql, (openid,))
-                return cur.fetchone()
+                cur.execute(_SELECT_BY_OPENID_SQL, (openid,))
+                row = cur.fetchone()
+                if row:
+                    return row["id"], row["member_level"] or 0, False
+                try:
+                    uid = WechatService._insert_user(cur, openid, nick_name)
+                except pymysql.err.IntegrityError as e:
+                    if e.args[0] != 1062:
+                        raise
+                    conn.rollback()
+                    cur.execute(_SELECT_BY_OPENID_SQL, (openid,))
+                    row = cur.fetchone()
+                    if not row:
+                        raise
+                    return row["id"], row["member_level"] or 0, False
+                conn.commit()
+                return uid, 0, True
 
     @staticmethod
-    def register_user(openid: str, nick_name: str) -> int:
-        """为微信用户创建账号，自动生成必填字段"""
+    def _insert_user(cur, openid: str, nick_name: str) -> int:
+        """在调用方事务内插入微信用户（不提交），返回新用户 id"""
         # 生成占位手机号，保证唯一
         mobile = f"wx_{openid[:20]}"
-        pwd_hash = hash_pwd(uuid.uuid4().hex)
-
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                # 获取 users 表字段，动态构建插入语句以兼容老表
-                cur.execute("SHOW COLUMNS FROM users")
-                cols = [r["Field"] for r in cur.fetchall()]
-
-                desired = [
-                    "openid", "mobile", "password_hash", "name",
-                    "member_points", "merchant_points", "withdrawable_balance",
-                    "status", "referral_code"
-                ]
-                insert_cols = [c for c in desired if c in cols]
-
-                # 确保 mobile/password_hash 存在
-                if "mobile" not in insert_cols or "password_hash" not in insert_cols:
-                    raise RuntimeError("数据库 users 表缺少必要字段，请检查表结构")
-
-                # 如果支持 referral_code，则生成唯一推荐码
-                code = None
-                if "referral_code" in insert_cols:
-                    code = _generate_code()
-                    select_sql = build_dynamic_select(
-                        cur,
-                        "users",
-                        where_clause="referral_code=%s",
-                        select_fields=["1"]
-                    )
-                    cur.execute(select_sql, (code,))
-                    while cur.fetchone():
-                        code = _generate_code()
-                        select_sql = build_dynamic_select(
-                            cur,
-                            "users",
-                            where_clause="referral_code=%s",
-                            select_fields=["1"]
-                        )
-                        cur.execute(select_sql, (code,))
-
-                # 确保占位手机号不冲突
-                select_sql = build_dynamic_select(
-                    cur,
-                    "users",
-                    where_clause="mobile=%s",
-                    select_fields=["1"]
-                )
-                cur.execute(select_sql, (mobile,))
-                idx = 1
-                base_mobile = mobile
-                while cur.fetchone():
-                    mobile = f"{base_mobile}_{idx}"
-                    select_sql = build_dynamic_select(
-                        cur,
-                        "users",
-                        where_clause="mobile=%s",
-                        select_fields=["1"]
-                    )
-                    cur.execute(select_sql, (mobile,))
-                    idx += 1
-
-                vals = []
-                for col in insert_cols:
-                    if col == "openid":
-                        vals.append(openid)
-                    elif col == "mobile":
-                        vals.append(mobile)
-                    elif col == "password_hash":
-                        vals.append(pwd_hash)
-                    elif col == "name":
-                        vals.append(nick_name)
-                    elif col in ("member_points", "merchant_points"):
-                        vals.append(0)
-                    elif col == "withdrawable_balance":
-                        vals.append(0)
-                    elif col == "status":
-                        vals.append(int(UserStatus.NORMAL))
-                    elif col == "referral_code":
-                        vals.append(code)
-                    else:
-                        vals.append(None)
-
-                cols_sql = ",".join([_quote_identifier(c) for c in insert_cols])
-                placeholders = ",".join(["%s"] * len(insert_cols))
-                sql = f"INSERT INTO {_quote_identifier('users')}({cols_sql}) VALUES ({placeholders})"
-                cur.execute(sql, tuple(vals))
-                conn.commit()
-                return cur.lastrowid
-
-    @staticmethod
-    def get_openid_by_code(code: str) -> tuple[str, str]:
-        """通过code换取openid和session_key"""
-        # 延迟导入 requests，避免 Windows multiprocessing 导入问题
-        import requests
-        
-        if not WECHAT_APP_ID or not WECHAT_APP_SECRET:
-            raise HTTPException(status_code=500, detail="未配置微信小程序 AppId/Secret，请在 .env 中设置 WECHAT_APP_ID 与 WECHAT_APP_SECRET")
-
-        url = f"https://api.weixin.qq.com/sns/jscode2session?appid={WECHAT_APP_ID}&secret={WECHAT_APP_SECRET}&js_code={code}&grant_type=authorization_code"
-        response = requests.get(url)
-        if response.status_code != 200:
-            raise HTTPException(status_code=500, detail="微信接口调用失败")
-
-        wechat_data = response.json()
-        openid = wechat_data.get('openid')
-        session_key = wechat_data.get('session_key')
-
-        if not openid or not session_key:
-            error_msg = wechat_data.get('errmsg', '未知错误')
-            raise HTTPException(status_code=500, detail=f"无法获取openid或session_key: {error_msg}")
-
-        return openid, session_key
-
-    @staticmethod
-    def generate_token(user_id: int) -> str:
-        """生成JWT token"""
-        # 确保 payload 中不包含 Decimal 或其他不可序列化对象
-        uid = int(user_id)
-        exp_dt = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
-        exp_ts = int(exp_dt.timestamp())
-        payload = {
-            "user_id": uid,
-            "exp": exp_ts
-        }
-        token = jwt.encode(payload, "your_secret_key", algorithm="HS256")
-        return token
+        pwd_hash = LOCKED_PWD_HASH
+
+        # 获取 users 表字段，动态构建插入语句以兼容老表
+        cols = get_table_structure(cur, "users")["fields"]
+
+        desired = [
+            "openid", "mobile", "password_hash", "name",
+            "member_points", "merchant_points", "withdrawable_balance",
+            "status", "referral_code"
+        ]
+        insert_cols = [c for c in desired if c in cols]
+
+        # 确保 mobile/password_hash 存在
+        if "mobile" not in insert_cols or "password_hash" not in insert_cols:
+            raise RuntimeError("数据库 users 表缺少必要字段，请检查表结构")
+
+        # 如果支持 referral_code，则生成推荐码（唯一性由插入时的唯一索引保证）
+        code = _generate_code() if "referral_code" in insert_cols else None
+
+        # 确保占位手机号不冲突：一次查出候选号中已被占用的，取第一个空闲的
+        candidates = [mobile] + [f"{mobile}_{i}" for i in range(1, _MOBILE_CANDIDATES)]
+        cur.execute(
+            f"SELECT mobile FROM users WHERE mobile IN ({','.join(['%s'] * len(candidates))})",
+            tuple(candidates)
+        )
+        taken = {r["mobile"] for r in cur.fetchall()}
+        mobile = next((c for c in candidates if c not in taken),
+                      f"{mobile}_{uuid.uuid4().hex[:6]}")
+
+        return _insert_user_row(cur, insert_cols, {
+            "openid": openid,
+            "mobile": mobile,
+            "password_hash": pwd_hash,
+            "name": nick_name,
+            "referral_code": code,
+        })
 
     @staticmethod
     def generate_wxacode(scene: str, page: str = "pages/index/index") -> Optional[bytes]:
@@ -230,16 +148,29 @@ class WechatService:
             return None
 
     @staticmethod
-    def get_openid_by_code(code: str) -> Tuple[str, str]:
-        """code 换 openid 和 session_key"""
-        url = f"https://api.weixin.qq.com/sns/jscode2session?appid={WECHAT_APP_ID}&secret={WECHAT_APP_SECRET}&js_code={code}&grant_type=authorization_code"
-        resp = requests.get(url, timeout=10).json()
+    async def get_openid_by_code(code: str) -> Tuple[str, str]:
+        """code 换 openid 和 session_key（复用长连接客户端）"""
+        r = await _wx_client.get(
+            "https://api.weixin.qq.com/sns/jscode2session",
+            params={
+                "appid": WECHAT_APP_ID,
+                "secret": WECHAT_APP_SECRET,
+                "js_code": code,
+                "grant_type": "authorization_code",
+            },
+        )
+        resp = r.json()
 
         if "errcode" in resp and resp["errcode"] != 0:
             raise ValueError(f"微信接口错误: {resp.get('errmsg')}")
 
         return resp["openid"], resp["session_key"]
 
+    @staticmethod
+    async def close_http_client() -> None:
+        """关闭共享 HTTP 客户端（应用关闭时调用）"""
+        await _wx_client.aclose()
+
     @staticmethod
     def decrypt_phone_number(session_key: str, encrypted_data: str, iv: str) -> str:
         """AES解密微信手机号"""